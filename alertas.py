@@ -1,5 +1,28 @@
+"""
+Alertas por Telegram.
+
+- send_telegram_message: envio sincronico de un mensaje, un request por chat.
+- TelegramNotifier: envio en segundo plano para usar desde main.run. Las alertas de cada corrida se juntan en un solo
+  mensaje por chat y se encolan sin bloquear al bot. Un thread propio con un loop de asyncio las envia con una
+  sesion http persistente (httpx.AsyncClient), a todos los chats a la vez, respetando el retry_after de las
+  respuestas 429 de Telegram.
+
+https://core.telegram.org/bots/api#sendmessage
+https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+"""
+
+import asyncio
+import threading
+from collections import deque
+
+import httpx
 import requests
 
+import config
+
+# Largo maximo de un mensaje de Telegram
+MAX_LARGO = 4096
+
 
 def send_telegram_message(bot_token, message, chat_id_list):
     """
@@ -29,6 +52,158 @@ def send_telegram_message(bot_token, message, chat_id_list):
             print(f"Error al enviar mensaje de Telegram al chat_id {chat_id}: {e}")
 
 
+def partir(texto, largo=MAX_LARGO):
+    """ Divide un texto en mensajes de a lo sumo 'largo' caracteres, cortando en los saltos de linea. """
+    mensajes, actual = [], ''
+    for linea in texto.split('\n'):
+        while len(linea) > largo:  # una linea sola mas larga que el maximo
+            if actual:
+                mensajes.append(actual)
+                actual = ''
+            mensajes.append(linea[:largo])
+            linea = linea[largo:]
+        if actual and len(actual) + 1 + len(linea) > largo:
+            mensajes.append(actual)
+            actual = linea
+        else:
+            actual = f'{actual}\n{linea}' if actual else linea
+    if actual:
+        mensajes.append(actual)
+    return mensajes
+
+
+class TelegramNotifier:
+    """
+    Envia las alertas a Telegram en segundo plano.
+
+    Uso desde main.run:
+        notifier = TelegramNotifier(BOT_TOKEN, CHAT_ID_LIST)
+        notifier.start()
+        ...
+        notifier.notify(to_telegram)  # no bloquea
+
+    La cola es acotada: si Telegram no responde y se llena se descartan los mensajes mas viejos. Si al enviar hay
+    varios mensajes pendientes (por ejemplo despues de esperar un retry_after) se juntan en uno.
+    """
+
+    def __init__(self, bot_token, chat_id_list, max_cola=config.TELEGRAM_COLA, reintentos=config.TELEGRAM_REINTENTOS,
+                 timeout=10, url='https://api.telegram.org'):
+        """
+        :param bot_token: Token del bot de Telegram
+        :param chat_id_list: Lista de chat_ids a los que se envian las alertas
+        :param max_cola: Cantidad maxima de mensajes pendientes
+        :param reintentos: Intentos por mensaje y chat ante errores de red, 5xx o 429
+        :param timeout: Segundos de espera de cada request
+        """
+        self.bot_token = bot_token
+        self.chat_id_list = [str(c) for c in chat_id_list if str(c)]
+        self.reintentos = reintentos
+        self.timeout = timeout
+        self.url = url
+
+        self.enviados = 0  # mensajes enviados (por chat)
+        self.fallidos = 0  # mensajes que no se pudieron enviar (por chat)
+        self.descartados = 0  # mensajes descartados por la cola llena
+
+        self._pendientes = deque(maxlen=max_cola)  # append y popleft son seguros entre threads
+        self._lock = threading.Lock()
+        self._loop = None
+        self._event = None
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Termina el thread despues de enviar lo pendiente (espera a lo sumo timeout segundos). """
+        self._stop = True
+        self._despertar()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self, alertas):
+        """
+        Encola las alertas de una corrida como un solo mensaje. No bloquea.
+
+        :param alertas: Lista de mensajes (o un mensaje)
+        """
+        if isinstance(alertas, str):
+            alertas = [alertas]
+        if not alertas or not self.chat_id_list:
+            return
+
+        with self._lock:
+            if len(self._pendientes) == self._pendientes.maxlen:
+                self.descartados += 1
+            self._pendientes.append('\n'.join(str(a) for a in alertas))
+        self._despertar()
+
+    def _despertar(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def _run(self):
+        self._event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+        async with httpx.AsyncClient(base_url=self.url, timeout=self.timeout) as client:
+            while True:
+                with self._lock:
+                    textos = list(self._pendientes)
+                    self._pendientes.clear()
+
+                if not textos:
+                    if self._stop:
+                        break
+                    await self._event.wait()
+                    self._event.clear()
+                    continue
+
+                for mensaje in partir('\n\n'.join(textos)):
+                    await asyncio.gather(*(self._enviar(client, chat_id, mensaje) for chat_id in self.chat_id_list))
+
+        self._loop = None
+
+    async def _enviar(self, client, chat_id, mensaje):
+        """ Envia un mensaje a un chat con reintentos. Devuelve True si se envio. """
+        body = {'chat_id': chat_id, 'text': mensaje, 'parse_mode': 'Markdown'}
+        espera = 1
+
+        for _ in range(self.reintentos):
+            try:
+                response = await client.post(f'/bot{self.bot_token}/sendMessage', json=body)
+            except httpx.HTTPError as e:
+                print(f"Error al enviar mensaje de Telegram al chat_id {chat_id}: {e}")
+                await asyncio.sleep(espera)
+                espera *= 2
+                continue
+
+            if response.status_code == 200:
+                self.enviados += 1
+                return True
+
+            if response.status_code == 429:  # limite de Telegram, indica cuantos segundos esperar
+                try:
+                    retry_after = response.json()['parameters']['retry_after']
+                except (ValueError, KeyError, TypeError):  # respuesta de un proxy o sin json
+                    retry_after = espera
+                await asyncio.sleep(retry_after)
+            elif response.status_code >= 500:
+                await asyncio.sleep(espera)
+                espera *= 2
+            elif response.status_code == 400 and 'parse_mode' in body:
+                body.pop('parse_mode')  # el mensaje tiene caracteres que Markdown no puede interpretar
+            else:
+                print(f"Error al enviar mensaje de Telegram al chat_id {chat_id}: {response.status_code} "
+                      f"{response.text}")
+                break
+
+        self.fallidos += 1
+        return False
+
+
 if __name__ == '__main__':
     """
     Sobre if __name__ == '__main__': 
@@ -59,3 +234,10 @@ if __name__ == '__main__':
     from keys import BOT_TOKEN, CHAT_ID_LIST
 
     send_telegram_message(BOT_TOKEN, 'Long BTC', CHAT_ID_LIST)
+
+    # En segundo plano: las alertas de una corrida llegan en un solo mensaje
+    notifier = TelegramNotifier(BOT_TOKEN, CHAT_ID_LIST)
+    notifier.start()
+    notifier.notify(['Abro posicion BTC-USDT-SWAP por cruce side long', 'Abro posicion ETH-USDT-SWAP por rsi side short'])
+    notifier.stop(timeout=30)
+    print(f"Enviados: {notifier.enviados}, fallidos: {notifier.fallidos}, descartados: {notifier.descartados}")
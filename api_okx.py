@@ -25,11 +25,20 @@ Lo que haremos con la api es:
 """
 import time
 import datetime
+import json
+import os
+import threading
 import uuid
 import base64
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
 import pandas as pd
 import pprint  # import print para poder imprimir los json de manera mas ordenada
 
+import lotes
+
 # Usaremos la libreria okx para interactuar con la api de okx
 from okx.Account import AccountAPI
 import okx.MarketData as MarketData
@@ -40,20 +49,95 @@ from keys import API_KEY, API_SECRET, PASSPHRASE
 
 
 # Configuración de la API
-def get_account_api(api_key, api_secret, passphrase, flag='1'):
+# Dominio de la api de OKX, se puede cambiar por un servidor local (ver benchmark.py)
+DOMAIN = 'https://www.okx.com'
+
+
+class _KeepAlive(httpx.Client):
+    """
+    Los clientes de python-okx son httpx.Client y crean el pool de conexiones con los limites por defecto de httpx,
+    que cierra las conexiones despues de 5 segundos sin uso. Esta clase se agrega en la herencia entre el cliente de
+    OKX y httpx.Client y le pasa al constructor los limites con keepalive_expiry.
+    """
+    keepalive_expiry = 5
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('limits', httpx.Limits(keepalive_expiry=self.keepalive_expiry))
+        super().__init__(*args, **kwargs)
+
+
+def _client_class(cls, keepalive_expiry=None):
+    """ Clase del cliente de OKX, con keepalive_expiry segundos de keep-alive si se indica (ver _KeepAlive). """
+    if keepalive_expiry is None:
+        return cls
+    return type(cls.__name__, (cls, _KeepAlive), {'keepalive_expiry': keepalive_expiry})
+
+
+def get_account_api(api_key, api_secret, passphrase, flag='1', domain=DOMAIN, keepalive_expiry=None):
     """Inicializa y retorna una instancia de AccountAPI."""
     # flag = "1"  # live trading: 0, demo trading: 1
-    return AccountAPI(api_key, api_secret, passphrase, flag=flag, debug=False)
+    return _client_class(AccountAPI, keepalive_expiry)(api_key, api_secret, passphrase, flag=flag, domain=domain,
+                                                       debug=False)
 
 
-def get_account_md_api(flag='1'):
+def get_account_md_api(flag='1', domain=DOMAIN, keepalive_expiry=None):
     """Inicializa y retorna una instancia de MarketAPI."""
-    return MarketData.MarketAPI(flag=flag, debug=False)
+    return _client_class(MarketData.MarketAPI, keepalive_expiry)(flag=flag, domain=domain, debug=False)
 
 
-def get_account_trade_api(api_key, api_secret, passphrase, flag='1'):
+def get_account_trade_api(api_key, api_secret, passphrase, flag='1', domain=DOMAIN, keepalive_expiry=None):
     """Inicializa y retorna una instancia de TradeAPI."""
-    return TradeAPI(api_key, api_secret, passphrase, flag=flag, debug=False)
+    return _client_class(TradeAPI, keepalive_expiry)(api_key, api_secret, passphrase, flag=flag, domain=domain,
+                                                     debug=False)
+
+
+# Limites de requests por endpoint: (cantidad de requests, ventana en segundos)
+# https://www.okx.com/docs-v5/en/#order-book-trading-market-data-get-candlesticks -> 40 requests cada 2 segundos
+# https://www.okx.com/docs-v5/en/#order-book-trading-market-data-get-candlesticks-history -> 20 requests cada 2 segundos
+RATE_LIMITS = {
+    'candles': (40, 2),
+    'history_candles': (20, 2),
+}
+
+
+class TokenBucket:
+    """
+    Limitador de requests tipo token bucket, seguro para usar desde varios threads.
+
+    El bucket arranca lleno con 'capacity' tokens y se recarga a razon de capacity / period tokens por segundo.
+    Cada request consume un token, si no hay tokens disponibles se espera lo necesario.
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Consume un token, bloqueando hasta que haya uno disponible. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+_rate_limiters = {endpoint: TokenBucket(*limit) for endpoint, limit in RATE_LIMITS.items()}
+
+
+def rate_limit(endpoint):
+    """ Espera hasta poder hacer un request al endpoint segun RATE_LIMITS. """
+    _rate_limiters[endpoint].acquire()
 
 
 # Funciones de utilidad
@@ -86,7 +170,7 @@ def get_instruments(account_api, instType='SWAP'):
     return instruments.get('data', [])
 
 
-def get_data_instruments(account_api, tickers, instType='SWAP'):
+def get_data_instruments(account_api, tickers, instType='SWAP', ttl=0, snapshot_file=None):
     """
     Obtiene datos específicos de los instrumentos seleccionados.
 
@@ -112,59 +196,137 @@ def get_data_instruments(account_api, tickers, instType='SWAP'):
 
     https://www.okx.com/es-es/trade-market/info/swap
 
+    Estos datos casi nunca cambian, por lo que se pueden guardar en cache (ver get_instruments_index).
+
     :param account_api: Instancia de AccountAPI
     :param tickers: Lista de tickers de interés
     :param instType: Tipo de instrumento (por defecto SWAP)
+    :param ttl: Segundos que se reutiliza la lista de instrumentos (por defecto 0, sin cache)
+    :param snapshot_file: Archivo json donde se guarda la lista para los reinicios del bot (opcional)
     :return: Diccionario con datos de los instrumentos
     """
 
-    instruments = get_instruments(account_api=account_api, instType=instType)
-
-    data = {}
-    for i in instruments:
-        if i['instId'] in tickers:
-            data[i['instId']] = {
-                'instId': i['instId'],
-                'ctVal': float(i['ctVal']),
-                'minSz': float(i['minSz']),
-                'lotSz': float(i['lotSz'])
-            }  # generamos el diccionario con los datos de los instrumentos
+    index = get_instruments_index(account_api, instType=instType, ttl=ttl, snapshot_file=snapshot_file)
 
     # podriamos tambien entregar el max leverage, etc...
 
-    return data
+    return {t: index[t] for t in tickers if t in index}
 
 
-def set_leverage(account_api, instId, lever, mgnMode='isolated'):
+# Cache de instrumentos por instType: {instType: (timestamp, {instId: datos})}
+_instruments_cache = {}
+
+
+def get_instruments_index(account_api, instType='SWAP', ttl=0, snapshot_file=None):
+    """
+    Devuelve los datos de todos los instrumentos en un diccionario con el instId como clave.
+
+    La lista se guarda en memoria durante ttl segundos. Si se indica snapshot_file tambien se guarda en disco, asi
+    al reiniciar el bot no hace falta descargarla mientras no haya vencido.
+
+    :param account_api: Instancia de AccountAPI
+    :param instType: Tipo de instrumento (por defecto SWAP)
+    :param ttl: Segundos que se reutiliza la lista (0 = descargar siempre)
+    :param snapshot_file: Archivo json para guardar la lista (opcional)
+    :return: Diccionario {instId: {'instId', 'ctVal', 'minSz', 'lotSz', 'tickSz', 'lotEscala', 'lotPaso'}}, con
+             lotEscala y lotPaso para ajustar las cantidades al lotSz (ver lotes.lot_step)
+    """
+    now = time.time()
+
+    cache = _instruments_cache.get(instType)
+    if cache is None and ttl and snapshot_file and os.path.exists(snapshot_file):
+        with open(snapshot_file) as f:
+            snapshot = json.load(f)
+        if snapshot.get('instType') == instType:
+            cache = (snapshot['time'], snapshot['data'])
+
+    if cache is not None and now - cache[0] < ttl:
+        _instruments_cache[instType] = cache
+        return cache[1]
+
+    index = {}
+    for i in get_instruments(account_api=account_api, instType=instType):
+        escala, paso = lotes.lot_step(i['lotSz'])
+        index[i['instId']] = {
+            'instId': i['instId'],
+            'ctVal': float(i['ctVal']),
+            'minSz': float(i['minSz']),
+            'lotSz': float(i['lotSz']),
+            'tickSz': float(i['tickSz']),
+            'lotEscala': escala,
+            'lotPaso': paso
+        }  # generamos el diccionario con los datos de los instrumentos
+
+    _instruments_cache[instType] = (now, index)
+
+    if snapshot_file:
+        with open(snapshot_file, 'w') as f:
+            json.dump({'time': now, 'instType': instType, 'data': index}, f)
+
+    return index
+
+
+# Leverage conocido de cada (instId, mgnMode, posSide), ver set_leverage
+_leverage_cache = {}
+
+
+def _lever_str(lever):
+    """ Leverage como string normalizado, 5, 5.0, '5' y '5.00' dan '5' (OKX devuelve '5', la hoja puede dar 5.0) """
+    return f'{float(lever):g}'
+
+
+def set_leverage(account_api, instId, lever, mgnMode='isolated', cache=False):
     """
     https://www.okx.com/docs-v5/en/#trading-account-rest-api-get-leverage
 
     Establece el apalancamiento para un instrumento.
 
+    Con cache=True guardamos el leverage de cada lado (posSide) que conocemos del exchange. Si coincide con el
+    pedido no hacemos ningun request, por lo que en las corridas normales del bot no se consulta el leverage.
+    Se vuelve a consultar cuando cambia el leverage pedido (columna leverage de parametros) o si falla un seteo.
+
     :param account_api: Instancia de AccountAPI
     :param instId: ID del instrumento
     :param lever: Nivel de apalancamiento
     :param mgnMode: Modo de margen (por defecto 'isolated')
+    :param cache: Usar el leverage guardado para evitar requests (por defecto False)
     :return: True si se estableció correctamente, False en caso contrario
     """
 
-    lever = str(lever)
+    lever = _lever_str(lever)
+
+    if cache:
+        conocidos = [v for k, v in _leverage_cache.items() if k[0] == instId and k[1] == mgnMode]
+        if conocidos and all(v == lever for v in conocidos):
+            return True
 
     # Primero consultamos el leverage, y en caso necesario lo modificamos
     lever_actual = account_api.get_leverage(instId=instId, mgnMode=mgnMode)
     lever_actual = lever_actual.get('data', [])
     for i in lever_actual:
 
-        lever_side = i['lever']
+        lever_side = _lever_str(i['lever'])
+        _leverage_cache[(instId, mgnMode, i['posSide'])] = lever_side
+
         if lever != lever_side:
             data = account_api.set_leverage(instId=instId, lever=lever, mgnMode=mgnMode, posSide=i['posSide'])
 
             if data['code'] != '0':
+                clear_leverage_cache(instId)
                 return False
 
+            _leverage_cache[(instId, mgnMode, i['posSide'])] = lever
+
     return True
 
 
+def clear_leverage_cache(instId=None):
+    """ Borra el leverage guardado de un instrumento, o de todos si instId es None. """
+    for key in list(_leverage_cache.keys()):
+        if instId is None or key[0] == instId:
+            del _leverage_cache[key]
+
+
 def get_balance(account_api):
     """
     https://www.okx.com/docs-v5/en/#trading-account-rest-api-get-balance
@@ -238,54 +400,97 @@ def get_positions_dict(account_api, instType='SWAP'):
     return positions_dict
 
 
-def get_historical_prices(client_md, instId, bar='1m', limit=300):
+def get_historical_prices(client_md, instId, bar='1m', limit=300, after='', before='', history=False):
     """
     https://www.okx.com/docs-v5/en/#order-book-trading-market-data-get-candlesticks
 
     Obtiene los precios históricos de un instrumento.
 
+    La paginacion de OKX funciona con timestamps en milisegundos:
+    - after: devuelve las velas anteriores a ese timestamp
+    - before: devuelve las velas posteriores a ese timestamp
+
     :param client_md: Instancia de MarketDataAPI
     :param instId: ID del instrumento
     :param bar: Intervalo de tiempo (por defecto '1m')
     :param limit: Cantidad de datos a obtener (por defecto 300)
+    :param after: Timestamp en ms, trae velas anteriores (opcional)
+    :param before: Timestamp en ms, trae velas posteriores (opcional)
+    :param history: True para usar el endpoint history-candles, con velas desde hace años (maximo 100 por request)
     :return: DataFrame con los precios históricos
     """
-    data = client_md.get_candlesticks(instId, bar=bar, limit=limit)
-    return pd.DataFrame(data.get('data', []))
+    return pd.DataFrame(get_candles(client_md, instId, bar=bar, limit=limit, after=after, before=before,
+                                    history=history))
+
+
+def get_candles(client_md, instId, bar='1m', limit=300, after='', before='', history=False):
+    """
+    Igual que get_historical_prices pero devuelve las velas como las entrega OKX: lista de listas de strings
+    [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm], de la mas nueva a la mas vieja.
+    """
+    if history:
+        rate_limit('history_candles')
+        data = client_md.get_history_candlesticks(instId, after=after, before=before, bar=bar, limit=limit)
+    else:
+        rate_limit('candles')
+        data = client_md.get_candlesticks(instId, after=after, before=before, bar=bar, limit=limit)
+    return data.get('data', [])
+
+
+CANDLE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume', 'volCcy', 'volCcyQuote', 'confirm']
+
+
+def parse_candles(rows):
+    """
+    Convierte las velas de OKX en el DataFrame de get_historical_data_formatted.
+
+    En lugar de armar un DataFrame de strings y convertirlo (astype, to_datetime, set_index, sort_index y el filtro
+    de confirm generan varios DataFrames intermedios), decodificamos los strings directo a un array float64 y
+    armamos el DataFrame una sola vez. OKX devuelve las velas de la mas nueva a la mas vieja, por lo que alcanza con
+    recorrer el array al reves (vista, sin copia) para ordenarlas.
+
+    :param rows: Lista de velas [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm] (strings)
+    :return: DataFrame con las velas confirmadas, indice 'time' ascendente
+    """
+    n = len(rows)
+    if n == 0:
+        return pd.DataFrame()
+
+    valores = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=n * len(CANDLE_COLUMNS))
+    valores = valores.reshape(n, len(CANDLE_COLUMNS))[::-1]
+
+    tiempos = valores[:, 0].astype(np.int64)  # el timestamp en ms entra exacto en un float64
+    if n > 1 and not (tiempos[1:] > tiempos[:-1]).all():  # por si OKX no respeta el orden
+        orden = np.argsort(tiempos, kind='stable')
+        valores, tiempos = valores[orden], tiempos[orden]
 
+    confirmadas = valores[:, 8] == 1  # elimino la vela no confirmada
+    index = pd.DatetimeIndex(tiempos[confirmadas].astype('datetime64[ms]').astype('datetime64[ns]'), name='time')
 
-def get_historical_data_formatted(client_md, instId, bar='1m', limit=300):
+    return pd.DataFrame(valores[confirmadas, 1:], index=index, columns=CANDLE_COLUMNS[1:])
+
+
+def get_historical_data_formatted(client_md, instId, bar='1m', limit=300, after='', before='', history=False):
     """
     https://www.okx.com/docs-v5/en/#order-book-trading-market-data-get-candlesticks
 
-    Obtiene y formatea datos históricos de precios.
+    Obtiene y formatea datos históricos de precios (ver parse_candles).
 
     :param client_md: Instancia de MarketAPI
     :param instId: ID del instrumento
     :param bar: Intervalo de tiempo (por defecto '1m')
     :param limit: Número de velas a obtener (por defecto 300)
+    :param after: Timestamp en ms, trae velas anteriores (opcional)
+    :param before: Timestamp en ms, trae velas posteriores (opcional)
+    :param history: True para usar el endpoint history-candles
     :return: DataFrame con los datos históricos formateados
     """
 
-    df = get_historical_prices(client_md, instId, bar=bar, limit=limit)
-
-    if not df.empty:
-
-        columns = ['time', 'open', 'high', 'low', 'close', 'volume', 'volCcy', 'volCcyQuote', 'confirm']
-        df.columns = columns  # renombro las columnas
-        df = df.astype(float)  # convierto a float
+    rows = get_candles(client_md, instId, bar=bar, limit=limit, after=after, before=before, history=history)
+    return parse_candles(rows)
 
-        df['time'] = pd.to_datetime(df['time'], unit='ms')  # convierto el tiempo a datetime
-        df.set_index('time', inplace=True)
-        df.sort_index(inplace=True)  # ordeno el index por fecha
 
-        # elimino la vela no confirmada, es decir, la que es 0
-        df = df[df['confirm'] == 1]
-
-    return df
-
-
-def send_market_order(account_trade_api, instId, tdMode, ccy, clOrdId, side, posSide, ordType, sz):
+def send_market_order(account_trade_api, instId, tdMode, ccy, clOrdId, side, posSide, ordType, sz, attachAlgoOrds=None):
     """
     https://www.okx.com/docs-v5/en/#order-book-trading-trade-post-place-order
 
@@ -300,6 +505,7 @@ def send_market_order(account_trade_api, instId, tdMode, ccy, clOrdId, side, pos
     :param posSide: Lado de la posición (long o short)
     :param ordType: Tipo de orden (market)
     :param sz: Tamaño de la orden
+    :param attachAlgoOrds: Take profit y stop loss adjuntos a la orden (ver attach_tp_sl, opcional)
     :return: Respuesta de la API
     """
     return account_trade_api.place_order(
@@ -310,11 +516,42 @@ def send_market_order(account_trade_api, instId, tdMode, ccy, clOrdId, side, pos
         side=side,
         posSide=posSide,
         ordType=ordType,
-        sz=sz
+        sz=sz,
+        attachAlgoOrds=attachAlgoOrds
     )
 
 
-def api_open_position(instId, posSide, sz, account_trade_api):
+def format_price(price, tick):
+    """ Redondea un precio al tickSz del instrumento y lo devuelve como string, como lo pide OKX. """
+    if not tick:
+        return f'{price:.8g}'
+    decimales = len(f'{tick:.10f}'.rstrip('0').split('.')[1])
+    return f'{round(price / tick) * tick:.{decimales}f}'
+
+
+def attach_tp_sl(take_profit, stop_loss, tick=None):
+    """
+    https://www.okx.com/docs-v5/en/#order-book-trading-trade-post-place-order (attachAlgoOrds)
+
+    Take profit y stop loss para adjuntar a una orden de apertura. Cuando se ejecuta la orden OKX crea una orden
+    algo con los dos niveles, que cierra la posicion con una orden market (OrdPx -1) apenas el ultimo precio toca
+    alguno de los dos. Si se ejecuta uno el otro se cancela.
+
+    :param take_profit: Precio de disparo del take profit
+    :param stop_loss: Precio de disparo del stop loss
+    :param tick: tickSz del instrumento para redondear los precios (opcional)
+    :return: Lista para el parametro attachAlgoOrds
+    """
+    return [{'attachAlgoClOrdId': generate_unique_clordid(),
+             'tpTriggerPx': format_price(take_profit, tick),
+             'tpOrdPx': '-1',
+             'tpTriggerPxType': 'last',
+             'slTriggerPx': format_price(stop_loss, tick),
+             'slOrdPx': '-1',
+             'slTriggerPxType': 'last'}]
+
+
+def api_open_position(instId, posSide, sz, account_trade_api, attachAlgoOrds=None):
     """
     Abre una nueva posicion
 
@@ -322,6 +559,7 @@ def api_open_position(instId, posSide, sz, account_trade_api):
     :param posSide: Lado de la posición ('long' o 'short')
     :param sz: Tamaño de la orden
     :param account_trade_api: Instancia de TradeAPI
+    :param attachAlgoOrds: Take profit y stop loss adjuntos a la orden (ver attach_tp_sl, opcional)
     :return: Tupla con el ID de la orden y el código de respuesta
     """
 
@@ -335,7 +573,8 @@ def api_open_position(instId, posSide, sz, account_trade_api):
                               side='buy' if posSide == 'long' else 'sell',
                               posSide=posSide,
                               ordType='market',
-                              sz=sz)
+                              sz=sz,
+                              attachAlgoOrds=attachAlgoOrds)
 
     return clOrdId, order.get('code')
 
@@ -372,26 +611,126 @@ def api_close_position(instId, posSide, account_trade_api, clOrdId=None, mgnMode
     return clOrdId
 
 
-def get_data_order(account_trade_api, instId, clOrdId, close=False):
+# Cantidad maxima de ordenes por request del endpoint batch-orders de OKX
+BATCH_ORDERS_MAX = 20
+
+
+def api_open_positions(pedidos, account_trade_api, batch_size=BATCH_ORDERS_MAX):
+    """
+    https://www.okx.com/docs-v5/en/#order-book-trading-trade-post-place-multiple-orders
+
+    Abre varias posiciones enviando las ordenes market de a grupos de batch_size por request.
+
+    :param pedidos: Lista de tuplas (instId, posSide, sz) o (instId, posSide, sz, attachAlgoOrds) para adjuntar el
+                    take profit y stop loss (ver attach_tp_sl)
+    :param account_trade_api: Instancia de TradeAPI
+    :param batch_size: Ordenes por request (maximo 20, 1 = una orden por request con place_order)
+    :return: Lista de tuplas (clOrdId, code) en el mismo orden que pedidos, code es el sCode de cada orden
+    """
+    if batch_size <= 1:
+        return [api_open_position(*pedido[:3], account_trade_api, *pedido[3:]) for pedido in pedidos]
+
+    ordenes = []
+    for instId, posSide, sz, *adjuntos in pedidos:
+        orden = {'instId': instId,
+                 'tdMode': 'isolated',
+                 'ccy': 'USDT',
+                 'clOrdId': generate_unique_clordid(),
+                 'side': 'buy' if posSide == 'long' else 'sell',
+                 'posSide': posSide,
+                 'ordType': 'market',
+                 'sz': str(sz)}
+        if adjuntos and adjuntos[0]:
+            orden['attachAlgoOrds'] = adjuntos[0]
+        ordenes.append(orden)
+
+    codes = {}
+    batch_size = min(batch_size, BATCH_ORDERS_MAX)
+    for i in range(0, len(ordenes), batch_size):
+        grupo = ordenes[i:i + batch_size]
+        response = account_trade_api.place_multiple_orders(grupo)
+
+        # code '0' todas ok, '1' todas fallaron, '2' algunas fallaron. El resultado de cada orden esta en sCode
+        for d in response.get('data', []):
+            codes[d.get('clOrdId')] = d.get('sCode')
+        for o in grupo:
+            codes.setdefault(o['clOrdId'], response.get('code'))
+
+    return [(o['clOrdId'], codes[o['clOrdId']]) for o in ordenes]
+
+
+def api_close_positions(pedidos, account_trade_api, max_workers=8):
+    """
+    Cierra varias posiciones a la vez. OKX no tiene un endpoint batch para cerrar posiciones, por lo que enviamos
+    los cierres en paralelo con un pool de threads.
+
+    :param pedidos: Lista de tuplas (instId, posSide)
+    :param account_trade_api: Instancia de TradeAPI
+    :param max_workers: Cantidad maxima de cierres en vuelo (1 = secuencial)
+    :return: Lista con el clOrdId de cada cierre en el mismo orden que pedidos, None si el request fallo
+    """
+    def cerrar(pedido):
+        try:
+            return api_close_position(pedido[0], pedido[1], account_trade_api)
+        except Exception as e:
+            print(f"Error al cerrar la posicion {pedido[0]}: {e}")
+            return None
+
+    if max_workers <= 1 or len(pedidos) <= 1:
+        return [cerrar(p) for p in pedidos]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pedidos))) as executor:
+        return list(executor.map(cerrar, pedidos))
+
+
+# Estados finales de una orden, ya no va a cambiar
+ORDER_FINAL_STATES = ('filled', 'canceled', 'mmp_canceled')
+
+
+def get_data_order(account_trade_api, instId, clOrdId, close=False, first_delay=0.05, max_wait=5):
     """
     Obtiene los detalles de una orden.
 
+    Si la orden todavia no aparece o no esta ejecutada se vuelve a consultar con espera exponencial (first_delay,
+    el doble, etc), asi una orden market que se ejecuta enseguida no espera un segundo fijo.
+
     :param close: Caso verdadero tambien devuelve el pnl
     :param account_trade_api: Instancia de TradeAPI
     :param instId: ID del instrumento
     :param clOrdId: ID de la orden
-    :return: Diccionario con los datos de la orden
+    :param first_delay: Primera espera en segundos antes de reintentar
+    :param max_wait: Espera total maxima en segundos
+    :return: Diccionario con los datos de la orden, None si la orden no aparece en max_wait segundos
     """
-    data = account_trade_api.get_order(instId=instId, clOrdId=clOrdId)
-    data = data.get('data', [])
+    delay = first_delay
+    waited = 0
 
-    if not data:  # si no hay data, espero 1 segundo y vuelvo a consultar
-        time.sleep(1)
+    while True:
         data = account_trade_api.get_order(instId=instId, clOrdId=clOrdId)
         data = data.get('data', [])
 
-    data = data[0]
+        if (data and data[0].get('state') in ORDER_FINAL_STATES) or waited >= max_wait:
+            break
+
+        time.sleep(delay)  # si no hay data o no se ejecuto, espero y vuelvo a consultar
+        waited += delay
+        delay *= 2
+
+    if not data:
+        print(f"No se pudo consultar la orden {clOrdId} de {instId}")
+        return None
+
+    return parse_order(data[0], close)
+
 
+def parse_order(data, close=False):
+    """
+    Extrae los datos que usa el bot de una orden de OKX (respuesta de get_order o mensaje del canal orders).
+
+    :param data: Diccionario con la orden
+    :param close: Caso verdadero tambien devuelve el pnl
+    :return: Diccionario con execution_time, avg_price, contratos, fee (y pnl)
+    """
     r = {}
 
     if data:
@@ -409,6 +748,33 @@ def get_data_order(account_trade_api, instId, clOrdId, close=False):
     return r
 
 
+def get_close_order(account_trade_api, instId, posSide, desde_ms=None, limit=20):
+    """
+    https://www.okx.com/docs-v5/en/#order-book-trading-trade-get-order-history-last-7-days
+
+    Busca la orden que cerro una posicion sin que el bot la enviara, por ejemplo el take profit o stop loss adjunto
+    a la orden de apertura (ver attach_tp_sl). Es la orden ejecutada mas reciente del lado contrario a la posicion.
+
+    :param account_trade_api: Instancia de TradeAPI
+    :param instId: ID del instrumento
+    :param posSide: Lado de la posición ('long' o 'short')
+    :param desde_ms: Solo ordenes ejecutadas desde este timestamp en ms, la apertura de la posicion (opcional)
+    :param limit: Cantidad de ordenes del historial que se revisan
+    :return: Diccionario con los datos de la orden (ver parse_order, con pnl) o None si no se encontro
+    """
+    data = account_trade_api.get_orders_history(instType='SWAP', instId=instId, state='filled', limit=str(limit))
+    side = 'sell' if posSide == 'long' else 'buy'
+
+    for orden in data.get('data', []):  # de la mas nueva a la mas vieja
+        if orden.get('posSide') != posSide or orden.get('side') != side:
+            continue
+        if desde_ms is not None and int(orden['fillTime']) < desde_ms:
+            break
+        return parse_order(orden, close=True)
+
+    return None
+
+
 def get_data_open_position(account_trade_api, instId, clOrdId):
     """
     Retorna el execution_time, avx_price, fillSz, fee
@@ -416,7 +782,7 @@ def get_data_open_position(account_trade_api, instId, clOrdId):
     :param account_trade_api: Instancia de TradeAPI
     :param instId: ID del instrumento
     :param clOrdId: ID de la orden
-    :return: Diccionario con los datos de la orden
+    :return: Diccionario con los datos de la orden, None si no se pudo consultar (ver get_data_order)
     """
     return get_data_order(account_trade_api, instId, clOrdId)
 
@@ -428,7 +794,7 @@ def get_data_close_position(account_trade_api, instId, clOrdId):
     :param account_trade_api: Instancia de TradeAPI
     :param instId: ID del instrumento
     :param clOrdId: ID de la orden
-    :return: Diccionario con los datos de la orden
+    :return: Diccionario con los datos de la orden, None si no se pudo consultar (ver get_data_order)
     """
 
     return get_data_order(account_trade_api, instId, clOrdId, close=True)
@@ -0,0 +1,308 @@
+"""
+Archivo local de velas.
+
+Las velas que descarga el bot se guardan en disco, asi al reiniciar no hace falta volver a descargar las ultimas
+300 velas de cada ticker y el backtest (ver backtest.py) puede usar la historia sin consultar a OKX.
+
+El archivo es opcional: se usa solo si config.ARCHIVO_VELAS tiene una carpeta (por defecto None, no se guarda nada).
+
+Formato: un archivo binario por instId, bar y dia (UTC):
+
+    <root>/<instId>/<bar>/<YYYY-MM-DD>.f8
+
+Cada vela es un registro de 9 float64 (el timestamp en ms y las columnas de api_okx.get_historical_data_formatted),
+ordenados por fecha. Se lee con np.memmap sin copiar: leer un rango de un dia es una vista sobre el archivo mapeado
+en memoria, con la forma (9 x velas) de antes (la fila 0 es el timestamp).
+
+El archivo es de solo agregado: las velas posteriores a la ultima guardada del dia se escriben al final del archivo,
+sin leer ni reescribir las anteriores. Solo si llegan velas anteriores a la ultima guardada (por ejemplo el backfill,
+que descarga de la mas nueva a la mas vieja) se reescribe el dia completo, de forma atomica (archivo temporal +
+os.replace). Un registro incompleto al final (por ejemplo el bot se corto durante una escritura) se ignora al leer y
+se descarta en la siguiente escritura.
+
+Uso desde la linea de comandos para descargar la historia (endpoint history-candles):
+
+    python archivo.py [--root archivo_velas] backfill BTC-USDT-SWAP 1m 2024-01-01 [2024-02-01]
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import api_okx
+import config
+import velas
+
+COLUMNAS = ['open', 'high', 'low', 'close', 'volume', 'volCcy', 'volCcyQuote', 'confirm']
+DIA_MS = 24 * 60 * 60 * 1000
+REGISTRO = (len(COLUMNAS) + 1) * 8  # bytes de cada vela en el archivo
+
+# Un lock por (root, instId, bar): con streaming la misma vela la puede escribir el thread del motor
+# (velas.add_vela) y el pool de descargas (velas.get_velas) a la vez
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock(root, instId, bar):
+    with _locks_lock:
+        return _locks.setdefault((root, instId, bar), threading.Lock())
+
+
+def _root(root):
+    """ Carpeta del archivo, por defecto config.ARCHIVO_VELAS. """
+    root = config.ARCHIVO_VELAS if root is None else root
+    if root is None:
+        raise ValueError('El archivo de velas esta desactivado (config.ARCHIVO_VELAS es None), indicar la carpeta')
+    return root
+
+
+def _path(root, instId, bar, dia):
+    """ Ruta del archivo de un dia (dia = ms // DIA_MS). """
+    fecha = pd.Timestamp(dia * DIA_MS, unit='ms').strftime('%Y-%m-%d')
+    return os.path.join(root, instId, bar, f'{fecha}.f8')
+
+
+def _dias(root, instId, bar):
+    """ Dias guardados de un instId y bar, ordenados. """
+    carpeta = os.path.join(root, instId, bar)
+    if not os.path.isdir(carpeta):
+        return []
+    fechas = sorted(f[:-3] for f in os.listdir(carpeta) if f.endswith('.f8'))
+    return [int(pd.Timestamp(f).value // 10 ** 6 // DIA_MS) for f in fechas]
+
+
+def _load(path):
+    """ Velas de un dia como array (9 x velas), una vista sobre el archivo mapeado en memoria. """
+    n = os.path.getsize(path) // REGISTRO if os.path.exists(path) else 0
+    if n == 0:
+        return np.empty((len(COLUMNAS) + 1, 0))
+    return np.memmap(path, dtype=np.float64, mode='r', shape=(n, len(COLUMNAS) + 1)).T
+
+
+def _append(path, arr):
+    """ Agrega velas (9 x velas) al final del archivo, descartando un registro incompleto si lo hubiera. """
+    with open(path, 'ab') as f:
+        f.truncate(f.tell() - f.tell() % REGISTRO)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(arr.T).tobytes())
+
+
+def _replace(path, arr):
+    """ Reescribe el archivo de un dia de forma atomica. """
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(np.ascontiguousarray(arr.T).tobytes())
+    os.replace(tmp, path)
+
+
+def _to_array(df):
+    """ DataFrame de velas -> array (9 x velas) con el timestamp en ms en la fila 0. """
+    tiempos = df.index.values.astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+    return np.vstack([tiempos] + [df[c].to_numpy(np.float64) for c in COLUMNAS])
+
+
+def _to_frame(arr):
+    """ Array (9 x velas) -> DataFrame con el formato de api_okx.get_historical_data_formatted. """
+    index = pd.DatetimeIndex(arr[0].astype(np.int64).astype('datetime64[ms]').astype('datetime64[ns]'), name='time')
+    # arr[1:].T es una vista: si arr esta mapeado en memoria el DataFrame no copia los valores
+    return pd.DataFrame(arr[1:].T, index=index, columns=COLUMNAS, copy=False)
+
+
+def write_velas(df, instId, bar, root=None):
+    """
+    Agrega velas confirmadas al archivo. Las velas que ya estaban guardadas se ignoran.
+
+    Las velas posteriores a la ultima guardada del dia se agregan al final del archivo (el caso de cada corrida del
+    bot). Si hay velas anteriores el dia se reescribe completo. La lectura de lo guardado y la escritura se hacen con
+    el lock del instId y bar, asi dos threads no agregan la misma vela dos veces (el lock es por proceso).
+
+    :param df: DataFrame con el formato de api_okx.get_historical_data_formatted
+    :param instId: ID del instrumento
+    :param bar: Intervalo de tiempo
+    :param root: Carpeta del archivo (por defecto config.ARCHIVO_VELAS)
+    :return: Cantidad de velas agregadas
+    """
+    if df is None or df.empty:
+        return 0
+    root = _root(root)
+
+    nuevas = _to_array(df)
+    with _lock(root, instId, bar):
+        return _write(nuevas, root, instId, bar)
+
+
+def _write(nuevas, root, instId, bar):
+    """ write_velas con el lock tomado """
+    agregadas = 0
+
+    for dia in np.unique(nuevas[0] // DIA_MS).astype(np.int64):
+        path = _path(root, instId, bar, dia)
+        dia_nuevas = nuevas[:, nuevas[0] // DIA_MS == dia]
+
+        dia_nuevas = dia_nuevas[:, np.unique(dia_nuevas[0], return_index=True)[1]]  # ordenadas y sin repetir
+        guardadas = _load(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if guardadas.shape[1] and dia_nuevas[0, 0] <= guardadas[0, -1]:
+            dia_nuevas = dia_nuevas[:, ~np.isin(dia_nuevas[0], guardadas[0])]
+            if dia_nuevas.shape[1] == 0:
+                continue
+
+        if guardadas.shape[1] == 0 or dia_nuevas[0, 0] > guardadas[0, -1]:
+            _append(path, dia_nuevas)
+        else:
+            arr = np.hstack([guardadas, dia_nuevas])
+            _replace(path, arr[:, np.argsort(arr[0], kind='stable')])
+
+        agregadas += dia_nuevas.shape[1]
+
+    return agregadas
+
+
+def read_array(instId, bar, start=None, end=None, root=None):
+    """
+    Lee las velas de un rango de fechas como array (9 x velas).
+
+    Si el rango esta dentro de un solo dia devuelve una vista sobre el archivo mapeado en memoria (sin copia), si no
+    concatena los dias.
+
+    :param start: Fecha inicial (incluida), cualquier valor que acepte pd.Timestamp. None = desde el principio
+    :param end: Fecha final (excluida). None = hasta el final
+    """
+    root = _root(root)
+    start_ms = None if start is None else pd.Timestamp(start).value // 10 ** 6
+    end_ms = None if end is None else pd.Timestamp(end).value // 10 ** 6
+
+    partes = []
+    for dia in _dias(root, instId, bar):
+        if start_ms is not None and (dia + 1) * DIA_MS <= start_ms:
+            continue
+        if end_ms is not None and dia * DIA_MS >= end_ms:
+            break
+
+        arr = _load(_path(root, instId, bar, dia))
+        i = 0 if start_ms is None else np.searchsorted(arr[0], start_ms, side='left')
+        j = arr.shape[1] if end_ms is None else np.searchsorted(arr[0], end_ms, side='left')
+        if j > i:
+            partes.append(arr[:, i:j])
+
+    if not partes:
+        return np.empty((len(COLUMNAS) + 1, 0))
+    return partes[0] if len(partes) == 1 else np.hstack(partes)
+
+
+def read_velas(instId, bar, start=None, end=None, root=None):
+    """
+    Lee las velas de un rango de fechas (ver read_array).
+
+    :return: DataFrame con el formato de api_okx.get_historical_data_formatted
+    """
+    return _to_frame(read_array(instId, bar, start, end, root))
+
+
+def read_last(instId, bar, n, root=None):
+    """
+    Lee las ultimas n velas guardadas, para el arranque en caliente de velas.get_velas.
+
+    :return: DataFrame con el formato de api_okx.get_historical_data_formatted (vacio si no hay velas)
+    """
+    root = _root(root)
+    partes, total = [], 0
+    for dia in reversed(_dias(root, instId, bar)):
+        arr = _load(_path(root, instId, bar, dia))
+        partes.insert(0, arr)
+        total += arr.shape[1]
+        if total >= n:
+            break
+
+    if not partes:
+        return _to_frame(np.empty((len(COLUMNAS) + 1, 0)))
+    arr = partes[0] if len(partes) == 1 else np.hstack(partes)
+    return _to_frame(arr[:, -n:])
+
+
+def read_tickers(parametros, start=None, end=None, root=None):
+    """
+    Lee las velas de varios tickers, cada uno en su timeframe, por ejemplo para backtest.backtest.
+
+    :param parametros: Diccionario con los parametros de cada ticker (se usa el timeframe)
+    :return: Diccionario {ticker: DataFrame}
+    """
+    return {t: read_velas(t, p['timeframe'], start, end, root) for t, p in parametros.items()}
+
+
+def backfill(client_md, instId, bar, start, end=None, root=None, pages_por_escritura=50):
+    """
+    Descarga la historia de velas con el endpoint history-candles, de la mas nueva a la mas vieja, y la guarda en
+    el archivo. Los dias que ya estan completos en el archivo no se vuelven a descargar.
+
+    :param client_md: Instancia de MarketAPI
+    :param instId: ID del instrumento
+    :param bar: Intervalo de tiempo
+    :param start: Fecha inicial
+    :param end: Fecha final (por defecto ahora)
+    :param pages_por_escritura: Cantidad de paginas (100 velas cada una) que se juntan antes de escribir
+    :return: Cantidad de velas agregadas
+    """
+    root = _root(root)
+    start_ms = pd.Timestamp(start).value // 10 ** 6
+    cursor = int(time.time() * 1000) if end is None else pd.Timestamp(end).value // 10 ** 6
+    velas_por_dia = max(DIA_MS // (velas.bar_seconds(bar) * 1000), 1)
+
+    pendientes, agregadas = [], 0
+    while cursor > start_ms:
+        # Si el dia del cursor ya esta completo en el archivo salto al inicio del dia
+        dia = (cursor - 1) // DIA_MS
+        if _load(_path(root, instId, bar, dia)).shape[1] >= velas_por_dia:
+            cursor = dia * DIA_MS
+            continue
+
+        df = api_okx.get_historical_data_formatted(client_md, instId, bar=bar, limit=100, after=str(cursor),
+                                                   history=True)
+        if df.empty:
+            break
+
+        pendientes.append(df[df.index >= pd.Timestamp(start_ms, unit='ms')])
+        cursor = int(df.index[0].value // 10 ** 6)
+
+        if len(pendientes) >= pages_por_escritura:
+            agregadas += write_velas(pd.concat(pendientes), instId, bar, root)
+            pendientes = []
+
+    if pendientes:
+        agregadas += write_velas(pd.concat(pendientes), instId, bar, root)
+
+    return agregadas
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Archivo local de velas')
+    parser.add_argument('--root', default=config.ARCHIVO_VELAS or 'archivo_velas', help='Carpeta del archivo')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_backfill = sub.add_parser('backfill', help='Descarga la historia de velas de OKX')
+    p_backfill.add_argument('instId')
+    p_backfill.add_argument('bar')
+    p_backfill.add_argument('start')
+    p_backfill.add_argument('end', nargs='?')
+
+    p_read = sub.add_parser('read', help='Muestra las velas guardadas')
+    p_read.add_argument('instId')
+    p_read.add_argument('bar')
+    p_read.add_argument('start', nargs='?')
+    p_read.add_argument('end', nargs='?')
+
+    args = parser.parse_args()
+
+    if args.comando == 'backfill':
+        client_md = api_okx.get_account_md_api()
+        inicio = time.time()
+        n = backfill(client_md, args.instId, args.bar, args.start, args.end, args.root)
+        print(f"{n} velas agregadas en {time.time() - inicio:.1f} segundos")
+    else:
+        print(read_velas(args.instId, args.bar, args.start, args.end, args.root))
@@ -0,0 +1,226 @@
+"""
+Backtest de la estrategia del bot sobre velas historicas.
+
+Simula la misma logica que main.run corrida a corrida, pero calculando todo sobre la serie completa con numpy:
+- Al cierre de cada vela se evalua primero el cierre y luego la apertura (misma regla que
+  functions.should_open_position). El cierre se evalua contra el close (salidas.check_stop_loss_take_profit) o, con
+  intrabar=True (por defecto config.SALIDA_INTRABAR), contra el high y low de la vela como el bot en vivo (ver
+  salidas.py). En ese caso la salida es al nivel tocado, o al open si la vela abrio mas alla del nivel.
+- Un ticker que se cerro en una vela no se vuelve a abrir en esa misma vela (posiciones_cerradas en main.run).
+- Una posicion abierta en una vela recien se evalua para cerrar en la vela siguiente.
+- El tamaño se calcula con functions.calculate_sizes (calculate_size para todas las velas), el tp y sl sobre el
+  precio de apertura.
+- Las ordenes se ejecutan al close de la vela y pagan fee_rate sobre el nocional (por defecto 0.05%, taker de OKX).
+
+Diferencias con el bot en vivo:
+- Los indicadores se calculan una vez sobre toda la serie (ver indicadores.add_indicadores_rapido). El bot los
+  recalcula cada corrida sobre las ultimas velas (config.VELAS_LIMIT), por lo que las medias de Wilder y las EMAs
+  pueden diferir levemente en los primeros valores.
+- Cada ticker opera con su margen sin compartir el saldo, no se simula functions.usdt_available ni el funding.
+
+Las señales de apertura se calculan vectorizadas y para cada operacion se busca la vela de salida con numpy sobre
+ventanas crecientes, por lo que el costo es proporcional a la cantidad de operaciones y no a la cantidad de velas.
+"""
+
+import numpy as np
+import pandas as pd
+
+import config
+import functions
+import indicadores
+import salidas
+
+
+def signals(df, parametros):
+    """
+    Señal de apertura de cada vela con la regla de functions.should_open_position.
+
+    :param df: DataFrame con las columnas ADX, RSI y cruce
+    :param parametros: Diccionario con los parametros del ticker
+    :return: Tupla (side, motivo) de arrays: side 1 long, -1 short, 0 no abre; motivo 'cruce' o 'rsi'
+    """
+    adx = df['ADX'].to_numpy(float)
+    rsi = df['RSI'].to_numpy(float)
+    cruce = df['cruce'].to_numpy(float)
+
+    fuerte = adx > parametros['adx']  # Tendencia fuerte -> cruce
+    debil = adx < parametros['adx']  # Tendencia debil -> rsi
+
+    side = np.select([fuerte & (cruce > 0), fuerte & (cruce < 0),
+                      debil & (rsi > parametros['rsi']), debil & (rsi < parametros['rsi'])],
+                     [1, -1, -1, 1], default=0)
+    motivo = np.where(fuerte, 'cruce', 'rsi')
+
+    return side, motivo
+
+
+def _next_true(mask):
+    """ Para cada posicion i devuelve el primer j >= i con mask[j] True, o len(mask) si no hay. """
+    n = len(mask)
+    idx = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(idx[::-1])[::-1]
+
+
+def backtest_ticker(df, parametros, fee_rate=0.0005, con_indicadores=False, intrabar=None):
+    """
+    Backtest de un ticker.
+
+    :param df: DataFrame de velas con el formato de api_okx.get_historical_data_formatted
+    :param parametros: Diccionario con los parametros del ticker (fila de la hoja de parametros + ctVal, lotSz, minSz)
+    :param fee_rate: Fee por orden sobre el nocional
+    :param con_indicadores: True si el df ya tiene las columnas ADX, RSI y cruce
+    :param intrabar: True para evaluar el stop loss y take profit con el high y low de cada vela (None = usar
+                     config.SALIDA_INTRABAR)
+    :return: Tupla (operaciones, equity): DataFrame con una fila por operacion y Serie con el pnl acumulado
+             (realizado + no realizado, neto de fees) al cierre de cada vela
+    """
+    if intrabar is None:
+        intrabar = config.SALIDA_INTRABAR
+    if not con_indicadores:
+        df = indicadores.add_indicadores_rapido(df, parametros)
+
+    close = df['close'].to_numpy(float)
+    n = len(close)
+    # Precios contra los que se evaluan los niveles: con high = low = close es la regla del close
+    high = df['high'].to_numpy(float) if intrabar else close
+    low = df['low'].to_numpy(float) if intrabar else close
+    side, motivo = signals(df, parametros)
+    siguiente = _next_true(side != 0)
+    tamaños = functions.calculate_sizes(parametros, close)  # contratos si se abre en cada vela
+
+    ctVal = float(parametros['ctVal'])
+    tp_pct = parametros['take_profit']
+    sl_pct = parametros['stop_loss']
+
+    operaciones = []
+    posicion = np.zeros(n)  # contratos con signo al cierre de cada vela
+    entrada = np.zeros(n)  # precio de apertura de la posicion de cada vela
+    fees = np.zeros(n)
+    realizado = np.zeros(n)
+
+    i = siguiente[0] if n else 0
+    while i < n:
+        s = side[i]
+        price = close[i]
+        contratos = float(tamaños[i])
+
+        if contratos == 0:  # no alcanza el minSz, se vuelve a intentar en la vela siguiente
+            i = siguiente[i + 1] if i + 1 < n else n
+            continue
+
+        tp = price * (1 + s * tp_pct)
+        sl = price * (1 - s * sl_pct)
+        salida, motivo_cierre = salidas.first_exit(high, low, i + 1, s, sl, tp)
+        fin = n - 1 if salida is None else salida
+
+        nocional = contratos * ctVal * price
+        fee_open = -nocional * fee_rate
+        posicion[i:fin] = s * contratos
+        entrada[i:fin] = price
+        fees[i] += fee_open
+
+        operacion = {'ticker': parametros['ticker'], 'side': 'long' if s == 1 else 'short', 'motivo': motivo[i],
+                     'execution_time': df.index[i], 'avg_price': price, 'contratos': contratos,
+                     'margen': parametros['margen'], 'leverage': parametros['leverage'], 'nocional': nocional,
+                     'take_profit': tp, 'stop_loss': sl, 'close_time': None, 'close_price': None,
+                     'motivo_cierre': 'abierta', 'fee': fee_open, 'pnl': 0.}
+
+        if salida is None:
+            posicion[fin] = s * contratos
+            entrada[fin] = price
+            operaciones.append(operacion)
+            break
+
+        exit_price = salidas.exit_price(s, motivo_cierre, sl, tp, df['open'].iat[salida]) if intrabar else close[salida]
+        pnl = s * contratos * ctVal * (exit_price - price)
+        fee_close = -contratos * ctVal * exit_price * fee_rate
+        fees[salida] += fee_close
+        realizado[salida] += pnl
+
+        operacion.update({'close_time': df.index[salida], 'close_price': exit_price, 'motivo_cierre': motivo_cierre,
+                          'fee': fee_open + fee_close, 'pnl': pnl})
+        operaciones.append(operacion)
+
+        # En la vela del cierre no se vuelve a abrir
+        i = siguiente[salida + 1] if salida + 1 < n else n
+
+    no_realizado = posicion * ctVal * (close - entrada)
+    equity = pd.Series(np.cumsum(realizado + fees) + no_realizado, index=df.index, name=parametros['ticker'])
+
+    return pd.DataFrame(operaciones), equity
+
+
+def backtest(data, parametros, capital=0., fee_rate=0.0005, intrabar=None):
+    """
+    Backtest de varios tickers.
+
+    :param data: Diccionario {ticker: DataFrame de velas}
+    :param parametros: Diccionario con los parametros de cada ticker (ver functions.get_parametros)
+    :param capital: Capital inicial de la curva de equity
+    :param fee_rate: Fee por orden sobre el nocional
+    :param intrabar: True para evaluar el stop loss y take profit con el high y low de cada vela (None = usar
+                     config.SALIDA_INTRABAR)
+    :return: Tupla (operaciones, equity): DataFrame con las operaciones de todos los tickers ordenadas por fecha y
+             Serie con el capital total al cierre de cada vela
+    """
+    operaciones, curvas = [], []
+    for ticker, df in data.items():
+        if df.empty or ticker not in parametros:
+            continue
+        ops, curva = backtest_ticker(df, parametros[ticker], fee_rate=fee_rate, intrabar=intrabar)
+        operaciones.append(ops)
+        curvas.append(curva)
+
+    if not curvas:
+        return pd.DataFrame(), pd.Series(dtype=float)
+
+    operaciones = pd.concat(operaciones, ignore_index=True)
+    if not operaciones.empty:
+        operaciones = operaciones.sort_values('execution_time', ignore_index=True)
+
+    # Antes de la primera vela de un ticker su pnl es 0, despues de la ultima se mantiene
+    equity = pd.concat(curvas, axis=1).ffill().fillna(0.).sum(axis=1) + capital
+
+    return operaciones, equity
+
+
+def resumen(operaciones, equity):
+    """ Metricas basicas del backtest. """
+    cerradas = operaciones[operaciones['motivo_cierre'] != 'abierta'] if not operaciones.empty else operaciones
+    neto = cerradas['pnl'] + cerradas['fee'] if not cerradas.empty else pd.Series(dtype=float)
+    return {
+        'operaciones': len(cerradas),
+        'ganadoras': int((neto > 0).sum()),
+        'pnl': float(cerradas['pnl'].sum()) if not cerradas.empty else 0.,
+        'fees': float(cerradas['fee'].sum()) if not cerradas.empty else 0.,
+        'equity_final': float(equity.iloc[-1]) if len(equity) else 0.,
+        'max_drawdown': float((equity - equity.cummax()).min()) if len(equity) else 0.,
+    }
+
+
+if __name__ == '__main__':
+    """
+    Ejemplo con velas sinteticas: 1 año de velas de 1 minuto para 10 tickers.
+    Para usar velas reales leerlas del archivo local: data = archivo.read_tickers(parametros, '2024-01-01', '2025-01-01')
+    """
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 365 * 24 * 60
+    index = pd.date_range('2023-01-01', periods=n, freq='1min', name='time')
+
+    data, parametros = {}, {}
+    for k in range(10):
+        ticker = f'T{k}-USDT-SWAP'
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.0008, n)))
+        data[ticker] = pd.DataFrame({'open': close, 'high': close * 1.0005, 'low': close * 0.9995, 'close': close},
+                                    index=index)
+        parametros[ticker] = {'ticker': ticker, 'adx': 20, 'rsi': 50, 'ema_slow': 50, 'ema_fast': 20,
+                              'take_profit': 0.01, 'stop_loss': 0.01, 'margen': 100, 'leverage': 2,
+                              'ctVal': 0.01, 'lotSz': 0.1, 'minSz': 0.1}
+
+    start = time.time()
+    operaciones, equity = backtest(data, parametros, capital=1000)
+    print(f"Backtest de {len(data)} tickers x {n} velas en {time.time() - start:.2f} segundos")
+    print(resumen(operaciones, equity))
+    print(operaciones.head())
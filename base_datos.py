@@ -0,0 +1,242 @@
+"""
+Base de datos local (SQLite) con las posiciones y operaciones del bot.
+
+La base local es la fuente de verdad de las hojas 'posiciones' y 'operaciones': el bot lee y escribe aca, sin
+esperar a Google Sheets. Cada escritura queda ademas encolada en la tabla 'espejo_pendiente' y un thread en segundo
+plano (SheetsMirror) la replica en Google Sheets. Si Sheets esta lento o caido el bot sigue operando y los cambios
+se envian cuando vuelva.
+
+Usamos el modo WAL de SQLite para que el thread del espejo pueda leer mientras el bot escribe.
+https://www.sqlite.org/wal.html
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import traceback
+from typing import List, Dict, Any
+
+import google_sheets
+import metricas
+
+# Columnas de cada tabla, en el mismo orden que las hojas de Google Sheets
+COLUMNAS_POSICIONES = ['ticker', 'execution_time', 'side', 'margen', 'leverage', 'nocional', 'avg_price',
+                       'contratos', 'stop_loss', 'take_profit', 'fee']
+# Columnas de la tabla posiciones que no van a la hoja, se agregan a las bases existentes (ver get_connection)
+# - cierre_pendiente, motivo_pendiente: clOrdId y motivo de una orden de cierre enviada que no se pudo consultar
+# - tpsl_exchange: 1 si la posicion se abrio con el take profit y stop loss adjuntos en OKX (config.TPSL_EXCHANGE)
+COLUMNAS_POSICIONES_EXTRA = {'cierre_pendiente': 'TEXT', 'motivo_pendiente': 'TEXT', 'tpsl_exchange': 'INTEGER'}
+COLUMNAS_OPERACIONES = ['ticker', 'tipo', 'execution_time', 'side', 'margen', 'leverage', 'nocional', 'avg_price',
+                        'contratos', 'fee', 'motivo', 'pnl']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posiciones (
+    ticker TEXT PRIMARY KEY,
+    execution_time TEXT, side TEXT, margen REAL, leverage REAL, nocional REAL, avg_price REAL, contratos REAL,
+    stop_loss REAL, take_profit REAL, fee REAL
+);
+CREATE TABLE IF NOT EXISTS operaciones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticker TEXT, tipo TEXT, execution_time TEXT, side TEXT, margen REAL, leverage REAL, nocional REAL,
+    avg_price REAL, contratos REAL, fee REAL, motivo TEXT, pnl REAL
+);
+CREATE INDEX IF NOT EXISTS idx_operaciones_ticker ON operaciones (ticker);
+CREATE TABLE IF NOT EXISTS espejo_pendiente (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT
+);
+"""
+
+
+def get_connection(path: str) -> sqlite3.Connection:
+    """
+    Abre (o crea) la base de datos en modo WAL.
+
+    :param path: Ruta al archivo de la base
+    :return: Conexion de sqlite3, las filas se leen como diccionarios (sqlite3.Row)
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')  # en WAL es seguro ante caidas del proceso
+    conn.executescript(SCHEMA)
+
+    existentes = {r['name'] for r in conn.execute('PRAGMA table_info(posiciones)')}
+    for columna, tipo in COLUMNAS_POSICIONES_EXTRA.items():
+        if columna not in existentes:
+            conn.execute(f'ALTER TABLE posiciones ADD COLUMN {columna} {tipo}')
+    return conn
+
+
+def read_posiciones(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """ Lee todas las posiciones, con el mismo formato que google_sheets.read_all_sheet. """
+    return [dict(r) for r in conn.execute('SELECT * FROM posiciones ORDER BY rowid')]
+
+
+def get_posicion(conn: sqlite3.Connection, ticker: str) -> Dict[str, Any]:
+    """ Devuelve la posicion de un ticker o None si no hay posicion abierta. """
+    r = conn.execute('SELECT * FROM posiciones WHERE ticker = ?', (ticker,)).fetchone()
+    return dict(r) if r else None
+
+
+def read_operaciones(conn: sqlite3.Connection, ticker: str = None) -> List[Dict[str, Any]]:
+    """ Lee las operaciones, todas o las de un ticker. """
+    if ticker is None:
+        rows = conn.execute('SELECT * FROM operaciones ORDER BY id')
+    else:
+        rows = conn.execute('SELECT * FROM operaciones WHERE ticker = ? ORDER BY id', (ticker,))
+    return [dict(r) for r in rows]
+
+
+def write_batch(conn: sqlite3.Connection, list_sheets: List[Dict[str, Any]]) -> None:
+    """
+    Aplica las operaciones de la corrida en una sola transaccion y las encola para el espejo de Google Sheets.
+
+    Las de tipo 'pendiente' (ver functions.pending_close) solo marcan la posicion con el cierre pendiente, no van a
+    Google Sheets.
+
+    :param conn: Conexion a la base
+    :param list_sheets: Lista de operaciones con el formato de functions.work_sheets ('tipo' open, close, none o
+                        pendiente)
+    """
+    if not list_sheets:
+        return
+
+    with conn:  # transaccion: se aplica todo o nada
+        for data in list_sheets:
+
+            if 'open' in data['tipo']:
+                _insert(conn, 'operaciones', COLUMNAS_OPERACIONES, data)
+                _insert(conn, 'posiciones', COLUMNAS_POSICIONES + list(COLUMNAS_POSICIONES_EXTRA), data, replace=True)
+
+            elif 'close' in data['tipo']:
+                _insert(conn, 'operaciones', COLUMNAS_OPERACIONES, data)
+                conn.execute('DELETE FROM posiciones WHERE ticker = ?', (data['ticker'],))
+
+            elif 'none' in data['tipo']:
+                conn.execute('DELETE FROM posiciones WHERE ticker = ?', (data['ticker'],))
+
+            elif 'pendiente' in data['tipo']:
+                conn.execute('UPDATE posiciones SET cierre_pendiente = ?, motivo_pendiente = ? WHERE ticker = ?',
+                             (data['cierre_pendiente'], data['motivo_pendiente'], data['ticker']))
+
+        espejo = [data for data in list_sheets if 'pendiente' not in data['tipo']]
+        if espejo:
+            conn.execute('INSERT INTO espejo_pendiente (payload) VALUES (?)', (json.dumps(espejo, default=float),))
+
+
+def _insert(conn, tabla, columnas, data, replace=False):
+    sql = f"INSERT {'OR REPLACE ' if replace else ''}INTO {tabla} ({', '.join(columnas)}) " \
+          f"VALUES ({', '.join('?' * len(columnas))})"
+    conn.execute(sql, [data.get(c) for c in columnas])
+
+
+def is_initialized(conn: sqlite3.Connection) -> bool:
+    """ Indica si la base ya tiene cargadas las posiciones iniciales (ver import_posiciones). """
+    return conn.execute("SELECT 1 FROM meta WHERE clave = 'inicializado'").fetchone() is not None
+
+
+def import_posiciones(conn: sqlite3.Connection, posiciones: List[Dict[str, Any]]) -> bool:
+    """
+    Carga las posiciones leidas de Google Sheets la primera vez que se usa la base. En las siguientes llamadas no
+    hace nada, ya que a partir de ahi la base local es la fuente de verdad.
+
+    :param posiciones: Posiciones con el formato de google_sheets.read_all_sheet
+    :return: True si se importaron las posiciones
+    """
+    if is_initialized(conn):
+        return False
+
+    with conn:
+        for p in posiciones:
+            _insert(conn, 'posiciones', COLUMNAS_POSICIONES, p, replace=True)
+        conn.execute("INSERT INTO meta (clave, valor) VALUES ('inicializado', datetime('now'))")
+
+    return True
+
+
+class SheetsMirror:
+    """
+    Thread que replica en Google Sheets las escrituras encoladas en 'espejo_pendiente'.
+
+    Junta todo lo pendiente en un solo google_sheets.write_batch y recien borra los pendientes cuando la escritura
+    fue exitosa. Si falla reintenta con espera creciente, sin bloquear al bot.
+    """
+
+    def __init__(self, path, sheet_factory, sheet_operaciones='operaciones', sheet_posiciones='posiciones',
+                 max_wait=300):
+        """
+        :param path: Ruta al archivo de la base
+        :param sheet_factory: Funcion sin parametros que devuelve el objeto Spreadsheet de gspread
+        :param max_wait: Espera maxima en segundos entre reintentos
+        """
+        self.path = path
+        self.sheet_factory = sheet_factory
+        self.sheet_operaciones = sheet_operaciones
+        self.sheet_posiciones = sheet_posiciones
+        self.max_wait = max_wait
+
+        self._event = threading.Event()
+        self._stop = False
+        self._sheet = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._event.set()
+
+    def notify(self):
+        """ Avisa que hay escrituras nuevas para replicar. """
+        self._event.set()
+
+    def flush(self, conn):
+        """
+        Envia a Google Sheets todo lo pendiente.
+
+        :return: Cantidad de lotes enviados
+        """
+        rows = conn.execute('SELECT id, payload FROM espejo_pendiente ORDER BY id').fetchall()
+        if not rows:
+            return 0
+
+        list_sheets = [data for r in rows for data in json.loads(r['payload'])]
+
+        inicio = time.perf_counter()
+        if self._sheet is None:
+            self._sheet = self.sheet_factory()
+        google_sheets.write_batch(self._sheet, list_sheets, self.sheet_operaciones, self.sheet_posiciones)
+        metricas.observe('bot_espejo_sheets_segundos', time.perf_counter() - inicio)
+
+        with conn:
+            conn.execute('DELETE FROM espejo_pendiente WHERE id <= ?', (rows[-1]['id'],))
+
+        return len(rows)
+
+    def _run(self):
+        conn = get_connection(self.path)  # conexion propia, sqlite no comparte conexiones entre threads
+        wait = 1
+
+        while not self._stop:
+            try:
+                self.flush(conn)
+                wait = 1
+                self._event.wait()  # espero a que haya algo nuevo
+                self._event.clear()
+
+            except Exception:
+                traceback.print_exc()
+                print(f"Error al replicar en Google Sheets, reintento en {wait} segundos")
+                self._sheet = None  # en el reintento vuelvo a abrir el sheet
+                self._event.wait(wait)
+                wait = min(wait * 2, self.max_wait)
+
+        conn.close()
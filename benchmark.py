@@ -0,0 +1,738 @@
+"""
+Benchmarks de las partes del bot que corren en cada ciclo, sin conexion a OKX ni a Google Sheets.
+
+- OKX: un servidor http local (StubOKX, en un proceso aparte) responde los endpoints que usa el bot a partir de las
+  respuestas guardadas en fixtures/okx. Las ordenes se ejecutan al close de la vela actual y las posiciones quedan
+  abiertas hasta el close-position, asi el ciclo completo abre, consulta y cierra posiciones como en vivo. Si la orden
+  de apertura trae take profit y stop loss adjuntos (config.TPSL_EXCHANGE), el servidor cierra la posicion cuando una
+  vela toca alguno de los niveles.
+- Google Sheets: SpreadsheetFalso guarda las hojas en memoria, la hoja de parametros sale de fixtures/sheets.
+- Las fixtures tienen pocos instrumentos, para N tickers se replican (ver tickers).
+
+Se mide con 1, 10, 100 y 500 tickers:
+- el ciclo completo de main.run (main.run_cycle): percentiles de la latencia, tiempo por etapa y pico de memoria
+- las funciones que mas se usan en cada ciclo: get_historical_data_formatted, add_indicadores, adj_quantity
+  (y lotes.quantize) y work_sheets
+
+Uso:
+    python benchmark.py                                   # todo
+    python benchmark.py --solo ciclo --tickers 10 100     # solo el ciclo completo
+    python benchmark.py --guardar base.json               # guarda los resultados
+    python benchmark.py --comparar base.json              # falla (exit 1) si algo es mas lento que la tolerancia
+    python benchmark.py --grabar                          # vuelve a grabar las fixtures publicas desde OKX
+
+Por defecto el limite de requests de api_okx (RATE_LIMITS) se desactiva, ya que el servidor es local y el objetivo
+es medir el codigo del bot. Con --rate-limit se mantiene.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen, Request
+
+import numpy as np
+import pandas as pd
+from gspread.exceptions import WorksheetNotFound
+
+import alertas
+import api_okx
+import base_datos
+import config
+import functions
+import indicadores
+import lotes
+import velas
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+TICKERS = (1, 10, 100, 500)
+
+
+def medir(fn, repeticiones=200):
+    """
+    Ejecuta fn varias veces y devuelve la mediana del tiempo en milisegundos.
+
+    :param fn: Funcion sin parametros
+    :param repeticiones: Cantidad de ejecuciones
+    """
+    fn()  # calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos) * 1000
+
+
+def velas_okx(n, ultimo_ts=1709337540000, bar_ms=60000, seed=0):
+    """
+    Velas sinteticas con el formato de la respuesta de OKX: strings, de la mas nueva a la mas vieja y la primera
+    sin confirmar.
+    """
+    rng = np.random.default_rng(seed)
+    close = 60000 * np.exp(np.cumsum(rng.normal(0, 0.001, n)))
+    rows = []
+    for i in range(n):
+        c = close[i]
+        rows.append([str(ultimo_ts - i * bar_ms), f'{c:.1f}', f'{c * 1.001:.1f}', f'{c * 0.999:.1f}', f'{c:.1f}',
+                     f'{rng.uniform(10, 1000):.2f}', f'{rng.uniform(0.1, 10):.4f}', f'{rng.uniform(1e4, 1e6):.2f}',
+                     '0' if i == 0 else '1'])
+    return rows
+
+
+def parse_candles_pandas(rows):
+    """ Implementacion anterior de api_okx.get_historical_data_formatted, como referencia. """
+    df = pd.DataFrame(rows)
+
+    if not df.empty:
+        columns = ['time', 'open', 'high', 'low', 'close', 'volume', 'volCcy', 'volCcyQuote', 'confirm']
+        df.columns = columns
+        df = df.astype(float)
+        df['time'] = pd.to_datetime(df['time'], unit='ms')
+        df.set_index('time', inplace=True)
+        df.sort_index(inplace=True)
+        df = df[df['confirm'] == 1]
+
+    return df
+
+
+def bench_parse_candles(tamaños=(300, 1440)):
+    """ Compara api_okx.parse_candles contra la implementacion anterior con pandas. """
+    resultados = []
+    for n in tamaños:
+        rows = velas_okx(n)
+        assert api_okx.parse_candles(rows).equals(parse_candles_pandas(rows))
+
+        anterior = medir(lambda: parse_candles_pandas(rows))
+        nuevo = medir(lambda: api_okx.parse_candles(rows))
+        resultados.append({'benchmark': 'parse_candles', 'velas': n, 'anterior_ms': anterior, 'nuevo_ms': nuevo,
+                           'speedup': anterior / nuevo})
+    return resultados
+
+
+# Fixtures
+def read_fixture(nombre):
+    """ Lee una fixture, por ejemplo 'okx/candles' o 'sheets/parametros'. """
+    with open(os.path.join(FIXTURES, f'{nombre}.json')) as f:
+        return json.load(f)
+
+
+def tickers(n):
+    """
+    Nombres de n tickers a partir de los instrumentos de la fixture: los primeros son los de la fixture y los demas
+    copias con un numero, por ejemplo BTC1-USDT-SWAP.
+
+    :return: Lista de tuplas (instId, instId de la fixture)
+    """
+    base = [i['instId'] for i in read_fixture('okx/instruments')['data']]
+    resultado = []
+    for k in range(n):
+        original = base[k % len(base)]
+        vuelta = k // len(base)
+        resultado.append((original.replace('-', f'{vuelta}-', 1) if vuelta else original, original))
+    return resultado
+
+
+def grabar_fixtures(client_md, account_api, instId='BTC-USDT-SWAP', bar='1m', velas_total=600):
+    """
+    Graba las fixtures de los endpoints publicos desde OKX (velas, instrumentos y ultimo precio). Los instrumentos
+    y precios se guardan solo para los instrumentos que ya estan en la fixture.
+    """
+    instIds = {i['instId'] for i in read_fixture('okx/instruments')['data']}
+
+    rows, after = [], ''
+    while len(rows) < velas_total:
+        pagina = api_okx.get_candles(client_md, instId, bar=bar, limit=min(300, velas_total - len(rows)),
+                                     after=after)
+        if not pagina:
+            break
+        rows += pagina
+        after = pagina[-1][0]
+
+    fixtures = {
+        'okx/candles': {'code': '0', 'msg': '', 'data': rows},
+        'okx/instruments': {'code': '0', 'msg': '',
+                            'data': [i for i in api_okx.get_instruments(account_api) if i['instId'] in instIds]},
+        'okx/tickers': {'code': '0', 'msg': '',
+                        'data': [t for t in client_md.get_tickers(instType='SWAP')['data'] if t['instId'] in instIds]},
+    }
+    for nombre, contenido in fixtures.items():
+        with open(os.path.join(FIXTURES, f'{nombre}.json'), 'w') as f:
+            json.dump(contenido, f, indent=None if nombre == 'okx/candles' else 1)
+        print(f"Fixture {nombre}: {len(contenido['data'])} registros")
+
+
+# Servidor local de OKX
+class StubOKX:
+    """
+    Estado del servidor local: velas de cada ticker, posiciones, ordenes y leverage.
+
+    Las velas de cada ticker son las de la fixture escaladas al ultimo precio del instrumento (fixture de tickers) y
+    desplazadas un poco para que no todos den la misma señal. La vela 'actual' es la que esta en curso, avanzar()
+    confirma una vela y empieza la siguiente.
+    """
+
+    def __init__(self, n, inicio=config.VELAS_LIMIT, fee_rate=0.0005):
+        self.fee_rate = fee_rate
+        self.lock = threading.Lock()
+
+        rows = read_fixture('okx/candles')['data'][::-1]  # de la mas vieja a la mas nueva
+        valores = np.array(rows, dtype=np.float64)
+        self.ts = valores[:, 0].astype(np.int64)
+        self.actual = inicio
+
+        instrumentos = {i['instId']: i for i in read_fixture('okx/instruments')['data']}
+        precios = {t['instId']: float(t['last']) for t in read_fixture('okx/tickers')['data']}
+        self.leverage_inicial = read_fixture('okx/leverage')['data'][0]['lever']
+        self.balance = read_fixture('okx/balance')
+        self.position = read_fixture('okx/positions')['data'][0]
+        self.order = read_fixture('okx/order')['data'][0]
+
+        self.instruments, self.velas = {}, {}
+        for k, (instId, original) in enumerate(tickers(n)):
+            self.instruments[instId] = {**instrumentos[original], 'instId': instId}
+            desplazamiento = (k * 37) % (len(rows) // 2)
+            precios_vela = np.roll(valores[:, 1:5], -desplazamiento, axis=0)
+            precios_vela *= precios[original] / precios_vela[-1, 3]
+            self.velas[instId] = np.column_stack([precios_vela, valores[:, 5:8]])
+
+        self.positions = {}  # instId -> {'posSide', 'sz', 'avgPx', 'tp', 'sl'}
+        self.orders = {}  # clOrdId -> orden
+        self.leverage = {}  # (instId, posSide) -> lever
+        self._filas = {}  # instId -> velas como strings (cache)
+
+    def avanzar(self):
+        with self.lock:
+            if self.actual + 1 >= len(self.ts):
+                raise ValueError('No hay mas velas en la fixture')
+            self.actual += 1
+            self._disparar()
+
+    def _disparar(self):
+        """ Cierra las posiciones cuyo take profit o stop loss adjunto toca la vela en curso (primero el stop loss). """
+        for instId, p in list(self.positions.items()):
+            if p.get('tp') is None:
+                continue
+            o, h, l, c = self.velas[instId][self.actual, :4]
+            long = p['posSide'] == 'long'
+            if (l <= p['sl']) if long else (h >= p['sl']):
+                nivel = min(o, p['sl']) if long else max(o, p['sl'])
+            elif (h >= p['tp']) if long else (l <= p['tp']):
+                nivel = max(o, p['tp']) if long else min(o, p['tp'])
+            else:
+                continue
+            self._cerrar(instId, f'algo{len(self.orders) + 1}', float(nivel))
+
+    def precio(self, instId):
+        """ Close de la vela en curso. """
+        return float(self.velas[instId][self.actual, 3])
+
+    def filas(self, instId):
+        if instId not in self._filas:
+            v = self.velas[instId]
+            self._filas[instId] = [[str(t), *(f'{x:.8g}' for x in v[i, :4]), *(f'{x:.6g}' for x in v[i, 4:]), '1']
+                                   for i, t in enumerate(self.ts)]
+        return self._filas[instId]
+
+    def candles(self, instId, after='', before='', limit='100'):
+        """ Velas con la paginacion de OKX: after trae las anteriores, before las posteriores. """
+        if instId not in self.velas:
+            return {'code': '51001', 'msg': 'Instrument ID does not exist', 'data': []}
+
+        with self.lock:
+            actual = self.actual
+        fin = actual + 1 if not after else min(int(np.searchsorted(self.ts, int(after), 'left')), actual + 1)
+        ini = 0 if not before else int(np.searchsorted(self.ts, int(before), 'right'))
+        ini = max(ini, fin - min(int(limit or 100), 300))
+
+        filas = self.filas(instId)
+        data = [filas[i] for i in range(fin - 1, ini - 1, -1)]
+        if data and fin == actual + 1:
+            data[0] = data[0][:-1] + ['0']  # la vela en curso no esta confirmada
+        return {'code': '0', 'msg': '', 'data': data}
+
+    def _fill(self, instId, clOrdId, side, posSide, sz, pnl=0., precio=None):
+        precio = self.precio(instId) if precio is None else precio
+        ctVal = float(self.instruments[instId]['ctVal'])
+        orden = {**self.order, 'instId': instId, 'clOrdId': clOrdId, 'ordId': str(len(self.orders) + 1), 'side': side,
+                 'posSide': posSide, 'sz': str(sz), 'accFillSz': str(sz), 'fillSz': str(sz), 'avgPx': str(precio),
+                 'fillPx': str(precio), 'fee': str(-sz * ctVal * precio * self.fee_rate), 'pnl': str(pnl),
+                 'fillTime': str(self.ts[self.actual])}
+        self.orders[clOrdId] = orden
+        return orden
+
+    def place_order(self, o):
+        if o['instId'] not in self.instruments:
+            return {'clOrdId': o.get('clOrdId'), 'ordId': '', 'sCode': '51001', 'sMsg': 'Instrument ID does not exist'}
+        with self.lock:
+            sz = float(o['sz'])
+            self._fill(o['instId'], o['clOrdId'], o['side'], o['posSide'], sz)
+            adjuntos = (o.get('attachAlgoOrds') or [{}])[0]
+            self.positions[o['instId']] = {'posSide': o['posSide'], 'sz': sz, 'avgPx': self.precio(o['instId']),
+                                           'tp': float(adjuntos['tpTriggerPx']) if adjuntos else None,
+                                           'sl': float(adjuntos['slTriggerPx']) if adjuntos else None}
+        return {'clOrdId': o['clOrdId'], 'ordId': self.orders[o['clOrdId']]['ordId'], 'sCode': '0', 'sMsg': ''}
+
+    def _cerrar(self, instId, clOrdId, precio=None):
+        p = self.positions.pop(instId)
+        signo = 1 if p['posSide'] == 'long' else -1
+        precio = self.precio(instId) if precio is None else precio
+        ctVal = float(self.instruments[instId]['ctVal'])
+        pnl = signo * p['sz'] * ctVal * (precio - p['avgPx'])
+        self._fill(instId, clOrdId, 'sell' if signo == 1 else 'buy', p['posSide'], p['sz'], pnl, precio)
+        return p
+
+    def close_position(self, o):
+        with self.lock:
+            if o['instId'] not in self.positions:
+                return {'code': '51023', 'msg': 'Position does not exist', 'data': []}
+            p = self._cerrar(o['instId'], o['clOrdId'])
+        return {'code': '0', 'msg': '', 'data': [{'clOrdId': o['clOrdId'], 'instId': o['instId'],
+                                                  'posSide': p['posSide'], 'tag': ''}]}
+
+    def orders_history(self, instId, limit='100'):
+        """ Ordenes ejecutadas del instrumento, de la mas nueva a la mas vieja. """
+        with self.lock:
+            data = [o for o in reversed(self.orders.values()) if o['instId'] == instId]
+        return {'code': '0', 'msg': '', 'data': data[:int(limit or 100)]}
+
+    def positions_data(self):
+        with self.lock:
+            data = []
+            for instId, p in self.positions.items():
+                mark = self.precio(instId)
+                lever = float(self.leverage.get((instId, p['posSide']), self.leverage_inicial))
+                nocional = p['sz'] * float(self.instruments[instId]['ctVal']) * mark
+                data.append({**self.position, 'instId': instId, 'posSide': p['posSide'], 'pos': str(p['sz']),
+                             'avgPx': str(p['avgPx']), 'markPx': str(mark), 'lever': str(lever),
+                             'notionalUsd': str(nocional), 'margin': str(nocional / lever)})
+        return {'code': '0', 'msg': '', 'data': data}
+
+    def leverage_info(self, instId, mgnMode):
+        data = [{'instId': instId, 'mgnMode': mgnMode, 'posSide': posSide,
+                 'lever': self.leverage.get((instId, posSide), self.leverage_inicial)} for posSide in ('long', 'short')]
+        return {'code': '0', 'msg': '', 'data': data}
+
+    def responder(self, metodo, path, query, body):
+        """ Respuesta (diccionario) de un request al servidor. """
+        q = {k: v[0] for k, v in parse_qs(query).items()}
+
+        if path in ('/api/v5/market/candles', '/api/v5/market/history-candles'):
+            return self.candles(q.get('instId'), q.get('after', ''), q.get('before', ''), q.get('limit', '100'))
+        if path == '/api/v5/account/instruments':
+            return {'code': '0', 'msg': '', 'data': list(self.instruments.values())}
+        if path == '/api/v5/account/balance':
+            return self.balance
+        if path == '/api/v5/account/positions':
+            return self.positions_data()
+        if path == '/api/v5/account/leverage-info':
+            return self.leverage_info(q.get('instId'), q.get('mgnMode'))
+        if path == '/api/v5/account/set-leverage':
+            for posSide in (['long', 'short'] if not body.get('posSide') else [body['posSide']]):
+                self.leverage[(body['instId'], posSide)] = body['lever']
+            return {'code': '0', 'msg': '', 'data': [body]}
+        if path == '/api/v5/trade/order' and metodo == 'POST':
+            r = self.place_order(body)
+            return {'code': '0' if r['sCode'] == '0' else '1', 'msg': '', 'data': [r]}
+        if path == '/api/v5/trade/batch-orders':
+            data = [self.place_order(o) for o in body]
+            codes = {d['sCode'] == '0' for d in data}
+            return {'code': '0' if codes == {True} else '1' if codes == {False} else '2', 'msg': '', 'data': data}
+        if path == '/api/v5/trade/close-position':
+            return self.close_position(body)
+        if path == '/api/v5/trade/orders-history':
+            return self.orders_history(q.get('instId'), q.get('limit', '100'))
+        if path == '/api/v5/trade/order':
+            orden = self.orders.get(q.get('clOrdId'))
+            if orden is None:
+                return {'code': '51603', 'msg': 'Order does not exist', 'data': []}
+            return {'code': '0', 'msg': '', 'data': [orden]}
+        if path == '/stub/avanzar':
+            self.avanzar()
+            return {'code': '0', 'actual': self.actual}
+
+        return {'code': '50000', 'msg': f'Endpoint no soportado {metodo} {path}', 'data': []}
+
+
+def _servir(n, conexion):
+    """ Proceso del servidor local, envia el puerto por la conexion y atiende hasta que lo terminan. """
+    stub = StubOKX(n)
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _responder(self, metodo):
+            url = urlparse(self.path)
+            largo = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(largo)) if largo else {}
+            contenido = json.dumps(stub.responder(metodo, url.path, url.query, body)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def do_GET(self):
+            self._responder('GET')
+
+        def do_POST(self):
+            self._responder('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    conexion.send(server.server_address[1])
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def stub_okx(n):
+    """
+    Levanta el servidor local de OKX con n tickers en otro proceso, asi no compite por el GIL con el bot.
+
+    :return: Dominio del servidor, por ejemplo http://127.0.0.1:54321
+    """
+    padre, hijo = multiprocessing.Pipe()
+    proceso = multiprocessing.Process(target=_servir, args=(n, hijo), daemon=True)
+    proceso.start()
+    try:
+        yield f'http://127.0.0.1:{padre.recv()}'
+    finally:
+        proceso.terminate()
+        proceso.join()
+
+
+def avanzar(domain):
+    """ Confirma la vela en curso del servidor local. """
+    urlopen(Request(f'{domain}/stub/avanzar', data=b'', method='POST')).read()
+
+
+# Google Sheets en memoria
+class HojaFalsa:
+    """ Worksheet de gspread en memoria, con los metodos que usa el bot. """
+
+    def __init__(self, title, id, valores):
+        self.title = title
+        self.id = id
+        self.valores = valores  # lista de filas, la primera es el encabezado
+
+    def get_all_records(self):
+        header = self.valores[0]
+        return [dict(zip(header, fila)) for fila in self.valores[1:]]
+
+    def col_values(self, col):
+        return [fila[col - 1] for fila in self.valores]
+
+    def clear(self):
+        self.valores = []
+
+    def update(self, values, range_name='A1'):
+        self.valores = [list(v) for v in values]
+
+
+class SpreadsheetFalso:
+    """
+    Spreadsheet de gspread en memoria. Cada llamada espera 'latencia' segundos, para simular la api de Google.
+    """
+
+    def __init__(self, hojas, latencia=0.):
+        """
+        :param hojas: Diccionario {nombre: filas} con el encabezado en la primera fila
+        """
+        self.hojas = {nombre: HojaFalsa(nombre, i, valores) for i, (nombre, valores) in enumerate(hojas.items())}
+        self.latencia = latencia
+
+    @classmethod
+    def from_fixtures(cls, n, latencia=0.):
+        """ Hojas de parametros (fixture replicada para n tickers), posiciones y operaciones vacias. """
+        parametros = {p['ticker']: p for p in read_fixture('sheets/parametros')}
+        filas = [{**parametros[original], 'ticker': instId} for instId, original in tickers(n)]
+        header = list(filas[0].keys())
+        return cls({config.HOJA_PARAMETROS: [header] + [[f[k] for k in header] for f in filas],
+                    config.HOJA_POSICIONES: [list(base_datos.COLUMNAS_POSICIONES)],
+                    config.HOJA_OPERACIONES: [list(base_datos.COLUMNAS_OPERACIONES)]}, latencia)
+
+    def _esperar(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def worksheet(self, nombre):
+        self._esperar()
+        if nombre not in self.hojas:
+            raise WorksheetNotFound(nombre)
+        return self.hojas[nombre]
+
+    def worksheets(self):
+        self._esperar()
+        return list(self.hojas.values())
+
+    def batch_update(self, body):
+        self._esperar()
+        por_id = {h.id: h for h in self.hojas.values()}
+        for r in body['requests']:
+            if 'deleteDimension' in r:
+                rango = r['deleteDimension']['range']
+                del por_id[rango['sheetId']].valores[rango['startIndex']:rango['endIndex']]
+            elif 'appendCells' in r:
+                hoja = por_id[r['appendCells']['sheetId']]
+                for fila in r['appendCells']['rows']:
+                    hoja.valores.append([next(iter(c['userEnteredValue'].values())) if c else ''
+                                         for c in fila['values']])
+
+
+# Ciclo completo
+def _reset_caches():
+    """ Borra las caches de modulo del bot para que cada escenario arranque en frio. """
+    velas.clear_cache()
+    api_okx._instruments_cache.clear()
+    api_okx.clear_leverage_cache()
+
+
+def bench_ciclo(n, ciclos=20, latencia_sheets=0.):
+    """
+    Corre el ciclo completo de main.run (main.run_cycle) contra el servidor local, en una carpeta temporal (base
+    local, archivo de velas y snapshot de instrumentos).
+
+    La primera corrida (arranque en frio: descarga todas las velas y los instrumentos) se informa aparte. Despues de
+    las corridas medidas se corre una mas con tracemalloc para medir el pico de memoria.
+
+    :param n: Cantidad de tickers
+    :param ciclos: Cantidad de corridas medidas
+    :param latencia_sheets: Segundos de cada llamada a Google Sheets
+    :return: Diccionario con los resultados
+    """
+    import main
+    from clientes import ClientRegistry
+    from cuenta import AccountState
+
+    directorio = os.getcwd()
+    with tempfile.TemporaryDirectory() as carpeta, stub_okx(n) as domain:
+        os.chdir(carpeta)
+        try:
+            _reset_caches()
+            hoja = SpreadsheetFalso.from_fixtures(n, latencia_sheets)
+            clientes = ClientRegistry('', '', '', None, None, domain=domain, sheet_factory=lambda: hoja)
+            db = base_datos.get_connection(config.DB_FILE)
+            mirror = base_datos.SheetsMirror(config.DB_FILE, lambda: hoja, config.HOJA_OPERACIONES,
+                                             config.HOJA_POSICIONES)
+            mirror.start()
+            estado = {'timeframes': None, 'engine': None, 'cuenta': AccountState()}
+            notifier = alertas.TelegramNotifier('', [])  # sin chats no envia nada
+
+            def corrida():
+                avanzar(domain)
+                tick = {'bars': ['1m'], 'atraso': 0.}
+                with contextlib.redirect_stdout(io.StringIO()):
+                    inicio = time.perf_counter()
+                    resumen = main.run_cycle(clientes, db, mirror, tick, estado, notifier)
+                    return time.perf_counter() - inicio, resumen
+
+            frio, _ = corrida()
+            tiempos, etapas = [], {}
+            for _ in range(ciclos):
+                t, resumen = corrida()
+                tiempos.append(t)
+                for etapa, s in resumen['etapas'].items():
+                    etapas.setdefault(etapa, []).append(s)
+
+            tracemalloc.start()
+            corrida()
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            operaciones = len(base_datos.read_operaciones(db))
+            mirror.stop()
+            db.close()
+            clientes.invalidate()
+        finally:
+            os.chdir(directorio)
+
+    p50, p90, p99 = np.percentile(tiempos, [50, 90, 99]) * 1000
+    return {'benchmark': 'ciclo', 'tickers': n, 'ciclos': ciclos, 'frio_ms': frio * 1000, 'p50_ms': p50,
+            'p90_ms': p90, 'p99_ms': p99, 'max_ms': max(tiempos) * 1000, 'pico_mb': pico / 2 ** 20,
+            'operaciones': operaciones,
+            'etapas_ms': {k: statistics.median(v) * 1000 for k, v in etapas.items()}}
+
+
+# Funciones
+def _datos(n):
+    """ Velas (de la fixture, escaladas) y parametros de n tickers, como los arma el bot. """
+    instrumentos = {i['instId']: i for i in read_fixture('okx/instruments')['data']}
+    parametros_fixture = {p['ticker']: p for p in read_fixture('sheets/parametros')}
+    rows = read_fixture('okx/candles')['data'][:config.VELAS_LIMIT]
+
+    data, parametros = {}, {}
+    for instId, original in tickers(n):
+        data[instId] = api_okx.parse_candles(rows)
+        i = instrumentos[original]
+        parametros[instId] = {**parametros_fixture[original], 'ticker': instId, 'ctVal': float(i['ctVal']),
+                              'lotSz': float(i['lotSz']), 'minSz': float(i['minSz'])}
+    return data, parametros
+
+
+def _list_sheets(n, posiciones):
+    """ Operaciones de una corrida con n tickers: la mitad aperturas y la mitad cierres de posiciones abiertas. """
+    lista = []
+    for k, (instId, _) in enumerate(tickers(n)):
+        data = {'ticker': instId, 'execution_time': '2024-03-01 23:59:00', 'side': 'long', 'margen': 50.,
+                'leverage': 5, 'nocional': 250., 'avg_price': 100., 'contratos': 2.5, 'fee': -0.125}
+        if k % 2 and instId in posiciones:
+            lista.append({**data, 'tipo': 'close', 'motivo': 'take profit', 'pnl': 0.75})
+        else:
+            lista.append({**data, 'tipo': 'open', 'motivo': 'cruce', 'stop_loss': 99.7, 'take_profit': 100.3})
+    return lista
+
+
+def bench_funciones(n):
+    """
+    Tiempo total de cada funcion para n tickers, en milisegundos.
+
+    get_historical_data_formatted descarga 300 velas de cada ticker del servidor local, secuencial.
+    """
+    repeticiones = max(3, 200 // n)
+    data, parametros = _datos(n)
+    resultados = {}
+
+    with stub_okx(n) as domain:
+        client_md = api_okx.get_account_md_api(domain=domain)
+        resultados['get_historical_data_formatted'] = medir(
+            lambda: [api_okx.get_historical_data_formatted(client_md, t, limit=config.VELAS_LIMIT) for t in data],
+            repeticiones)
+        client_md.close()
+
+    resultados['add_indicadores'] = medir(
+        lambda: [indicadores.add_indicadores(df, parametros[t]) for t, df in data.items()], repeticiones)
+
+    rng = np.random.default_rng(0)
+    cantidades = [(float(q), parametros[t]['lotSz']) for q, t in zip(rng.uniform(0.01, 500, n), parametros)]
+    resultados['adj_quantity'] = medir(lambda: [functions.adj_quantity(q, lot) for q, lot in cantidades],
+                                       repeticiones)
+    pasos = [(q, *lotes.lot_step(lot)) for q, lot in cantidades]
+    resultados['quantize'] = medir(lambda: [lotes.quantize(q, escala, paso) for q, escala, paso in pasos],
+                                   repeticiones)
+
+    # La mitad de los tickers ya tiene posicion abierta en la hoja, y se cierra
+    abiertas = [instId for k, (instId, _) in enumerate(tickers(n)) if k % 2]
+    lista = _list_sheets(n, set(abiertas))
+
+    def work_sheets():
+        hoja = SpreadsheetFalso.from_fixtures(n)
+        hoja.hojas[config.HOJA_POSICIONES].valores += [[t] + [''] * (len(base_datos.COLUMNAS_POSICIONES) - 1)
+                                                       for t in abiertas]
+        functions.work_sheets(lista, hoja, config.HOJA_OPERACIONES, config.HOJA_POSICIONES)
+
+    resultados['work_sheets'] = medir(work_sheets, repeticiones)
+
+    return [{'benchmark': nombre, 'tickers': n, 'ms': ms} for nombre, ms in resultados.items()]
+
+
+# Comparacion contra una corrida anterior
+def _claves(resultados):
+    """ Valor de referencia de cada resultado: {(benchmark, tamaño): ms} """
+    claves = {}
+    for r in resultados:
+        if r['benchmark'] == 'parse_candles':
+            claves[('parse_candles', r['velas'])] = r['nuevo_ms']
+        elif r['benchmark'] == 'ciclo':
+            claves[('ciclo_p50', r['tickers'])] = r['p50_ms']
+            claves[('ciclo_pico_mb', r['tickers'])] = r['pico_mb']
+        else:
+            claves[(r['benchmark'], r['tickers'])] = r['ms']
+    return claves
+
+
+def comparar(resultados, base, tolerancia=0.25):
+    """
+    Compara los resultados contra los de una corrida anterior.
+
+    :param tolerancia: Aumento relativo permitido (0.25 = 25% mas lento o mas memoria)
+    :return: Lista de regresiones (benchmark, tamaño, antes, ahora)
+    """
+    antes = _claves(base)
+    regresiones = []
+    for clave, ahora in _claves(resultados).items():
+        if clave in antes and ahora > antes[clave] * (1 + tolerancia):
+            regresiones.append((*clave, antes[clave], ahora))
+    return regresiones
+
+
+def imprimir(r):
+    if r['benchmark'] == 'parse_candles':
+        print(f"parse_candles {r['velas']} velas: {r['anterior_ms']:.3f} ms -> {r['nuevo_ms']:.3f} ms "
+              f"({r['speedup']:.1f}x)")
+    elif r['benchmark'] == 'ciclo':
+        print(f"ciclo {r['tickers']} tickers: p50 {r['p50_ms']:.1f} ms, p90 {r['p90_ms']:.1f} ms, "
+              f"p99 {r['p99_ms']:.1f} ms, max {r['max_ms']:.1f} ms, arranque en frio {r['frio_ms']:.1f} ms, "
+              f"pico de memoria {r['pico_mb']:.1f} MB, {r['operaciones']} operaciones")
+        print('    etapas (mediana): ' + ', '.join(f'{k} {v:.1f} ms' for k, v in r['etapas_ms'].items()))
+    else:
+        print(f"{r['benchmark']} {r['tickers']} tickers: {r['ms']:.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks del bot sin conexion a OKX ni a Google Sheets')
+    parser.add_argument('--tickers', type=int, nargs='+', default=list(TICKERS))
+    parser.add_argument('--ciclos', type=int, default=20, help='Corridas medidas del ciclo completo')
+    parser.add_argument('--solo', choices=['parse', 'funciones', 'ciclo'], help='Correr un solo grupo')
+    parser.add_argument('--latencia-sheets', type=float, default=0., help='Segundos de cada llamada a Sheets')
+    parser.add_argument('--tpsl-exchange', action='store_true',
+                        help='Take profit y stop loss en el exchange (config.TPSL_EXCHANGE)')
+    parser.add_argument('--rate-limit', action='store_true', help='Respetar los limites de requests de OKX')
+    parser.add_argument('--guardar', help='Archivo json donde guardar los resultados')
+    parser.add_argument('--comparar', help='Archivo json de una corrida anterior')
+    parser.add_argument('--tolerancia', type=float, default=0.25)
+    parser.add_argument('--grabar', action='store_true', help='Grabar las fixtures publicas desde OKX')
+    args = parser.parse_args()
+
+    if args.grabar:
+        grabar_fixtures(api_okx.get_account_md_api(),
+                        api_okx.get_account_api(api_okx.API_KEY, api_okx.API_SECRET, api_okx.PASSPHRASE))
+        sys.exit()
+
+    config.TPSL_EXCHANGE = args.tpsl_exchange
+
+    if not args.rate_limit:
+        for endpoint in api_okx.RATE_LIMITS:
+            api_okx._rate_limiters[endpoint] = api_okx.TokenBucket(10 ** 9, 1)
+
+    resultados = []
+    if args.solo in (None, 'parse'):
+        for r in bench_parse_candles():
+            imprimir(r)
+            resultados.append(r)
+
+    for n in args.tickers:
+        if args.solo in (None, 'funciones'):
+            for r in bench_funciones(n):
+                imprimir(r)
+                resultados.append(r)
+        if args.solo in (None, 'ciclo'):
+            r = bench_ciclo(n, args.ciclos, args.latencia_sheets)
+            imprimir(r)
+            resultados.append(r)
+
+    print(f"Memoria maxima del proceso: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    if args.guardar:
+        with open(args.guardar, 'w') as f:
+            json.dump(resultados, f, indent=1)
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            regresiones = comparar(resultados, json.load(f), args.tolerancia)
+        for benchmark, tamaño, antes, ahora in regresiones:
+            print(f"REGRESION {benchmark} {tamaño}: {antes:.3f} -> {ahora:.3f}")
+        if regresiones:
+            sys.exit(1)
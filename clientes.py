@@ -0,0 +1,113 @@
+"""
+Registro de clientes del bot: AccountAPI, TradeAPI, MarketAPI de OKX y el Spreadsheet de Google Sheets.
+
+Antes en cada corrida de main.run se creaban los clientes de nuevo y se abria el Google Sheet por nombre, lo que
+implica nuevas conexiones TLS y una autenticacion OAuth por minuto. Con el registro los clientes se crean una sola
+vez y se reutilizan:
+- Los clientes de OKX son httpx.Client, mantienen un pool de conexiones. Los creamos con un keep-alive mayor (ver
+  api_okx._KeepAlive) para que las conexiones sigan abiertas entre una corrida y la siguiente.
+- gspread renueva las credenciales solo cuando vencen, no hace falta volver a autenticar.
+
+Si un cliente falla (excepcion dentro de una llamada) se descarta y se vuelve a crear en el proximo uso, sin tocar
+los demas clientes.
+"""
+
+import threading
+
+import httpx
+import requests
+from google.auth.exceptions import GoogleAuthError
+from gspread.exceptions import APIError
+
+import api_okx
+import google_sheets
+import metricas
+
+
+class _Cliente:
+    """
+    Referencia a un cliente del registro. Busca el cliente en cada uso, por lo que sigue siendo valida aunque el
+    cliente se vuelva a crear, y si una llamada falla le avisa al registro para descartarlo.
+    """
+
+    def __init__(self, registry, nombre):
+        self._registry = registry
+        self._nombre = nombre
+
+    def __getattr__(self, attr):
+        valor = getattr(self._registry.get(self._nombre), attr)
+        if not callable(valor):
+            return valor
+
+        def llamada(*args, **kwargs):
+            try:
+                return valor(*args, **kwargs)
+            except Exception:
+                self._registry.invalidate(self._nombre)
+                raise
+
+        return llamada
+
+
+class ClientRegistry:
+    """
+    Crea los clientes la primera vez que se usan y los mantiene entre corridas.
+
+    Uso:
+        clientes = ClientRegistry(API_KEY, API_SECRET, PASSPHRASE, config.FILE_JSON, config.FILE_SHEET)
+        api_okx.get_usdt_balance(clientes.account_api)
+    """
+
+    def __init__(self, api_key, api_secret, passphrase, file_json, file_sheet, flag='1', keepalive_expiry=120,
+                 domain=api_okx.DOMAIN, sheet_factory=None):
+        """
+        :param flag: live trading: 0, demo trading: 1
+        :param keepalive_expiry: Segundos que se mantienen abiertas las conexiones de OKX sin uso
+        :param domain: Dominio de la api de OKX
+        :param sheet_factory: Funcion sin parametros que devuelve el Spreadsheet (por defecto lo abre con gspread)
+        """
+        # Los clientes de OKX ademas miden cada request (ver metricas.instrument_client)
+        self._factories = {
+            'account': lambda: metricas.instrument_client(
+                api_okx.get_account_api(api_key, api_secret, passphrase, flag, domain, keepalive_expiry)),
+            'trade': lambda: metricas.instrument_client(
+                api_okx.get_account_trade_api(api_key, api_secret, passphrase, flag, domain, keepalive_expiry)),
+            'md': lambda: metricas.instrument_client(
+                api_okx.get_account_md_api(flag, domain, keepalive_expiry)),
+            'sheet': sheet_factory or (lambda: google_sheets.get_google_sheet(file_json, file_sheet)),
+        }
+        self._clientes = {}
+        self._lock = threading.Lock()
+
+        self.account_api = _Cliente(self, 'account')
+        self.account_trade_api = _Cliente(self, 'trade')
+        self.client_md = _Cliente(self, 'md')
+        self.sheet = _Cliente(self, 'sheet')
+
+    def get(self, nombre):
+        """ Devuelve el cliente, creandolo si no existe o si fue descartado. """
+        with self._lock:
+            if nombre not in self._clientes:
+                self._clientes[nombre] = self._factories[nombre]()
+            return self._clientes[nombre]
+
+    def invalidate(self, nombre=None):
+        """ Descarta un cliente (o todos si nombre es None) para que se vuelva a crear en el proximo uso. """
+        with self._lock:
+            nombres = list(self._clientes) if nombre is None else [nombre]
+            for n in nombres:
+                cliente = self._clientes.pop(n, None)
+                if isinstance(cliente, httpx.Client):
+                    cliente.close()
+
+    def invalidate_for_error(self, error):
+        """
+        Descarta los clientes relacionados a un error que no paso por _Cliente, por ejemplo un error de una hoja
+        (Worksheet) de Google Sheets obtenida del Spreadsheet.
+        """
+        if isinstance(error, (APIError, GoogleAuthError, requests.RequestException)):
+            self.invalidate('sheet')
+        elif isinstance(error, httpx.HTTPError):
+            self.invalidate('account')
+            self.invalidate('trade')
+            self.invalidate('md')
@@ -4,3 +4,61 @@ HOJA_PARAMETROS = 'parametros'
 HOJA_OPERACIONES = 'operaciones'
 HOJA_POSICIONES = 'posiciones'
 HOJA_TESTEO = 'testeo'
+
+# Cantidad de velas confirmadas que guardamos por ticker
+VELAS_LIMIT = 300
+
+# Cantidad maxima de descargas de velas en paralelo (1 = secuencial)
+MAX_WORKERS_DATA = 8
+
+# Modo streaming: evalua stop loss y take profit con cada tick recibido por websocket (ver streaming.py)
+STREAMING = False
+
+# Calculo de indicadores: 'ta' (recalcula todo cada corrida), 'incremental' (solo procesa las velas nuevas) o
+# 'panel' (todos los tickers juntos con numpy)
+INDICADORES = 'ta'
+
+# Stop loss y take profit: True evalua el high y low de las velas desde la apertura y el mark price (ver salidas.py),
+# False solo el ultimo close
+SALIDA_INTRABAR = False
+
+# Stop loss y take profit en el exchange: True los adjunta a cada orden de apertura (attachAlgoOrds) y OKX cierra la
+# posicion, la corrida solo registra los cierres (ver functions.close_positions). Esas posiciones quedan marcadas en
+# la base local (tpsl_exchange); las demas, por ejemplo las abiertas antes de activarlo, el bot las sigue evaluando
+TPSL_EXCHANGE = False
+
+# Base de datos local de posiciones y operaciones (ver base_datos.py)
+DB_FILE = 'bot.db'
+
+# Cache de instrumentos (ctVal, minSz, lotSz): segundos de validez y archivo para los reinicios (None = sin archivo)
+INSTRUMENTS_TTL = 6 * 60 * 60
+INSTRUMENTS_SNAPSHOT = 'instruments_snapshot.json'
+
+# Seguimiento de ordenes (ver ordenes.py): canal privado 'orders' por websocket, primera espera y espera maxima en
+# segundos del polling por REST
+FILL_TRACKER_WS = False
+FILL_FIRST_DELAY = 0.05
+FILL_MAX_WAIT = 5
+
+# Envio de ordenes: aperturas por request del endpoint batch-orders (maximo 20, 1 = una orden por request) y
+# cantidad maxima de cierres en paralelo (1 = secuencial)
+ORDENES_BATCH_SIZE = 20
+MAX_WORKERS_ORDENES = 8
+
+# Carpeta del archivo local de velas (ver archivo.py), por ejemplo 'archivo_velas'. None = no guardar las velas
+ARCHIVO_VELAS = None
+
+# Planificador de corridas (ver planificador.py): segundos de espera despues del cierre de la vela y segundos de
+# atraso a partir de los cuales se informa la corrida como atrasada
+SCHEDULER_SETTLE = 1
+SCHEDULER_TOLERANCIA = 5
+
+# Metricas (ver metricas.py): puerto del endpoint http://127.0.0.1:<puerto>/metrics, por ejemplo 8000 (None = sin
+# servidor) y linea json con los tiempos de cada corrida
+METRICAS_PORT = None
+METRICAS_LOG = True
+
+# Alertas de Telegram (ver alertas.TelegramNotifier): mensajes pendientes como maximo (los mas viejos se descartan) e
+# intentos de envio de cada mensaje
+TELEGRAM_COLA = 100
+TELEGRAM_REINTENTOS = 5
@@ -0,0 +1,142 @@
+"""
+Estado de la cuenta de OKX en cada corrida: balance en USDT y posiciones abiertas.
+
+Antes cada corrida consultaba las posiciones dos veces (antes de cerrar y otra vez despues de abrir, para el margen
+y nocional de las posiciones nuevas) y el balance en el medio, tres requests seguidos.
+
+AccountState consulta el balance y las posiciones juntos, en paralelo, una vez al inicio de la corrida y los guarda.
+Despues de los cierres y aperturas aplica el resultado de las ordenes (pnl, fee, margen) sobre el balance guardado en
+lugar de volver a consultarlo. Si una orden no se puede aplicar (por ejemplo falta el ctVal del instrumento) los
+datos se invalidan y la proxima lectura los vuelve a consultar.
+
+Las posiciones solo se vuelven a consultar si hubo aperturas (refresh_positions): el margen y nocional de la hoja de
+posiciones son los que informa OKX, no una estimacion local.
+
+https://www.okx.com/docs-v5/en/#trading-account-rest-api-get-balance
+https://www.okx.com/docs-v5/en/#trading-account-rest-api-get-positions
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api_okx
+
+
+class AccountState:
+    """
+    Uso desde main.run_cycle:
+        usdt, posiciones_api = cuenta.refresh(account_api)
+        ... cierro posiciones
+        cuenta.apply_fills(to_sheets, parametros)
+        ... abro posiciones con cuenta.get_usdt(account_api)
+        cuenta.apply_fills(aperturas, parametros)
+        if aperturas:
+            functions.add_margen_positions(to_sheets, cuenta.refresh_positions(account_api))
+    """
+
+    def __init__(self):
+        self.usdt = None
+        self.positions = None  # formato de api_okx.get_positions_dict
+        self.time = None  # time.time() de la ultima consulta
+        self.valido = False
+        self.consultas = 0  # cantidad de consultas a OKX (balance y posiciones juntos)
+
+    def refresh(self, account_api):
+        """
+        Consulta el balance en USDT y las posiciones abiertas en paralelo.
+
+        :param account_api: Instancia de AccountAPI
+        :return: Tupla (usdt, posiciones)
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            usdt = executor.submit(api_okx.get_usdt_balance, account_api)
+            positions = executor.submit(api_okx.get_positions_dict, account_api)
+            self.usdt, self.positions = usdt.result(), positions.result()
+
+        self.time = time.time()
+        self.valido = True
+        self.consultas += 1
+        return self.usdt, self.positions
+
+    def refresh_positions(self, account_api):
+        """
+        Vuelve a consultar solo las posiciones abiertas, por ejemplo luego de las aperturas de la corrida.
+
+        :param account_api: Instancia de AccountAPI
+        :return: Diccionario de posiciones (ver api_okx.get_positions_dict)
+        """
+        self.positions = api_okx.get_positions_dict(account_api)
+        return self.positions
+
+    def invalidate(self):
+        """ Descarta los datos guardados, la proxima lectura los vuelve a consultar. """
+        self.valido = False
+
+    def get_usdt(self, account_api):
+        """ Balance en USDT, consulta solo si los datos no son validos. """
+        if not self.valido:
+            self.refresh(account_api)
+        return self.usdt
+
+    def get_positions(self, account_api):
+        """ Posiciones abiertas, consulta solo si los datos no son validos. """
+        if not self.valido:
+            self.refresh(account_api)
+        return self.positions
+
+    def apply_fills(self, list_sheets, parametros):
+        """
+        Aplica las ordenes ejecutadas de la corrida sobre el balance y las posiciones guardadas.
+
+        - close: borra la posicion y suma al balance el margen liberado, el pnl y el fee del cierre. Si la posicion
+          ya no estaba en los datos guardados, el balance consultado ya incluye el cierre y no se modifica.
+        - none: borra la posicion.
+        - open: resta del balance el margen estimado (nocional de la apertura sobre el leverage, con el ctVal del
+          instrumento) y el fee. La posicion no se agrega, sus datos se consultan con refresh_positions.
+
+        :param list_sheets: Operaciones con el formato de functions.work_sheets ('tipo' open, close o none)
+        :param parametros: Diccionario con los parámetros de cada ticker (con ctVal, ver functions.get_parametros)
+        """
+        if not self.valido:
+            return
+
+        for data in list_sheets:
+            ticker = data['ticker']
+
+            if 'close' in data['tipo']:
+                p = self.positions.pop(ticker, None)
+                if p is not None:
+                    self.usdt += p['margin'] + data.get('pnl', 0.) + data.get('fee', 0.)
+
+            elif 'none' in data['tipo']:
+                self.positions.pop(ticker, None)
+
+            elif 'open' in data['tipo']:
+                ctVal = parametros.get(ticker, {}).get('ctVal')
+                if not ctVal or not data.get('leverage'):
+                    self.invalidate()
+                    return
+
+                # estimacion del margen inicial en margen aislado, solo para el balance
+                margen = data['contratos'] * ctVal * data['avg_price'] / float(data['leverage'])
+                self.usdt += data['fee'] - margen
+
+
+if __name__ == '__main__':
+    """
+    Ejemplo: consulta la cuenta de demo trading y aplica una apertura simulada.
+    """
+    import pprint
+    from keys import API_KEY, API_SECRET, PASSPHRASE
+
+    account_api = api_okx.get_account_api(API_KEY, API_SECRET, PASSPHRASE)
+    cuenta = AccountState()
+
+    usdt, posiciones = cuenta.refresh(account_api)
+    print(f'Balance USDT {usdt}')
+    pprint.pprint(posiciones)
+
+    apertura = {'ticker': 'BTC-USDT-SWAP', 'tipo': 'open', 'side': 'long', 'avg_price': 60000., 'contratos': 1.6,
+                'fee': -0.048, 'leverage': 5}
+    cuenta.apply_fills([apertura], {'BTC-USDT-SWAP': {'ctVal': 0.001}})
+    print(f"Balance USDT luego de la apertura {cuenta.usdt}")
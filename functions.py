@@ -2,30 +2,48 @@
 En este modulo juntaremos diversas funciones necesarias para el funcionamiento del robot.
 """
 
-from alertas import send_telegram_message
-from api_okx import (get_historical_data_formatted, api_close_position, get_data_close_position, api_open_position,
-                     get_data_instruments, set_leverage, get_data_open_position)
+from api_okx import (api_close_position, api_close_positions, attach_tp_sl, get_close_order,
+                     get_data_close_position, api_open_positions, get_data_instruments, set_leverage)
+import config
 import google_sheets
 import indicadores
+import lotes
+import ordenes
+import salidas
+import velas
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from math import floor
 from time import sleep
 
+import numpy as np
+
 
 # Funciones para la estrategia de trading
-def get_data_tickers(parametros, client_md):
+def get_data_tickers(parametros, client_md, max_workers=config.MAX_WORKERS_DATA):
     """
     Descarga la data histórica de los tickers especificados en los parámetros.
+    Las velas se guardan en cache (ver velas.py), por lo que luego de la primera corrida solo se descargan las
+    velas nuevas de cada ticker.
+
+    Si max_workers es mayor a 1 las descargas se hacen en paralelo con un pool de threads, con a lo sumo
+    max_workers requests en vuelo. El limite de requests por segundo de OKX lo respeta api_okx.rate_limit.
 
     :param parametros (dict): Diccionario con los parámetros de cada ticker.
     :param client_md (object): Cliente para obtener datos del mercado.
+    :param max_workers (int): Cantidad maxima de descargas simultaneas (1 = secuencial).
     :return: Diccionario con los datos históricos de cada ticker.
     """
-    data = {}
-    for ticker, params in parametros.items():
-        timeframe = params['timeframe']
-        data[ticker] = get_historical_data_formatted(client_md, ticker, timeframe)
+    def descargar(ticker):
+        return velas.get_velas(client_md, ticker, parametros[ticker]['timeframe'], limit=config.VELAS_LIMIT)
+
+    if max_workers <= 1:
+        return {ticker: descargar(ticker) for ticker in parametros}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        resultados = executor.map(descargar, parametros)  # map mantiene el orden de los tickers
+        data = dict(zip(parametros, resultados))
 
     return data
 
@@ -39,47 +57,64 @@ def calculate_indicators(data, parametros):
     """
     Calculo los indicadores de los tickers
 
+    Segun config.INDICADORES:
+    - 'ta': recalcula todas las velas con la libreria ta en cada corrida
+    - 'incremental': mantiene el estado de cada indicador entre corridas y solo procesa las velas nuevas
+    - 'panel': calcula todos los tickers juntos sobre arrays de numpy (tickers x velas)
+
     :param data: Diccionario con los datos históricos de cada ticker.
     :param parametros: Diccionario con los parámetros de cada ticker.
     :return: Diccionario con los datos históricos de cada ticker, incluyendo los indicadores calculados.
     """
+    if config.INDICADORES == 'panel':
+        data.update(indicadores.add_indicadores_panel(data, parametros))
+        return data
+
     for ticker, df in data.items():
-        data[ticker] = indicadores.add_indicadores(df, parametros[ticker])
+        if config.INDICADORES == 'incremental':
+            data[ticker] = indicadores.add_indicadores_incremental(ticker, df, parametros[ticker])
+        else:
+            data[ticker] = indicadores.add_indicadores(df, parametros[ticker])
     return data
 
 
 def fx_set_leverage(account_trade_api, parametros):
     """
     Seteo el leverage de los tickers
+    Uso la cache de leverage de api_okx, si el leverage no cambio no se hace ningun request
     """
     for p in parametros:
-        set_leverage(account_trade_api, p, parametros[p]['leverage'])
+        set_leverage(account_trade_api, p, parametros[p]['leverage'], cache=True)
 
 
 # Funciones para la operar
-def should_close_position(posicion, data, ticker):
+def should_close_position(posicion, mercado, ticker):
     """
     Analiza si se debe cerrar una posición basándose en el stop loss y take profit.
+
+    Con config.SALIDA_INTRABAR se evaluan el high y low de las velas desde la apertura de la posicion y el mark price
+    (ver salidas.evaluate_exit), si no solo el ultimo close.
+
     :param posicion: Diccionario con los datos de la posición.
-    :param data: Diccionario con los datos históricos de cada ticker.
+    :param mercado: Instancia de mercado.MarketSnapshot de la corrida.
     :param ticker: Ticker de la posición.
     :return: Tupla con un booleano indicando si se debe cerrar la posición y el motivo.
     """
 
-    stop_loss = posicion['stop_loss']
-    take_profit = posicion['take_profit']
-    side = posicion['side']
-    last_price = get_last_price(data)[ticker]
+    if config.SALIDA_INTRABAR:
+        salida = salidas.evaluate_exit(posicion, mercado.velas(ticker), mercado.mark_price(ticker))
+        if salida is None:
+            return False, None
+        print(f"{ticker}: {salida['motivo']} tocado por {salida['fuente']} {salida['time'] or ''} "
+              f"a {salida['precio']}")
+        return True, salida['motivo']
 
-    if last_price <= stop_loss if side == 'long' else last_price >= stop_loss:
-        return True, 'stop loss'
-    elif last_price >= take_profit if side == 'long' else last_price <= take_profit:
-        return True, 'take profit'
+    last_price = mercado.last_price(ticker)
 
-    return False, None
+    return salidas.check_stop_loss_take_profit(posicion, last_price)
 
 
-def should_open_position(data, parametros):
+def should_open_position(indicadores, parametros):
     """
     Analiza si se debe abrir una nueva posición basándose en los indicadores técnicos.
 
@@ -95,15 +130,15 @@ def should_open_position(data, parametros):
         - Si rsi > 50 -> abrimos posicion short
         - Si rsi < 50 -> abrimos posicion long
 
-    :param data: DataFrame con los datos históricos del ticker.
+    :param indicadores: Diccionario con los valores actuales de ADX, RSI y cruce (ver mercado.MarketSnapshot).
     :param parametros: Diccionario con los parámetros del ticker.
     :return: Tupla con un booleano indicando si se debe abrir la posición, el lado de la posición y el motivo.
     """
 
-    # Obtenemos los indicadores de la ultima fila, es decir, los actuales
-    adx = data['ADX'].iloc[-1]
-    rsi = data['RSI'].iloc[-1]
-    cruce = data['cruce'].iloc[-1]
+    # Obtenemos los indicadores de la ultima vela, es decir, los actuales
+    adx = indicadores['ADX']
+    rsi = indicadores['RSI']
+    cruce = indicadores['cruce']
 
     # Obtenemos los parametros
     adx_limit = parametros['adx']
@@ -126,7 +161,7 @@ def should_open_position(data, parametros):
     return False, None, None
 
 
-def close_positions(posiciones, posiciones_api, data, account_trade_api, list_alertas, list_sheets):
+def close_positions(posiciones, posiciones_api, mercado, account_trade_api, list_alertas, list_sheets):
     """
 
     Verifica si cierra alguna posicion.
@@ -135,18 +170,53 @@ def close_positions(posiciones, posiciones_api, data, account_trade_api, list_al
             Consulta la orden
             Guarda en alertas y en sheets. En sheets va a posiciones y en operaciones.
 
+    Primero se envian todas las ordenes de cierre, en paralelo (ver api_okx.api_close_positions), y luego se esperan
+    todas juntas (ver ordenes.wait_fills).
+
     Si la posicion de sheets no esta en la posicion de la api, entonces la borra de sheets y manda un mensaje a telegram
 
+    Si la orden de cierre se envio pero no se pudo consultar, la posicion queda marcada con el cierre pendiente (ver
+    pending_close) y en las corridas siguientes se vuelve a buscar la orden (ver resolve_pending_close), en lugar de
+    borrarla sin registrar el cierre.
+
+    Las posiciones abiertas con config.TPSL_EXCHANGE (marca tpsl_exchange, ver open_positions) tienen el take profit
+    y stop loss en OKX: el bot no las evalua y solo registra los cierres, si la posicion ya no esta en la api busca
+    la orden de cierre (ver reconcile_close). Las demas, por ejemplo las abiertas antes de activar el modo, se
+    evaluan como siempre.
+
     :param posiciones:
+    :param mercado: Instancia de mercado.MarketSnapshot de la corrida (ultimo precio de cada ticker)
     :return:
     """
 
     # print('Cerrando posiciones')
 
     posiciones_cerradas = []
+    pedidos = []
     for p in posiciones:
 
+        # Cierre enviado en una corrida anterior que no se pudo consultar
+        if p.get('cierre_pendiente'):
+            estado = resolve_pending_close(p, posiciones_api, account_trade_api, list_alertas, list_sheets)
+            if estado == 'cerrada':
+                posiciones_cerradas.append(p['ticker'])
+            if estado != 'abierta':
+                continue
+
         if p['ticker'] not in posiciones_api:
+            # Con el take profit y stop loss en el exchange, la cerro OKX
+            if p.get('tpsl_exchange'):
+                try:
+                    cerrada = reconcile_close(p, account_trade_api, list_alertas, list_sheets)
+                except Exception as e:
+                    # Sin el historial de OKX no se borra la posicion, se vuelve a buscar en la proxima corrida
+                    print(f"Error al buscar la orden de cierre de {p['ticker']}: {e}")
+                    list_alertas.append(f"Error al buscar la orden de cierre de {p['ticker']}: {e}")
+                    continue
+                if cerrada:
+                    posiciones_cerradas.append(p['ticker'])
+                    continue
+
             # Si la posicion de sheets no esta en la posicion de la api, entonces la borra de sheets y manda un mensaje a telegram
             print(f'Posicion {p["ticker"]} no esta en la api')
             list_alertas.append(f'Posicion {p["ticker"]} no esta en la api')
@@ -154,40 +224,195 @@ def close_positions(posiciones, posiciones_api, data, account_trade_api, list_al
             list_sheets.append(data_close)
             continue
 
+        if p.get('tpsl_exchange'):
+            continue
+
         margen = round(posiciones_api[p['ticker']]['margin'], 2)
         nocional = round(posiciones_api[p['ticker']]['notionalUsd'], 2)
 
         # Analizo si cierro la posicion
-        close_position, motivo = should_close_position(p, data, p['ticker'])
+        close_position, motivo = should_close_position(p, mercado, p['ticker'])
 
         if close_position:
-            # Cierro la posicion
-            ticker = p['ticker']
-            pos_side = p['side']
-            clOrdId = api_close_position(ticker, pos_side, account_trade_api)
-            sleep(0.1)  # Espero un poco para que se ejecute correctamente la orden market
-
-            # Consulto la orden
-            data_close = get_data_close_position(account_trade_api, ticker, clOrdId)
-
-            data_close['ticker'] = ticker
-            data_close['tipo'] = 'close'
-            data_close['side'] = pos_side
-            data_close['margen'] = margen
-            data_close['nocional'] = nocional
-            data_close['leverage'] = p['leverage']
-            data_close['motivo'] = motivo
-
-            print(f'Posicion cerrada {ticker} por {motivo}')
-
-            posiciones_cerradas.append(p['ticker'])
-            list_alertas.append(f"Cierro posicion {p['ticker']} por {motivo}")
-            list_sheets.append(data_close)
+            pedidos.append((p, motivo, margen, nocional))
+
+    # Envio todas las ordenes de cierre, las consulto despues juntas
+    clOrdIds = api_close_positions([(p['ticker'], p['side']) for p, _, _, _ in pedidos], account_trade_api,
+                                   max_workers=config.MAX_WORKERS_ORDENES)
+
+    enviados = []
+    for (p, motivo, margen, nocional), clOrdId in zip(pedidos, clOrdIds):
+        if clOrdId is None:
+            list_alertas.append(f"Error al cerrar la posicion {p['ticker']} por {motivo}")
+            continue
+        enviados.append((p, motivo, margen, nocional, clOrdId))
+        posiciones_cerradas.append(p['ticker'])
+    pedidos = enviados
+
+    # Espero la ejecucion de todas las ordenes de cierre
+    fills = ordenes.wait_fills(account_trade_api, [(p['ticker'], clOrdId, True) for p, _, _, _, clOrdId in pedidos])
+
+    for p, motivo, margen, nocional, clOrdId in pedidos:
+        if clOrdId not in fills:
+            pending_close(p, motivo, clOrdId, list_alertas, list_sheets)
+            continue
+        record_close(p, motivo, margen, nocional, fills[clOrdId], list_alertas, list_sheets)
 
     return posiciones_cerradas
 
 
-def open_positions(parametros, posiciones, posiciones_cerradas, usdt, data, account_trade_api, list_alertas, list_sheets):
+def close_single_position(posicion, motivo, margen, nocional, account_trade_api, list_alertas, list_sheets):
+    """
+    Cierra una posicion: envia la orden, consulta la orden y guarda en alertas y en sheets.
+
+    :param posicion: Diccionario con los datos de la posición (de la hoja de posiciones).
+    :param motivo: Motivo del cierre ('stop loss', 'take profit').
+    :param margen: Margen de la posicion.
+    :param nocional: Nocional de la posicion.
+    :return: Diccionario con los datos del cierre, None si no se pudo consultar la orden (queda como cierre
+             pendiente, ver pending_close).
+    """
+    ticker = posicion['ticker']
+    clOrdId = api_close_position(ticker, posicion['side'], account_trade_api)
+
+    # Consulto la orden
+    data_close = get_data_close_position(account_trade_api, ticker, clOrdId)
+    if data_close is None:
+        pending_close(posicion, motivo, clOrdId, list_alertas, list_sheets)
+        return None
+
+    return record_close(posicion, motivo, margen, nocional, data_close, list_alertas, list_sheets)
+
+
+def record_close(posicion, motivo, margen, nocional, data_close, list_alertas, list_sheets):
+    """
+    Completa los datos de una orden de cierre ya ejecutada y la guarda en alertas y en sheets.
+
+    :param data_close: Datos de la orden con el formato de api_okx.parse_order
+    :return: Diccionario con los datos del cierre.
+    """
+    ticker = posicion['ticker']
+
+    data_close['ticker'] = ticker
+    data_close['tipo'] = 'close'
+    data_close['side'] = posicion['side']
+    data_close['margen'] = margen
+    data_close['nocional'] = nocional
+    data_close['leverage'] = posicion['leverage']
+    data_close['motivo'] = motivo
+
+    print(f'Posicion cerrada {ticker} por {motivo}')
+
+    list_alertas.append(f"Cierro posicion {ticker} por {motivo}")
+    list_sheets.append(data_close)
+
+    return data_close
+
+
+def pending_close(posicion, motivo, clOrdId, list_alertas, list_sheets):
+    """
+    Marca una posicion con un cierre pendiente: la orden de cierre se envio pero no se pudo consultar. La marca se
+    guarda en la base local (tipo 'pendiente', ver base_datos.write_batch) y la orden se vuelve a buscar en la
+    proxima corrida (ver resolve_pending_close).
+
+    :param posicion: Diccionario con los datos de la posición, se modifica
+    :param motivo: Motivo del cierre
+    :param clOrdId: ID de la orden de cierre
+    """
+    posicion['cierre_pendiente'] = clOrdId
+    posicion['motivo_pendiente'] = motivo
+
+    print(f"No se pudo consultar la orden de cierre {clOrdId} de {posicion['ticker']}")
+    list_alertas.append(f"No se pudo consultar la orden de cierre de {posicion['ticker']}, se vuelve a consultar en "
+                        f"la proxima corrida")
+    list_sheets.append({'ticker': posicion['ticker'], 'tipo': 'pendiente', 'cierre_pendiente': clOrdId,
+                        'motivo_pendiente': motivo})
+
+
+def resolve_pending_close(posicion, posiciones_api, account_trade_api, list_alertas, list_sheets):
+    """
+    Busca la orden de un cierre pendiente (ver pending_close).
+
+    - Si la posicion sigue abierta en la api el cierre no se ejecuto: se borra la marca y la posicion se evalua como
+      cualquier otra.
+    - Si no, se consulta la orden por su clOrdId y si no aparece se busca en el historial (ver
+      api_okx.get_close_order). Si se encuentra se registra el cierre con el motivo original.
+    - Si tampoco se encuentra la posicion sigue pendiente y se avisa por telegram, no se borra sin registrar el
+      cierre.
+
+    :param posicion: Diccionario con los datos de la posición (con cierre_pendiente y motivo_pendiente)
+    :param posiciones_api: Posiciones abiertas en OKX (ver api_okx.get_positions_dict)
+    :return: 'cerrada' si se registro el cierre, 'pendiente' si no se encontro la orden o 'abierta' si la posicion
+             sigue abierta
+    """
+    ticker = posicion['ticker']
+    clOrdId, motivo = posicion['cierre_pendiente'], posicion.get('motivo_pendiente')
+
+    if ticker in posiciones_api:
+        print(f"La orden de cierre {clOrdId} de {ticker} no se ejecuto, la posicion sigue abierta")
+        posicion['cierre_pendiente'] = posicion['motivo_pendiente'] = None
+        list_sheets.append({'ticker': ticker, 'tipo': 'pendiente', 'cierre_pendiente': None,
+                            'motivo_pendiente': None})
+        return 'abierta'
+
+    try:
+        data_close = get_data_close_position(account_trade_api, ticker, clOrdId)
+        if data_close is None:
+            data_close = get_close_order(account_trade_api, ticker, posicion['side'],
+                                         salidas.execution_ms(posicion.get('execution_time')))
+    except Exception as e:
+        print(f"Error al consultar el cierre pendiente de {ticker}: {e}")
+        data_close = None
+
+    if not data_close:
+        list_alertas.append(f"Cierre pendiente de {ticker}: no se encontro la orden {clOrdId}")
+        return 'pendiente'
+
+    record_close(posicion, motivo, posicion.get('margen'), posicion.get('nocional'), data_close, list_alertas,
+                 list_sheets)
+    return 'cerrada'
+
+
+def reconcile_close(posicion, account_trade_api, list_alertas, list_sheets):
+    """
+    Registra el cierre de una posicion que cerro el exchange, con el take profit o stop loss adjunto a la orden de
+    apertura (config.TPSL_EXCHANGE). Busca la orden de cierre en el historial de OKX y el motivo es el nivel mas
+    cercano al precio de ejecucion.
+
+    :param posicion: Diccionario con los datos de la posición (de la hoja de posiciones).
+    :return: Diccionario con los datos del cierre, o None si no se encontro la orden de cierre.
+    """
+    data_close = get_close_order(account_trade_api, posicion['ticker'], posicion['side'],
+                                 salidas.execution_ms(posicion.get('execution_time')))
+    if not data_close:
+        return None
+
+    precio = data_close['avg_price']
+    motivo = 'stop loss' if abs(precio - posicion['stop_loss']) <= abs(precio - posicion['take_profit']) \
+        else 'take profit'
+
+    return record_close(posicion, motivo, posicion.get('margen'), posicion.get('nocional'), data_close, list_alertas,
+                        list_sheets)
+
+
+def calculate_tp_sl(side, price, parametros):
+    """
+    Calcula el take profit y stop loss de una posicion.
+
+    :param side: Lado de la posición ('long' o 'short')
+    :param price: Precio de referencia (precio de ejecucion, o el ultimo precio si se adjuntan a la orden)
+    :param parametros: Diccionario con los parámetros del ticker (take_profit y stop_loss en proporcion)
+    :return: Tupla (take_profit, stop_loss)
+    """
+    parametros_tp = parametros['take_profit']
+    parametros_sl = parametros['stop_loss']
+
+    if side == 'long':
+        return price * (1 + parametros_tp), price * (1 - parametros_sl)
+    return price * (1 - parametros_tp), price * (1 + parametros_sl)
+
+
+def open_positions(parametros, posiciones, posiciones_cerradas, usdt, mercado, account_trade_api, list_alertas, list_sheets):
     """
     Funcion para abrir nuevas posiciones.
 
@@ -197,19 +422,24 @@ def open_positions(parametros, posiciones, posiciones_cerradas, usdt, data, acco
     - Veo si me alcanza el dinero en base al margen y leverage
     - Analizo si abro la posicion, caso positivo:
         calculo el tamaño
-        envio la orden
+        disminuyo el usdt disponible
+    - Envio todas las ordenes juntas, de a 20 por request (ver api_okx.api_open_positions)
+    - Espero la ejecucion de todas las ordenes juntas (ver ordenes.wait_fills) y para cada una:
         consulto la orden
         calculo tp y sl
         guardo en alertas
         guardo en sheets (posiciones y en operaciones)
 
-        disminuyo el usdt disponible
+    Con config.TPSL_EXCHANGE el tp y sl se calculan con el ultimo precio antes de enviar la orden y se adjuntan a la
+    orden (ver api_okx.attach_tp_sl), asi OKX cierra la posicion sin esperar a la proxima corrida. En la hoja se
+    guardan esos mismos niveles y en la base local la marca tpsl_exchange (ver close_positions).
 
+    :param mercado: Instancia de mercado.MarketSnapshot de la corrida, con los indicadores ya calculados
     :return:
     """
 
-    tickers_abiertos = [p['ticker'] for p in posiciones]
-    last_price = get_last_price(data)
+    tickers_abiertos = {p['ticker'] for p in posiciones}
+    pedidos = []
 
     for p in parametros:
         ticker = p
@@ -226,58 +456,72 @@ def open_positions(parametros, posiciones, posiciones_cerradas, usdt, data, acco
             continue
 
         # Analizo si abro la posicion
-        open_position, side, motivo = should_open_position(data=data[parametros[p]['ticker']], parametros=parametros[p])
+        open_position, side, motivo = should_open_position(mercado.indicadores(ticker), parametros=parametros[p])
 
         if open_position:
 
-            price = last_price[ticker]
+            price = mercado.last_price(ticker)
 
             # Calculo el tamaño
             quantity = calculate_size(parametros[p], price)
 
-            # Abro la posicion
             ticker = parametros[p]['ticker']
 
-            # print(f"Abriendo posicion {ticker} por {motivo} side {side} con {quantity} contratos")
+            # Take profit y stop loss adjuntos a la orden
+            adjuntos = None
+            if config.TPSL_EXCHANGE:
+                tp, sl = calculate_tp_sl(side, price, parametros[p])
+                adjuntos = attach_tp_sl(tp, sl, parametros[p].get('tickSz'))
 
-            clOrdId, code = api_open_position(ticker, side, quantity, account_trade_api)
+            pedidos.append((p, ticker, side, motivo, quantity, adjuntos))
 
-            if code != '0':
-                print(f"*********\n\nError al abrir la posicion {ticker}\n\n*********\n\n ")
-                list_alertas.append(f"Error al abrir la posicion {ticker} por {motivo} side {side} con {quantity} contratos")
-                continue
+            # Disminuyo el usdt disponible
+            usdt -= parametros[p]['margen']
+
+    # Abro las posiciones
+    respuestas = api_open_positions([(ticker, side, quantity, adjuntos)
+                                     for _, ticker, side, _, quantity, adjuntos in pedidos],
+                                    account_trade_api, batch_size=config.ORDENES_BATCH_SIZE)
 
-            sleep(1)
+    enviados = []
+    for (p, ticker, side, motivo, quantity, adjuntos), (clOrdId, code) in zip(pedidos, respuestas):
+        if code != '0':
+            print(f"*********\n\nError al abrir la posicion {ticker}\n\n*********\n\n ")
+            list_alertas.append(f"Error al abrir la posicion {ticker} por {motivo} side {side} con {quantity} contratos")
+            continue
+        enviados.append((p, ticker, side, motivo, quantity, adjuntos, clOrdId))
+    pedidos = enviados
 
-            # Consulto la orden
-            data_open = get_data_open_position(account_trade_api, ticker, clOrdId)
+    # Espero la ejecucion de todas las ordenes de apertura
+    fills = ordenes.wait_fills(account_trade_api, [(ticker, clOrdId, False) for _, ticker, _, _, _, _, clOrdId in pedidos])
 
-            # Calculo el take profit y stop loss
-            parametros_tp = parametros[p]['take_profit']
-            parametros_sl = parametros[p]['stop_loss']
+    for p, ticker, side, motivo, quantity, adjuntos, clOrdId in pedidos:
 
-            if side == 'long':
-                tp = data_open['avg_price'] * (1 + parametros_tp)
-                sl = data_open['avg_price'] * (1 - parametros_sl)
-            else:
-                tp = data_open['avg_price'] * (1 - parametros_tp)
-                sl = data_open['avg_price'] * (1 + parametros_sl)
+        # Consulto la orden
+        if clOrdId not in fills:
+            list_alertas.append(f"No se pudo consultar la orden de apertura de {ticker}")
+            continue
+        data_open = fills[clOrdId]
 
-            data_open['ticker'] = ticker
-            data_open['tipo'] = 'open'
-            data_open['side'] = side
-            data_open['take_profit'] = tp
-            data_open['stop_loss'] = sl
-            data_open['leverage'] = parametros[p]['leverage']
-            data_open['motivo'] = motivo
+        # Calculo el take profit y stop loss, si estan en el exchange guardo los niveles enviados
+        if adjuntos:
+            tp, sl = float(adjuntos[0]['tpTriggerPx']), float(adjuntos[0]['slTriggerPx'])
+        else:
+            tp, sl = calculate_tp_sl(side, data_open['avg_price'], parametros[p])
 
-            print(f"Posicion abierta {ticker} por {motivo} side {side} con {quantity} contratos")
+        data_open['ticker'] = ticker
+        data_open['tipo'] = 'open'
+        data_open['side'] = side
+        data_open['take_profit'] = tp
+        data_open['stop_loss'] = sl
+        data_open['leverage'] = parametros[p]['leverage']
+        data_open['motivo'] = motivo
+        data_open['tpsl_exchange'] = 1 if adjuntos else 0
 
-            list_alertas.append(f"Abro posicion {ticker} por {motivo} side {side}")
-            list_sheets.append(data_open)
+        print(f"Posicion abierta {ticker} por {motivo} side {side} con {quantity} contratos")
 
-            # Disminuyo el usdt disponible
-            usdt -= parametros[p]['margen']
+        list_alertas.append(f"Abro posicion {ticker} por {motivo} side {side}")
+        list_sheets.append(data_open)
 
 
 def adj_quantity(value, tick):
@@ -287,6 +531,8 @@ def adj_quantity(value, tick):
     :param value: cantidad a operar previo al ajuste
     :param tick: 'lotSz' del contrato del ticker
     :return: cantidad ajustada para operar
+
+    calculate_size usa lotes.quantize, con la misma regla y aritmetica exacta (ver lotes.py)
     """
 
     tick = float(tick)
@@ -350,7 +596,8 @@ def calculate_size(parametros, price):
     https://www.okx.com/es-es/trade-market/info/swap
 
     En base al multiplicador, margen y leverage calculamos la cantidad de contratos.
-    La cantidad final se ajusta segun el 'lotSz' del ticker
+    La cantidad final se ajusta segun el 'lotSz' del ticker (ver lotes.py), con la escala y paso guardados en los
+    datos del instrumento (lotEscala y lotPaso) o calculados del lotSz si no estan.
 
     :param parametros:
     :param margen:
@@ -369,7 +616,7 @@ def calculate_size(parametros, price):
     quantity = margen * leverage / contract_value
 
     # Ajusto la cantidad de contratos
-    quantity = adj_quantity(quantity, parametros['lotSz'])
+    quantity = lotes.quantize(quantity, *lot_step(parametros))
 
     # Si la cantidad de contratos es menor al minSz, devuelvo 0
     if quantity < parametros['minSz']:
@@ -378,6 +625,26 @@ def calculate_size(parametros, price):
     return quantity
 
 
+def calculate_sizes(parametros, prices):
+    """
+    Igual que calculate_size para un array de precios (ver lotes.quantize_array), por ejemplo todos los close de un
+    backtest.
+
+    :return: Array con la cantidad de contratos para cada precio, 0 si no alcanza el minSz
+    """
+    quantity = parametros['margen'] * parametros['leverage'] / (parametros['ctVal'] * np.asarray(prices, float))
+    quantity = lotes.quantize_array(quantity, *lot_step(parametros))
+    quantity[quantity < parametros['minSz']] = 0
+    return quantity
+
+
+def lot_step(parametros):
+    """ Escala y paso del lotSz del ticker (ver lotes.lot_step). """
+    if 'lotEscala' in parametros:
+        return parametros['lotEscala'], parametros['lotPaso']
+    return lotes.lot_step(parametros['lotSz'])
+
+
 # Funciones para la adminstracion de la operatoria
 
 def add_margen_positions(list_sheet, positions_api):
@@ -407,15 +674,45 @@ def usdt_available(usdt, margen, ratio=0.99):
         return False
 
 
-def get_parametros(account_api, sheet, hoja_parametros='parametros'):
+# Tickers con timeframe no soportado ya informados por telegram, para avisar una sola vez
+_timeframes_avisados = set()
+
+
+def check_timeframes(parametros, list_alertas=None):
+    """
+    Descarta las filas de la hoja de parametros con un timeframe no soportado (ver velas.check_bar), por ejemplo
+    las velas mensuales. Se informa por consola en cada lectura y por telegram una sola vez por ticker y timeframe.
+
+    :param parametros: Lista de diccionarios leida de la hoja de parametros
+    :param list_alertas: Lista de alertas a enviar a telegram (opcional)
+    :return: Lista con las filas validas
+    """
+    validos = []
+    for p in parametros:
+        try:
+            velas.check_bar(p['timeframe'])
+        except ValueError as e:
+            mensaje = f"Ticker {p['ticker']} descartado: {e}"
+            print(mensaje)
+            if list_alertas is not None and (p['ticker'], p['timeframe']) not in _timeframes_avisados:
+                _timeframes_avisados.add((p['ticker'], p['timeframe']))
+                list_alertas.append(mensaje)
+            continue
+        validos.append(p)
+    return validos
+
+
+def get_parametros(account_api, sheet, hoja_parametros='parametros', list_alertas=None):
     """
     Obtenemos los parametros de la hoja de google sheets y le agrego ciertas cosas de los instruments
+    Los tickers con un timeframe no soportado se descartan (ver check_timeframes)
 
     """
-    parametros = google_sheets.read_all_sheet(sheet, hoja_parametros)
+    parametros = check_timeframes(google_sheets.read_all_sheet(sheet, hoja_parametros), list_alertas)
     parametros_dict = {p['ticker']: p for p in parametros}
 
-    instruments = get_data_instruments(account_api, tickers=parametros_dict.keys())
+    instruments = get_data_instruments(account_api, tickers=parametros_dict.keys(), ttl=config.INSTRUMENTS_TTL,
+                                       snapshot_file=config.INSTRUMENTS_SNAPSHOT)
 
     parametros_final = {}
 
@@ -433,15 +730,6 @@ def get_parametros(account_api, sheet, hoja_parametros='parametros'):
     return parametros_final
 
 
-def send_telegram_messages(list_alertas, bot_token, chat_id_list):
-    """
-    Envio los mensajes a telegram
-    """
-    for alerta in list_alertas:
-        send_telegram_message(bot_token, alerta, chat_id_list)
-
-    print(f"Mensaje enviado exitosamente a chat_id: {chat_id_list}")
-
 def work_sheets(list_sheets, sheet, sheet_operaciones='operaciones', sheet_posiciones='posiciones'):
     """
     Trabajo con la base de datos de google sheets
@@ -452,19 +740,10 @@ def work_sheets(list_sheets, sheet, sheet_operaciones='operaciones', sheet_posic
     Al cerrar una posicion:
         - escribo la operacion en la hoja de operaciones
         - borro la posicion de la hoja de posiciones
-    """
-    for data in list_sheets:
 
-        if 'open' in data['tipo']:  # Si es una operacion de apertura
-            google_sheets.add_operation(sheet, data, sheet_operaciones)
-            google_sheets.add_position(sheet, data, sheet_posiciones)
-
-        elif 'close' in data['tipo']:  # Si es una operacion de cierre
-            google_sheets.add_operation(sheet, data, sheet_operaciones)
-            google_sheets.delete_position(sheet, data['ticker'], sheet_posiciones)
-
-        elif 'none' in data['tipo']:  # esta en sheets pero no en okx
-            google_sheets.delete_position(sheet, data['ticker'], sheet_posiciones)
+    Todas las escrituras de la corrida se envian juntas en un solo batchUpdate (ver google_sheets.write_batch)
+    """
+    google_sheets.write_batch(sheet, list_sheets, sheet_operaciones, sheet_posiciones)
 
 
 def sleep_until_next_minute():
@@ -1,6 +1,7 @@
 import gspread
 from google.auth.exceptions import GoogleAuthError
 from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound
+import numbers
 import pprint
 from typing import List, Dict, Any
 
@@ -56,13 +57,30 @@ def read_all_sheet(gs: gspread.Spreadsheet, sheet_name: str) -> List[Dict[str, A
     return sheet.get_all_records()
 
 
-def add_position(gs: gspread.Spreadsheet, data: Dict[str, Any], sheet_name: str = 'posiciones') -> None:
+def write_sheet(gs: gspread.Spreadsheet, rows: List[Dict[str, Any]], sheet_name: str) -> None:
     """
-    Agrega una nueva posición a la hoja de posiciones.
+    Reemplaza el contenido de una hoja por las filas recibidas, con el encabezado tomado de las claves de la primera
+    fila (el formato inverso a read_all_sheet).
 
     :param gs: Objeto Spreadsheet de gspread
+    :param rows: Lista de diccionarios, todos con las mismas claves
+    :param sheet_name: Nombre de la hoja de cálculo
+    """
+    sheet = get_sheet(gs, sheet_name)
+    sheet.clear()
+    if rows:
+        header = list(rows[0].keys())
+        values = [header] + [[float(r[k]) if isinstance(r[k], numbers.Real) and not isinstance(r[k], bool) else r[k]
+                              for k in header] for r in rows]
+        sheet.update(values=values, range_name='A1')
+
+
+def position_row(data: Dict[str, Any]) -> List[Any]:
+    """
+    Genera la fila de la hoja de posiciones a partir de los datos de la posición.
+
     :param data: Diccionario con los datos de la posición
-    :param sheet_name: Nombre de la hoja de posiciones (por defecto 'posiciones')
+    :return: Lista con los valores en el orden de las columnas de la hoja
     """
 
     # reorganizo los datos para que coincidan con las columnas
@@ -70,19 +88,15 @@ def add_position(gs: gspread.Spreadsheet, data: Dict[str, Any], sheet_name: str
                'stop_loss', 'take_profit', 'fee']
 
     # genero una lista en base al orden de las columnas
-    data = [data[col] for col in columns]
-
-    sheet = get_sheet(gs, sheet_name)  # obtengo la hoja de posiciones
-    sheet.append_row(data)  # agrego la fila a continuación de la última fila con datos
+    return [data[col] for col in columns]
 
 
-def add_operation(gs: gspread.Spreadsheet, data: Dict[str, Any], sheet_name: str = 'operaciones') -> None:
+def operation_row(data: Dict[str, Any]) -> List[Any]:
     """
-    Agrega una nueva operación a la hoja de operaciones.
+    Genera la fila de la hoja de operaciones a partir de los datos de la operación.
 
-    :param gs: Objeto Spreadsheet de gspread
     :param data: Diccionario con los datos de la operación
-    :param sheet_name: Nombre de la hoja de operaciones (por defecto 'operaciones')
+    :return: Lista con los valores en el orden de las columnas de la hoja
     """
 
     # reorganizo los datos para que coincidan con las columnas
@@ -94,7 +108,34 @@ def add_operation(gs: gspread.Spreadsheet, data: Dict[str, Any], sheet_name: str
         columns.append('pnl')
 
     # genero una lista en base al orden de las columnas
-    data = [data[col] for col in columns]
+    return [data[col] for col in columns]
+
+
+def add_position(gs: gspread.Spreadsheet, data: Dict[str, Any], sheet_name: str = 'posiciones') -> None:
+    """
+    Agrega una nueva posición a la hoja de posiciones.
+
+    :param gs: Objeto Spreadsheet de gspread
+    :param data: Diccionario con los datos de la posición
+    :param sheet_name: Nombre de la hoja de posiciones (por defecto 'posiciones')
+    """
+
+    data = position_row(data)
+
+    sheet = get_sheet(gs, sheet_name)  # obtengo la hoja de posiciones
+    sheet.append_row(data)  # agrego la fila a continuación de la última fila con datos
+
+
+def add_operation(gs: gspread.Spreadsheet, data: Dict[str, Any], sheet_name: str = 'operaciones') -> None:
+    """
+    Agrega una nueva operación a la hoja de operaciones.
+
+    :param gs: Objeto Spreadsheet de gspread
+    :param data: Diccionario con los datos de la operación
+    :param sheet_name: Nombre de la hoja de operaciones (por defecto 'operaciones')
+    """
+
+    data = operation_row(data)
 
     sheet = get_sheet(gs, sheet_name)  # obtengo la hoja de operaciones
     sheet.append_row(data)  # agrego la fila a continuación de la última fila con datos
@@ -123,6 +164,90 @@ def delete_position(gs: gspread.Spreadsheet, ticker: str, sheet_name: str = 'pos
     print(f"No se encontró ninguna posición con el ticker '{ticker}'.")  # si no se encontró la posición
 
 
+def _cell(value: Any) -> Dict[str, Any]:
+    """ Convierte un valor al formato CellData de la api de Google Sheets (equivalente a escribir en modo RAW). """
+    if value is None:
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, numbers.Real):  # incluye los tipos de numpy
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def write_batch(gs: gspread.Spreadsheet, list_sheets: List[Dict[str, Any]], sheet_operaciones: str = 'operaciones',
+                sheet_posiciones: str = 'posiciones') -> None:
+    """
+    Escribe todas las operaciones de la corrida en un solo batchUpdate.
+
+    En lugar de un append_row por operación y un get_all_records por cada posición a borrar, hacemos:
+    1. Una lectura de los metadatos de las hojas (ids)
+    2. Una lectura de la columna de tickers de la hoja de posiciones, solo si hay posiciones para borrar
+    3. Un batchUpdate con el borrado de filas (de abajo hacia arriba para no correr los indices) y los appends
+       de ambas hojas
+
+    :param gs: Objeto Spreadsheet de gspread
+    :param list_sheets: Lista de operaciones con el formato de functions.work_sheets ('tipo' open, close o none)
+    :param sheet_operaciones: Nombre de la hoja de operaciones
+    :param sheet_posiciones: Nombre de la hoja de posiciones
+    """
+    if not list_sheets:
+        return
+
+    rows_operaciones = []
+    rows_posiciones = {}  # ticker -> fila, una posicion abierta y cerrada en el mismo lote no se escribe
+    tickers_borrar = []
+
+    for data in list_sheets:
+        if 'open' in data['tipo']:
+            rows_operaciones.append(operation_row(data))
+            rows_posiciones[data['ticker']] = position_row(data)
+
+        elif 'close' in data['tipo'] or 'none' in data['tipo']:
+            if 'close' in data['tipo']:
+                rows_operaciones.append(operation_row(data))
+
+            if data['ticker'] in rows_posiciones:
+                del rows_posiciones[data['ticker']]
+            else:
+                tickers_borrar.append(data['ticker'])
+
+    hojas = {ws.title: ws for ws in gs.worksheets()}
+    for name in [sheet_operaciones, sheet_posiciones]:
+        if name not in hojas:
+            print(f"No se encontró la hoja '{name}'")
+            raise WorksheetNotFound(name)
+
+    requests = []
+
+    # Borrado de posiciones
+    if tickers_borrar:
+        tickers = hojas[sheet_posiciones].col_values(1)  # columna ticker, incluye el encabezado
+
+        filas = []
+        for ticker in tickers_borrar:
+            if ticker in tickers[1:]:
+                filas.append(tickers.index(ticker, 1))  # indice 0-based de la fila
+            else:
+                print(f"No se encontró ninguna posición con el ticker '{ticker}'.")
+
+        for fila in sorted(set(filas), reverse=True):
+            requests.append({'deleteDimension': {'range': {'sheetId': hojas[sheet_posiciones].id,
+                                                           'dimension': 'ROWS',
+                                                           'startIndex': fila,
+                                                           'endIndex': fila + 1}}})
+
+    # Appends
+    for name, rows in [(sheet_operaciones, rows_operaciones), (sheet_posiciones, list(rows_posiciones.values()))]:
+        if rows:
+            requests.append({'appendCells': {'sheetId': hojas[name].id,
+                                             'rows': [{'values': [_cell(v) for v in row]} for row in rows],
+                                             'fields': 'userEnteredValue'}})
+
+    if requests:
+        gs.batch_update({'requests': requests})
+
+
 if __name__ == '__main__':
     """
     Instrucciones para configurar Google Sheets:
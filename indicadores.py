@@ -1,33 +1,30 @@
+import numpy as np
+import pandas as pd
 import ta.trend
 import ta.momentum
 
 
-def get_adx(df):
-    data = df.copy()  # hacemos una copia para no modificar el original y evitar warnings
+def get_adx(df, window=14):
+    # ta no modifica el df que recibe, por lo que no hace falta hacer una copia
 
     # Initialize the ADX indicator
-    adx_indicator = ta.trend.ADXIndicator(high=data['high'],
-                                          low=data['low'],
-                                          close=data['close'],
-                                          window=14,
+    adx_indicator = ta.trend.ADXIndicator(high=df['high'],
+                                          low=df['low'],
+                                          close=df['close'],
+                                          window=window,
                                           fillna=False)
 
     # Calculate the ADX
-    data['ADX'] = adx_indicator.adx()
+    return adx_indicator.adx()
 
-    return data['ADX']
 
-
-def get_rsi(df):
-    data = df.copy()
+def get_rsi(df, window=14):
 
     # Initialize the RSI indicator
-    rsi_indicator = ta.momentum.RSIIndicator(close=data['close'], window=14, fillna=False)
+    rsi_indicator = ta.momentum.RSIIndicator(close=df['close'], window=window, fillna=False)
 
     # Calculate the RSI
-    data['RSI'] = rsi_indicator.rsi()
-
-    return data['RSI']
+    return rsi_indicator.rsi()
 
 
 def cruce_ema(df, slow, fast):
@@ -38,14 +35,10 @@ def cruce_ema(df, slow, fast):
     :param fast:
     :return:
     """
-    data = df.copy()
+    ema_fast = ta.trend.EMAIndicator(close=df['close'], window=fast, fillna=False).ema_indicator()
+    ema_slow = ta.trend.EMAIndicator(close=df['close'], window=slow, fillna=False).ema_indicator()
 
-    data['ema_fast'] = ta.trend.EMAIndicator(close=data['close'], window=fast, fillna=False).ema_indicator()
-    data['ema_slow'] = ta.trend.EMAIndicator(close=data['close'], window=slow, fillna=False).ema_indicator()
-
-    data['cruce'] = data['ema_fast'] / data['ema_slow'] -1
-
-    return data['cruce']
+    return ema_fast / ema_slow - 1
 
 
 def add_indicadores(df, parametros):
@@ -66,6 +59,436 @@ def add_indicadores(df, parametros):
     return data
 
 
+class _Ewm:
+    """
+    Media exponencial con el mismo calculo que pandas ewm(adjust=False), que es lo que usa ta para el EMA y el RSI.
+    Devuelve NaN hasta tener min_periods observaciones.
+    """
+
+    def __init__(self, alpha, min_periods):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.value = np.nan
+        self.nobs = 0
+
+    def update(self, x):
+        self.nobs += 1
+        if self.value != self.value:  # primer valor
+            self.value = x
+        elif self.value != x:
+            old_wt = 1. - self.alpha
+            self.value = ((old_wt * self.value) + (self.alpha * x)) / (old_wt + self.alpha)
+
+        return self.value if self.nobs >= self.min_periods else np.nan
+
+
+class IndicadoresIncrementales:
+    """
+    Calcula ADX, RSI y cruce de EMAs de un ticker de forma incremental.
+
+    Guardamos el estado de las medias de Wilder (ADX, RSI) y de las EMAs, por lo que cada vela confirmada nueva se
+    procesa en tiempo constante en lugar de recalcular las 300 velas con ta en cada corrida.
+
+    Los valores son los mismos que devuelve ta calculado sobre todas las velas desde que se creo el objeto (ver
+    comparar_con_ta). Si se pierde la continuidad de las velas se recalcula todo desde el df recibido.
+    """
+
+    def __init__(self, slow, fast, window=14, max_len=1000):
+        """
+        :param slow: Ventana de la EMA lenta
+        :param fast: Ventana de la EMA rapida
+        :param window: Ventana del ADX y RSI
+        :param max_len: Cantidad maxima de valores que guardamos de cada indicador
+        """
+        self.slow = slow
+        self.fast = fast
+        self.window = window
+        self.max_len = max_len
+        self.reset()
+
+    def reset(self):
+        """ Vuelve al estado inicial, sin velas procesadas. """
+        w = self.window
+
+        self.n = 0  # cantidad de velas procesadas
+        self.last_time = None
+        self.prev = None  # (high, low, close) de la vela anterior
+
+        # ADX
+        self.trs = self.dip = self.din = 0.
+        self.dx_inicial = []
+        self.adx = 0.
+
+        # RSI
+        self.ema_up = _Ewm(1 / w, w)
+        self.ema_down = _Ewm(1 / w, w)
+
+        # Cruce
+        self.ema_fast = _Ewm(2 / (self.fast + 1), self.fast)
+        self.ema_slow = _Ewm(2 / (self.slow + 1), self.slow)
+
+        self.tiempos = []
+        self.valores = {'ADX': [], 'RSI': [], 'cruce': []}
+
+    def update(self, high, low, close):
+        """
+        Procesa una vela confirmada.
+
+        :return: Diccionario con los valores de ADX, RSI y cruce de la vela
+        """
+        w = self.window
+        t = self.n
+
+        # ADX (Wilder), mismo orden de operaciones que ta.trend.ADXIndicator
+        if self.prev is not None:
+            prev_high, prev_low, prev_close = self.prev
+
+            tr = max(high, prev_close) - min(low, prev_close)
+            diff_up = high - prev_high
+            diff_down = prev_low - low
+            pos = diff_up if diff_up > diff_down and diff_up > 0 else 0.
+            neg = diff_down if diff_down > diff_up and diff_down > 0 else 0.
+
+            if t <= w:  # las primeras w velas se suman
+                self.trs += tr
+                self.dip += pos
+                self.din += neg
+            else:
+                self.trs = self.trs - (self.trs / float(w)) + tr
+                self.dip = self.dip - (self.dip / float(w)) + pos
+                self.din = self.din - (self.din / float(w)) + neg
+
+        adx = 0.
+        if t >= w:
+            dip = 100 * (self.dip / self.trs) if self.trs != 0 else 0
+            din = 100 * (self.din / self.trs) if self.trs != 0 else 0
+            dx = 100 * np.abs((dip - din) / (dip + din)) if dip + din != 0 else 0
+
+            if t < 2 * w - 1:
+                self.dx_inicial.append(dx)
+            elif t == 2 * w - 1:
+                self.dx_inicial.append(dx)
+                self.adx = np.array(self.dx_inicial).mean()
+            else:
+                self.adx = ((self.adx * (w - 1)) + dx) / float(w)
+
+            if t >= 2 * w - 1:
+                adx = self.adx
+
+        # RSI
+        diff = close - self.prev[2] if self.prev is not None else 0.
+        ema_up = self.ema_up.update(diff if diff > 0 else 0.)
+        ema_down = self.ema_down.update(-diff if diff < 0 else 0.)
+        rsi = 100 if ema_down == 0 else 100 - (100 / (1 + ema_up / ema_down))
+
+        # Cruce
+        cruce = self.ema_fast.update(close) / self.ema_slow.update(close) - 1
+
+        self.prev = (high, low, close)
+        self.n += 1
+
+        return {'ADX': adx, 'RSI': rsi, 'cruce': cruce}
+
+    def sync(self, df):
+        """
+        Procesa las velas del df posteriores a la ultima procesada y devuelve el df con los indicadores.
+        Si el df no continua a las velas ya procesadas (hueco, o es la primera vez) recalcula todo.
+
+        :param df: DataFrame de velas confirmadas ordenado por fecha (ver velas.get_velas)
+        :return: Copia del df con las columnas ADX, RSI y cruce
+        """
+        if self.last_time is None or self.last_time < df.index[0] or self.last_time not in df.index:
+            self.reset()
+            nuevas = df
+        else:
+            nuevas = df[df.index > self.last_time]
+
+        if len(self.tiempos) + len(nuevas) < len(df):  # no tengo valores para todo el df
+            self.reset()
+            nuevas = df
+
+        for time, high, low, close in zip(nuevas.index, nuevas['high'].values, nuevas['low'].values,
+                                          nuevas['close'].values):
+            valores = self.update(float(high), float(low), float(close))
+            self.tiempos.append(time)
+            for k, v in valores.items():
+                self.valores[k].append(v)
+
+        if len(nuevas):
+            self.last_time = nuevas.index[-1]
+
+        if len(self.tiempos) > self.max_len:
+            del self.tiempos[:-self.max_len]
+            for k in self.valores:
+                del self.valores[k][:-self.max_len]
+
+        data = df.copy()
+        for k, v in self.valores.items():
+            data[k] = np.array(v[-len(df):], dtype=float)
+
+        return data
+
+
+# Un motor incremental por ticker, ver add_indicadores_incremental
+_motores = {}
+
+
+def add_indicadores_incremental(ticker, df, parametros):
+    """
+    Igual que add_indicadores pero usando un IndicadoresIncrementales por ticker que se mantiene entre corridas.
+    Si cambian las ventanas de las EMAs en los parametros se crea un motor nuevo.
+
+    :param ticker: Ticker del df
+    :param df: DataFrame de velas confirmadas
+    :param parametros: Diccionario con los parámetros del ticker
+    :return: Copia del df con las columnas ADX, RSI y cruce
+    """
+    slow = parametros['ema_slow']
+    fast = parametros['ema_fast']
+
+    motor = _motores.get(ticker)
+    if motor is None or motor.slow != slow or motor.fast != fast:
+        motor = IndicadoresIncrementales(slow, fast)
+        _motores[ticker] = motor
+
+    return motor.sync(df)
+
+
+# Calculo vectorizado de todos los tickers a la vez (panel)
+def _stack(data, columna, largo):
+    """
+    Apila la columna de todos los df en un array de (tickers x velas). Las series se alinean a la derecha (ultima
+    vela en la ultima columna) y las series mas cortas se completan con NaN a la izquierda.
+
+    :return: array de (tickers x largo) e indice de la primera vela valida de cada ticker
+    """
+    panel = np.full((len(data), largo), np.nan)
+    inicio = np.empty(len(data), dtype=np.int64)
+    for i, df in enumerate(data.values()):
+        valores = df[columna].values
+        panel[i, largo - len(valores):] = valores
+        inicio[i] = largo - len(valores)
+    return panel, inicio
+
+
+def _ewm_panel(x, alpha, min_periods):
+    """
+    pandas ewm(alpha, adjust=False).mean() aplicado a cada fila de x a la vez.
+
+    :param x: array de (tickers x velas), NaN antes de la primera observacion
+    :param alpha: array con el alpha de cada fila
+    :param min_periods: array con el min_periods de cada fila
+    """
+    out = np.full(x.shape, np.nan)
+    value = np.full(x.shape[0], np.nan)
+    nobs = np.zeros(x.shape[0])
+    old_wt = 1. - alpha
+
+    for j in range(x.shape[1]):
+        cur = x[:, j]
+        obs = cur == cur
+        nobs += obs
+        value = np.where(obs & (value != value), cur,
+                         np.where(obs & (value != cur), ((old_wt * value) + (alpha * cur)) / (old_wt + alpha), value))
+        out[:, j] = np.where(nobs >= min_periods, value, np.nan)
+
+    return out
+
+
+def adx_panel(high, low, close, inicio, window=14):
+    """
+    ADX de cada fila, mismo calculo que ta.trend.ADXIndicator (0 en las primeras 2 * window - 1 velas).
+
+    :param high, low, close: arrays de (tickers x velas)
+    :param inicio: indice de la primera vela valida de cada fila
+    """
+    w = window
+    n_tickers, n = close.shape
+    rel = np.arange(n)[None, :] - inicio[:, None]  # numero de vela de cada ticker
+
+    prev_close = np.roll(close, 1, axis=1)
+    tr = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    diff_up = high - np.roll(high, 1, axis=1)
+    diff_down = np.roll(low, 1, axis=1) - low
+    pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.)
+    neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.)
+
+    # Medias de Wilder: las primeras w velas se suman y luego trs = trs - trs / w + tr
+    dx = np.zeros((n_tickers, n))
+    trs, dip, din = np.zeros(n_tickers), np.zeros(n_tickers), np.zeros(n_tickers)
+    for j in range(n):
+        r = rel[:, j]
+        suma = (r >= 1) & (r <= w)
+        wilder = r > w
+        trs = np.where(suma, trs + tr[:, j], np.where(wilder, trs - (trs / float(w)) + tr[:, j], trs))
+        dip = np.where(suma, dip + pos[:, j], np.where(wilder, dip - (dip / float(w)) + pos[:, j], dip))
+        din = np.where(suma, din + neg[:, j], np.where(wilder, din - (din / float(w)) + neg[:, j], din))
+
+        di_pos = np.where(trs != 0, 100 * (dip / np.where(trs != 0, trs, 1)), 0)
+        di_neg = np.where(trs != 0, 100 * (din / np.where(trs != 0, trs, 1)), 0)
+        total = di_pos + di_neg
+        dx[:, j] = np.where((r >= w) & (total != 0), 100 * np.abs((di_pos - di_neg) / np.where(total != 0, total, 1)), 0)
+
+    # ADX: promedio de los primeros w dx y luego media de Wilder
+    adx = np.zeros((n_tickers, n))
+    primera = inicio + 2 * w - 1  # primera vela con ADX
+    validos = primera < n
+    filas = np.arange(n_tickers)[validos]
+    columnas = inicio[validos, None] + w + np.arange(w)[None, :]
+    adx[filas, primera[validos]] = dx[filas[:, None], columnas].mean(axis=1)
+
+    for j in range(n):
+        seguir = rel[:, j] > 2 * w - 1
+        adx[:, j] = np.where(seguir, ((adx[:, j - 1] * (w - 1)) + dx[:, j]) / float(w), adx[:, j])
+
+    return adx
+
+
+def rsi_panel(close, inicio, window=14):
+    """ RSI de cada fila, mismo calculo que ta.momentum.RSIIndicator. """
+    rel = np.arange(close.shape[1])[None, :] - inicio[:, None]
+
+    diff = np.where(rel >= 1, close - np.roll(close, 1, axis=1), 0.)  # la primera vela no tiene diferencia
+    up = np.where(rel >= 0, np.where(diff > 0, diff, 0.), np.nan)
+    down = np.where(rel >= 0, np.where(diff < 0, -diff, 0.), np.nan)
+
+    alpha = np.full(close.shape[0], 1 / window)
+    ema_up = _ewm_panel(up, alpha, window)
+    ema_down = _ewm_panel(down, alpha, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ema_down == 0, 100, 100 - (100 / (1 + ema_up / ema_down)))
+
+
+def cruce_ema_panel(close, slow, fast):
+    """
+    Cruce de medias exponenciales de cada fila, con ventanas distintas por ticker.
+
+    :param slow: array con la ventana de la EMA lenta de cada fila
+    :param fast: array con la ventana de la EMA rapida de cada fila
+    """
+    ema_fast = _ewm_panel(close, 2 / (fast + 1), fast)
+    ema_slow = _ewm_panel(close, 2 / (slow + 1), slow)
+    return ema_fast / ema_slow - 1
+
+
+def add_indicadores_panel(data, parametros):
+    """
+    Igual que aplicar add_indicadores a cada ticker, pero calculando todos los tickers juntos sobre arrays de
+    (tickers x velas). Con muchos tickers reemplaza cientos de llamadas chicas a pandas/ta por operaciones sobre
+    arrays.
+
+    :param data: Diccionario con los datos históricos de cada ticker.
+    :param parametros: Diccionario con los parámetros de cada ticker.
+    :return: Diccionario con una copia de cada df con las columnas ADX, RSI y cruce
+    """
+    data = {k: v for k, v in data.items() if not v.empty}
+    if not data:
+        return {}
+
+    largo = max(len(df) for df in data.values())
+    high, inicio = _stack(data, 'high', largo)
+    low, _ = _stack(data, 'low', largo)
+    close, _ = _stack(data, 'close', largo)
+
+    slow = np.array([parametros[t]['ema_slow'] for t in data], dtype=float)
+    fast = np.array([parametros[t]['ema_fast'] for t in data], dtype=float)
+
+    resultados = {'ADX': adx_panel(high, low, close, inicio),
+                  'RSI': rsi_panel(close, inicio),
+                  'cruce': cruce_ema_panel(close, slow, fast)}
+
+    salida = {}
+    for i, (ticker, df) in enumerate(data.items()):
+        df = df.copy()
+        for k, v in resultados.items():
+            df[k] = v[i, inicio[i]:]
+        salida[ticker] = df
+
+    return salida
+
+
+# Calculo para series largas (backtest)
+def adx_ewm(high, low, close, window=14):
+    """
+    ADX con el mismo calculo que ta.trend.ADXIndicator, pero con las medias de Wilder hechas con pandas ewm en lugar
+    de loops de python. Para series de cientos de miles de velas es mucho mas rapido que ta. Difiere de ta solo por
+    redondeo (del orden de 1e-10).
+
+    La media de Wilder trs = trs - trs / w + tr es una ewm con alpha = 1 / w: si z = trs / w, z = (1 - alpha) * z +
+    alpha * tr. El ADX = (ADX * (w - 1) + dx) / w es directamente una ewm con alpha = 1 / w. Arrancando la ewm con el valor inicial de ta (suma o promedio de las primeras w velas) se obtiene
+    la misma serie.
+
+    :param high, low, close: arrays de numpy
+    :return: array con el ADX (0 en las primeras 2 * window - 1 velas)
+    """
+    w = window
+    n = len(close)
+    adx = np.zeros(n)
+    if n < 2 * w:
+        return adx
+
+    alpha = 1 / w
+    prev_close = np.roll(close, 1)
+    tr = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    diff_up = high - np.roll(high, 1)
+    diff_down = np.roll(low, 1) - low
+    pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.)
+    neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.)
+
+    def ewm(x, inicial):
+        x = x.copy()
+        x[0] = inicial
+        return pd.Series(x).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+    def wilder(x, suma):
+        return ewm(x, suma * alpha) / alpha
+
+    # Desde la vela w: suma de las velas 1..w y luego media de Wilder
+    trs = wilder(tr[w:], tr[1:w + 1].sum())
+    dip = wilder(pos[w:], pos[1:w + 1].sum())
+    din = wilder(neg[w:], neg[1:w + 1].sum())
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        di_pos = np.where(trs != 0, 100 * (dip / trs), 0)
+        di_neg = np.where(trs != 0, 100 * (din / trs), 0)
+        total = di_pos + di_neg
+        dx = np.where(total != 0, 100 * np.abs((di_pos - di_neg) / total), 0)
+
+    # Desde la vela 2 * w - 1: promedio de los primeros w dx y luego media de Wilder
+    adx[2 * w - 1:] = ewm(dx[w - 1:], dx[:w].mean())
+    return adx
+
+
+def add_indicadores_rapido(df, parametros):
+    """
+    Igual que add_indicadores pero con el ADX de adx_ewm. El RSI y las EMAs de ta ya usan pandas ewm.
+    """
+    data = df.copy()
+    data['ADX'] = adx_ewm(data['high'].to_numpy(float), data['low'].to_numpy(float), data['close'].to_numpy(float))
+    data['RSI'] = get_rsi(data)
+    data['cruce'] = cruce_ema(data, parametros['ema_slow'], parametros['ema_fast'])
+    return data
+
+
+def comparar_con_ta(df, parametros, window=14):
+    """
+    Compara IndicadoresIncrementales contra ta: procesa las velas de a una y compara el resultado final con
+    add_indicadores calculado sobre el mismo df.
+
+    :return: Diccionario con la maxima diferencia absoluta de cada indicador
+    """
+    esperado = add_indicadores(df, parametros)
+
+    motor = IndicadoresIncrementales(parametros['ema_slow'], parametros['ema_fast'], window=window)
+    for i in range(1, len(df) + 1):  # simulo que llega una vela nueva por vez
+        resultado = motor.sync(df.iloc[:i])
+
+    return {k: float(np.nanmax(np.abs(resultado[k] - esperado[k])))
+            if not (resultado[k].isna() != esperado[k].isna()).any() else np.inf
+            for k in ['ADX', 'RSI', 'cruce']}
+
+
 if __name__ == '__main__':
     """
     Obtenemos el precio, como vimos en functions
@@ -98,3 +521,7 @@ if __name__ == '__main__':
 
     print(data_indicadores)
 
+    # Comparamos el calculo incremental contra ta
+    for k, v in data.items():
+        print(k, comparar_con_ta(v, parametros[k]))
+
@@ -0,0 +1,96 @@
+"""
+Ajuste de cantidades al lotSz de cada instrumento con aritmetica entera y Decimal.
+
+functions.adj_quantity formatea el lotSz como string en cada llamada para contar los decimales y ver si termina en 5.
+Aca ese analisis se hace una sola vez por instrumento (lot_step, se guarda en los datos del instrumento al cargarlos,
+ver api_okx.get_instruments_index) y el ajuste queda en:
+
+    k = floor(Decimal(repr(cantidad)) * escala)   # cantidad en unidades de 10 ** -decimales, exacto
+    k = k - k % paso                              # paso 5 si el lotSz termina en 5
+    cantidad = k / escala
+
+Con la misma regla que adj_quantity:
+- lotSz < 1: escala 10 ** decimales del lotSz, paso 5 si el lotSz termina en 5 (0.05, 0.005) y si no 1. Por ejemplo
+  0.2 ajusta a 0.1, igual que adj_quantity.
+- lotSz >= 1: ajusta al entero, por ejemplo 10 ajusta a 1, igual que adj_quantity.
+
+Cambio de comportamiento respecto de adj_quantity: adj_quantity multiplica en float (cantidad * escala) y cuando el
+producto queda apenas abajo del entero pierde un lote, por ejemplo 2.3 con lotSz 0.01 da 2.29 (2.3 * 100 es
+229.99999999999997). En los lotSz que terminan en 5 ademas multiplica y divide en float por segunda vez (284.215 con
+lotSz 0.005 da 284.21). Aca la multiplicacion se hace en Decimal sobre el valor tal como se escribe (repr) y el
+resultado es el piso exacto: 2.3 y 284.215. En esos casos la cantidad es un lote mas que la de adj_quantity, en el
+resto es la misma (ver test_lotes.py).
+
+quantize_array hace lo mismo sobre un array de numpy, para el backtest y el optimizador. Para no pasar cada valor
+por Decimal, redondea el producto al entero mas cercano y lo usa si el valor esta exactamente en la grilla del lotSz
+(ese entero / escala da el mismo float), si no usa el piso del producto. test_lotes.py verifica con Hypothesis que
+da lo mismo que quantize.
+"""
+
+from decimal import Decimal
+from functools import lru_cache
+from math import floor
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def lot_step(tick):
+    """
+    Escala y paso enteros de un lotSz.
+
+    :param tick: 'lotSz' del contrato del ticker
+    :return: Tupla (escala, paso): la cantidad se ajusta a multiplos de paso / escala
+    """
+    tick = float(tick)
+    if tick >= 1:
+        return 1, 1
+
+    texto = "{:.7f}".format(tick).rstrip('0').rstrip('.')
+    decimales = len(texto.split('.')[1])
+    return 10 ** decimales, 5 if texto[-1] == '5' else 1
+
+
+def quantize(value, escala, paso=1):
+    """
+    Ajusta una cantidad hacia el piso (ver lot_step).
+
+    :param value: cantidad a operar previo al ajuste
+    :param escala: 10 ** decimales del lotSz (1 si el lotSz es >= 1)
+    :param paso: 5 si el lotSz termina en 5, si no 1
+    :return: cantidad ajustada, entera si la escala es 1 (como adj_quantity)
+    """
+    k = floor(Decimal(repr(float(value))) * escala)
+    k -= k % paso
+    return k if escala == 1 else k / escala
+
+
+def quantize_array(values, escala, paso=1):
+    """ Igual que quantize para un array de cantidades, devuelve un array float64. """
+    values = np.asarray(values, dtype=np.float64)
+    producto = values * escala
+    cercano = np.rint(producto)
+    k = np.where(cercano / escala == values, cercano, np.floor(producto))  # en la grilla el producto puede fallar
+    if paso != 1:
+        k -= k % paso
+    return k / escala
+
+
+if __name__ == '__main__':
+    """
+    Tiempos contra functions.adj_quantity. La comparacion de resultados esta en test_lotes.py.
+    """
+    import time
+
+    from functions import adj_quantity
+
+    rng = np.random.default_rng(0)
+    valores = rng.uniform(0.01, 500, 100_000)
+    escala, paso = lot_step(0.05)
+    lista = valores.tolist()
+    for nombre, fn in [('adj_quantity', lambda: [adj_quantity(v, 0.05) for v in lista]),
+                       ('quantize', lambda: [quantize(v, escala, paso) for v in lista]),
+                       ('quantize_array', lambda: quantize_array(valores, escala, paso))]:
+        inicio = time.perf_counter()
+        fn()
+        print(f"{nombre}: {(time.perf_counter() - inicio) * 1000:.1f} ms para {len(valores)} cantidades")
@@ -9,99 +9,230 @@ import google_sheets
 import alertas
 import api_okx
 import functions
-
+import base_datos
+import ordenes
+from clientes import ClientRegistry
+from cuenta import AccountState
+from mercado import MarketSnapshot
+from planificador import BarScheduler
+import metricas
+from streaming import StreamingEngine
+
+from contextlib import nullcontext
 from datetime import datetime
 import pprint
 import traceback
 
 
+def run_cycle(clientes, db, mirror, tick, estado, notifier):
+    """
+    Una corrida del bot: lee parametros y posiciones, cierra y abre posiciones y guarda las operaciones.
+
+    :param clientes: Instancia de ClientRegistry
+    :param db: Conexion a la base local (ver base_datos.py)
+    :param mirror: Instancia de base_datos.SheetsMirror
+    :param tick: Resultado de BarScheduler.wait, con los timeframes cuya vela cerro
+    :param estado: Diccionario con el estado que se mantiene entre corridas ('timeframes', 'engine' y 'cuenta'), se
+                   modifica
+    :param notifier: Instancia de alertas.TelegramNotifier
+    :return: Diccionario con los tiempos de la corrida (ver metricas.fin_ciclo)
+    """
+    now = datetime.now()
+    print(f'\nIniciando bot {datetime.now()}')
+    metricas.inicio_ciclo()
+
+    # Obtengo los clientes necesarios, se crean una sola vez y se reutilizan entre corridas
+    account_api = clientes.account_api
+    account_trade_api = clientes.account_trade_api
+    client_md = clientes.client_md
+    sheet = clientes.sheet
+
+    # Voy a generar listas para enviar a telegram y a google sheets. Lo hago de esta manera para hacerlo al
+    # final y no tener que hacerlo en cada iteración
+    to_telegram = []
+    to_sheets = []
+
+    # Base de datos de parametros
+    with metricas.etapa('parametros'):
+        parametros = functions.get_parametros(account_api, sheet, config.HOJA_PARAMETROS, to_telegram)
+    # print('\nParametros')
+    # pprint.pprint(parametros)
+
+    # Solo proceso los tickers cuya vela cerro. Los timeframes nuevos en la hoja se procesan en la proxima corrida:
+    # el planificador todavia no los proceso y los devuelve como vencidos sin esperar
+    parametros_ciclo = {t: p for t, p in parametros.items()
+                        if estado['timeframes'] is None or p['timeframe'] in tick['bars']}
+    estado['timeframes'] = {p['timeframe'] for p in parametros.values()}
+
+    # Base de datos de posiciones abiertas
+    # la primera vez que se usa la base local importo las posiciones de google sheets
+    with metricas.etapa('posiciones'):
+        if not base_datos.is_initialized(db):
+            base_datos.import_posiciones(db, google_sheets.read_all_sheet(sheet, config.HOJA_POSICIONES))
+        posiciones = base_datos.read_posiciones(db)
+    # print('\nPosiciones')
+    # pprint.pprint(posiciones)
+
+    # Balance y posiciones abiertas en okx, se consultan juntos una vez por corrida (ver cuenta.py)
+    cuenta = estado['cuenta']
+    with metricas.etapa('cuenta'):
+        _, posiciones_api = cuenta.refresh(account_api)
+    # print('\nPosiciones API')
+    # pprint.pprint(posiciones_api)
+
+    # Descargo la data de los tickers y armo la foto del mercado de la corrida (ver mercado.py)
+    with metricas.etapa('data'):
+        data = functions.get_data_tickers(parametros_ciclo, client_md)
+        mercado = MarketSnapshot(data, posiciones_api)
+    # print('\nData tickers')
+    # print(data)
+
+    # Streaming: arranco el motor la primera vez, luego solo actualizo los tickers
+    engine = estado['engine']
+    if config.STREAMING:
+        if engine is None:
+            engine = estado['engine'] = StreamingEngine(parametros, account_trade_api)
+            engine.start()
+        else:
+            engine.set_parametros(parametros)
+
+    # Close positions
+    # si cierro una posicion no permito que se abra de nuevo en la misma corrida
+    # con streaming, mientras cierro posiciones el motor no puede cerrar (lock)
+    with metricas.etapa('close'), engine.lock if engine else nullcontext():
+        # tomo los cierres que hizo el motor desde la corrida anterior
+        cerradas_streaming = engine.drain(to_telegram, to_sheets) if engine else []
+        posiciones = [p for p in posiciones if p['ticker'] not in cerradas_streaming]
+
+        # cierres del motor que no se pudieron consultar, todavia no estan en la base (ver functions.pending_close)
+        pendientes = {d['ticker']: d for d in to_sheets if d['tipo'] == 'pendiente'}
+        for p in posiciones:
+            if p['ticker'] in pendientes:
+                p['cierre_pendiente'] = pendientes[p['ticker']]['cierre_pendiente']
+                p['motivo_pendiente'] = pendientes[p['ticker']]['motivo_pendiente']
+
+        # solo evaluo las posiciones de los tickers de esta corrida
+        posiciones_ciclo = [p for p in posiciones if p['ticker'] in parametros_ciclo]
+        posiciones_cerradas = functions.close_positions(posiciones_ciclo, posiciones_api, mercado, account_trade_api, to_telegram, to_sheets)
+        posiciones_cerradas += cerradas_streaming
+        # print(f'\nPosiciones cerradas: {posiciones_cerradas}')
+
+        if engine:
+            engine.set_posiciones([p for p in posiciones if p['ticker'] not in posiciones_cerradas])
+
+    # Veo balance en USDT luego de cerrar posiciones, aplicando los cierres al balance consultado al inicio
+    with metricas.etapa('balance'):
+        cuenta.apply_fills(to_sheets, parametros)
+        balance = cuenta.get_usdt(account_api)
+    # print(f'\nBalance USDT {balance}')
+
+    # Seteo leverage
+    # print('\nSeteo leverage')
+    with metricas.etapa('leverage'):
+        functions.fx_set_leverage(account_api, parametros_ciclo)
+
+    # Calculo indicadores
+    # print('\nCalculo indicadores')
+    with metricas.etapa('indicadores'):
+        data = functions.calculate_indicators(data, parametros_ciclo)
+        mercado.set_indicadores(data)
+
+    # Abro posiciones
+    # print('\nAbro posiciones')
+    with metricas.etapa('open'):
+        cierres = len(to_sheets)
+        functions.open_positions(parametros_ciclo, posiciones, posiciones_cerradas, balance, mercado, account_trade_api, to_telegram, to_sheets)
+
+    # Envio telegram, todas las alertas de la corrida en un mensaje que se envia en segundo plano
+    # print('\nEnvio telegram')
+    with metricas.etapa('telegram'):
+        notifier.notify(to_telegram)
+
+    # Margen y nocional de cada posicion abierta para la hoja de posiciones. Aplico las aperturas al balance guardado
+    # y solo si hubo aperturas vuelvo a consultar las posiciones, para usar los valores de OKX
+    with metricas.etapa('margen'):
+        aperturas = to_sheets[cierres:]
+        cuenta.apply_fills(aperturas, parametros)
+        if aperturas:
+            posiciones = cuenta.refresh_positions(account_api)
+            functions.add_margen_positions(list_sheet=to_sheets, positions_api=posiciones)
+
+    # El motor de streaming tambien vigila las posiciones abiertas en esta corrida
+    if engine:
+        engine.add_posiciones([d for d in to_sheets if d['tipo'] == 'open'])
+
+    # Guardo en la base local, el espejo lo replica en google sheets en segundo plano
+    print('\nGuardo en la base de datos')
+    with metricas.etapa('sheets'):
+        base_datos.write_batch(db, to_sheets)
+        mirror.notify()
+
+    # Duracion de la corrida y de cada etapa
+    return metricas.fin_ciclo(log=config.METRICAS_LOG, bars=tick['bars'], atraso=round(tick['atraso'], 2))
+
+
 def run():
 
+    # Estado que se mantiene entre corridas
+    estado = {'timeframes': None,  # timeframes de los tickers, se leen de la hoja en el arranque
+              'engine': None,  # motor de streaming, solo si config.STREAMING
+              'cuenta': AccountState()}  # balance y posiciones de okx de la corrida
+
+    # Clientes de OKX y Google Sheets
+    clientes = ClientRegistry(API_KEY, API_SECRET, PASSPHRASE, config.FILE_JSON, config.FILE_SHEET)
+
+    # Base de datos local de posiciones y operaciones, y el thread que la replica en google sheets
+    db = base_datos.get_connection(config.DB_FILE)
+    mirror = base_datos.SheetsMirror(config.DB_FILE,
+                                     lambda: google_sheets.get_google_sheet(config.FILE_JSON, config.FILE_SHEET),
+                                     config.HOJA_OPERACIONES, config.HOJA_POSICIONES)
+    mirror.start()
+
+    # Alertas de telegram, se envian en segundo plano
+    notifier = alertas.TelegramNotifier(BOT_TOKEN, CHAT_ID_LIST)
+    notifier.start()
+
+    # Seguimiento de ordenes por el canal privado de websocket
+    if config.FILL_TRACKER_WS:
+        tracker = ordenes.FillTracker(API_KEY, API_SECRET, PASSPHRASE)
+        tracker.start()
+        ordenes.set_tracker(tracker)
+
+    # Endpoint /metrics con los tiempos de cada etapa y de los requests a OKX
+    if config.METRICAS_PORT is not None:
+        try:
+            metricas.start_server(config.METRICAS_PORT)
+        except OSError as e:  # por ejemplo el puerto ya esta en uso, el bot sigue sin el endpoint
+            print(f'No se pudo iniciar el endpoint de metricas en el puerto {config.METRICAS_PORT}: {e}')
+
+    # Planificador: cada corrida arranca despues del cierre de la vela de algun timeframe
+    scheduler = BarScheduler()
+
     while True:
 
         try:
-            now = datetime.now()
-            print(f'\nIniciando bot {datetime.now()}')
-
-            # Obtengo los clientes necesarios
-            account_api = api_okx.get_account_api(API_KEY, API_SECRET, PASSPHRASE)
-            account_trade_api = api_okx.get_account_trade_api(API_KEY, API_SECRET, PASSPHRASE)
-            client_md = api_okx.get_account_md_api()
-            sheet = google_sheets.get_google_sheet(config.FILE_JSON, config.FILE_SHEET)
-
-            # Voy a generar listas para enviar a telegram y a google sheets. Lo hago de esta manera para hacerlo al
-            # final y no tener que hacerlo en cada iteración
-            to_telegram = []
-            to_sheets = []
-
-            # Base de datos de parametros
-            parametros = functions.get_parametros(account_api, sheet, config.HOJA_PARAMETROS)
-            # print('\nParametros')
-            # pprint.pprint(parametros)
-
-            # Base de datos de posiciones abiertas
-            posiciones = google_sheets.read_all_sheet(sheet, config.HOJA_POSICIONES)
-            # print('\nPosiciones')
-            # pprint.pprint(posiciones)
-
-            # Posiciones abiertas en okx
-            posiciones_api = api_okx.get_positions_dict(account_api)
-            # print('\nPosiciones API')
-            # pprint.pprint(posiciones_api)
-
-            # Descargo la data de los tickers
-            data = functions.get_data_tickers(parametros, client_md)
-            # print('\nData tickers')
-            # print(data)
-
-            # Close positions
-            # si cierro una posicion no permito que se abra de nuevo en la misma corrida
-            posiciones_cerradas = functions.close_positions(posiciones, posiciones_api, data, account_trade_api, to_telegram, to_sheets)
-            # print(f'\nPosiciones cerradas: {posiciones_cerradas}')
-
-            # Veo balance en USDT luego de cerrar posiciones
-            balance = api_okx.get_usdt_balance(account_api)
-            # print(f'\nBalance USDT {balance}')
-
-            # Seteo leverage
-            # print('\nSeteo leverage')
-            functions.fx_set_leverage(account_api, parametros)
-
-            # Calculo indicadores
-            # print('\nCalculo indicadores')
-            data = functions.calculate_indicators(data, parametros)
-
-            # Abro posiciones
-            # print('\nAbro posiciones')
-            functions.open_positions(parametros, posiciones, posiciones_cerradas, balance, data, account_trade_api, to_telegram, to_sheets)
-
-            # Envio telegram
-            # print('\nEnvio telegram')
-            functions.send_telegram_messages(to_telegram, BOT_TOKEN, CHAT_ID_LIST)
-
-            # Ahora pregunto nuevamente las posiciones abiertas para obtener el margen y nocional de cada posicion y
-            # agregarlo a la hoja de posiciones
-            posiciones = api_okx.get_positions_dict(account_api)
-            functions.add_margen_positions(list_sheet=to_sheets, positions_api=posiciones)
-
-            # Guardo en google sheets
-            print('\nGuardo en google sheets')
-            functions.work_sheets(to_sheets, sheet)
+            # En el arranque leo los timeframes de la hoja, asi la primera espera ya incluye a todos y cada vela se
+            # procesa una sola vez
+            if estado['timeframes'] is None:
+                hoja = google_sheets.read_all_sheet(clientes.sheet, config.HOJA_PARAMETROS)
+                estado['timeframes'] = {p['timeframe'] for p in functions.check_timeframes(hoja)}
 
-            # print duration bot como la diferencia entre now y el inicio
-            # print(f'Duration bot: {datetime.now() - now}')
+            # Espero al cierre de la proxima vela
+            tick = scheduler.wait(estado['timeframes'])
 
-            # Duermo hasta el siguiente minuto calendario
-            functions.sleep_until_next_minute()
+            run_cycle(clientes, db, mirror, tick, estado, notifier)
 
         except Exception as e:
             traceback.print_exc()
             print(e)
+            # Si el error vino de un cliente lo descarto para crearlo de nuevo en la proxima corrida
+            clientes.invalidate_for_error(e)
             # Envio alerta
-            alertas.send_telegram_message(BOT_TOKEN, f'Error en bot: {e}', CHAT_ID_LIST)
+            notifier.notify(f'Error en bot: {e}')
 
+            # Espero al proximo minuto antes de reintentar, asi un error que se repite (por ejemplo Google Sheets
+            # caido en el arranque) no genera una alerta por vuelta
             functions.sleep_until_next_minute()
-            # Arranco el bot de nuevo
             continue
 
 
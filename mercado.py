@@ -0,0 +1,84 @@
+"""
+Foto del mercado de cada corrida.
+
+Antes cada posicion a cerrar llamaba a functions.get_last_price, que recorre el DataFrame de todos los tickers para
+leer un solo precio, y open_positions volvia a leer la ultima fila de cada DataFrame. Con muchos tickers y posiciones
+la etapa de cierre hacia posiciones x tickers lecturas con pandas.
+
+MarketSnapshot se arma una sola vez despues de descargar la data: guarda el ultimo close, el mark price de las
+posiciones abiertas y los ultimos valores de los indicadores en arrays de numpy, con un indice ticker -> fila.
+close_positions y open_positions leen de aca. Tambien mantiene las velas de la corrida, para evaluar el stop loss y
+take profit con el high y low (ver salidas.py).
+"""
+
+import numpy as np
+
+# Indicadores que se guardan (columnas de indicadores.add_indicadores)
+INDICADORES = ('ADX', 'RSI', 'cruce')
+
+
+class MarketSnapshot:
+    """
+    Uso desde main.run:
+        mercado = MarketSnapshot(data, posiciones_api)
+        ...
+        data = functions.calculate_indicators(data, parametros)
+        mercado.set_indicadores(data)
+
+    Los tickers sin velas quedan con NaN, por lo que no cumplen ninguna condicion de apertura ni de cierre.
+    """
+
+    def __init__(self, data, posiciones_api=None):
+        """
+        :param data: Diccionario {ticker: DataFrame de velas}
+        :param posiciones_api: Diccionario de api_okx.get_positions_dict (para el mark price)
+        """
+        self.data = data
+        self.tickers = list(data)
+        self.index = {t: i for i, t in enumerate(self.tickers)}
+        n = len(self.tickers)
+
+        self.close = np.array([df['close'].iat[-1] if len(df) else np.nan for df in data.values()], dtype=np.float64)
+        self.mark = np.full(n, np.nan)
+        self.valores = np.full((n, len(INDICADORES)), np.nan)  # ultima fila de cada indicador
+
+        if posiciones_api:
+            self.set_mark(posiciones_api)
+
+    def __contains__(self, ticker):
+        return ticker in self.index
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def set_mark(self, posiciones_api):
+        """ Actualiza el mark price con las posiciones de api_okx.get_positions_dict. """
+        for ticker, p in posiciones_api.items():
+            if ticker in self.index:
+                self.mark[self.index[ticker]] = p['markPx']
+
+    def set_indicadores(self, data):
+        """ Guarda el ultimo valor de los indicadores de cada ticker (luego de functions.calculate_indicators). """
+        for ticker, df in data.items():
+            if ticker in self.index and len(df) and INDICADORES[0] in df:
+                self.valores[self.index[ticker]] = [df[c].iat[-1] for c in INDICADORES]
+
+    def last_price(self, ticker):
+        """ Ultimo close del ticker. """
+        return float(self.close[self.index[ticker]])
+
+    def velas(self, ticker):
+        """ DataFrame de velas del ticker. """
+        return self.data[ticker]
+
+    def mark_price(self, ticker):
+        """ Mark price de la posicion del ticker, NaN si no hay posicion. """
+        return float(self.mark[self.index[ticker]])
+
+    def indicadores(self, ticker):
+        """ Ultimos valores de los indicadores del ticker: {'ADX': ..., 'RSI': ..., 'cruce': ...} """
+        return dict(zip(INDICADORES, self.valores[self.index[ticker]].tolist()))
+
+    def last_prices(self):
+        """ Ultimo close de todos los tickers, igual que functions.get_last_price. """
+        return dict(zip(self.tickers, self.close.tolist()))
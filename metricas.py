@@ -0,0 +1,219 @@
+"""
+Metricas de tiempos del bot.
+
+- etapa(nombre): mide cada etapa de main.run (parametros, posiciones, data, close, etc).
+- instrument_client(client): mide cada request a OKX por endpoint, con los event hooks de httpx.
+- Los tiempos se guardan en histogramas en memoria y se exponen en formato Prometheus en http://127.0.0.1:<port>/metrics
+  (start_server).
+- Al final de cada corrida fin_ciclo imprime una linea json con la duracion de cada etapa y de los requests.
+
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites de los buckets de los histogramas, en segundos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Descripcion de cada metrica para el endpoint /metrics
+DESCRIPCIONES = {
+    'bot_etapa_segundos': 'Duracion de cada etapa de la corrida',
+    'bot_corrida_segundos': 'Duracion total de la corrida',
+    'bot_request_segundos': 'Duracion de los requests a OKX por endpoint (hasta recibir la respuesta)',
+    'bot_espejo_sheets_segundos': 'Duracion de cada replica de la base local en Google Sheets',
+}
+
+
+class Histogram:
+    """ Histograma acumulado con buckets fijos, como los de Prometheus. """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.counts[i] += 1
+        self.sum += valor
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histogramas = {}  # (nombre, labels) -> Histogram, labels es una tupla de (clave, valor)
+_ciclo = {'numero': 0, 'inicio': None, 'etapas': {}, 'requests': {}}
+
+
+def observe(nombre, valor, **labels):
+    """
+    Agrega una medicion al histograma.
+
+    :param nombre: Nombre de la metrica, por ejemplo 'bot_etapa_segundos'
+    :param valor: Valor en segundos
+    :param labels: Labels de la metrica, por ejemplo etapa='data'
+    """
+    key = (nombre, tuple(sorted(labels.items())))
+    with _lock:
+        if key not in _histogramas:
+            _histogramas[key] = Histogram()
+        _histogramas[key].observe(valor)
+
+
+@contextmanager
+def etapa(nombre):
+    """
+    Mide la duracion de un bloque como una etapa de la corrida.
+
+    Uso:
+        with metricas.etapa('data'):
+            data = functions.get_data_tickers(parametros, client_md)
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        observe('bot_etapa_segundos', duracion, etapa=nombre)
+        with _lock:
+            _ciclo['etapas'][nombre] = _ciclo['etapas'].get(nombre, 0.) + duracion
+
+
+def inicio_ciclo():
+    """ Marca el inicio de una corrida. """
+    with _lock:
+        _ciclo['numero'] += 1
+        _ciclo['inicio'] = time.perf_counter()
+        _ciclo['etapas'] = {}
+        _ciclo['requests'] = {}
+
+
+def fin_ciclo(log=True, **extra):
+    """
+    Marca el fin de una corrida e imprime una linea json con los tiempos.
+
+    :param log: Si es True imprime la linea
+    :param extra: Datos que se agregan a la linea, por ejemplo los timeframes de la corrida
+    :return: Diccionario con los tiempos de la corrida
+    """
+    with _lock:
+        if _ciclo['inicio'] is None:
+            return {}
+        total = time.perf_counter() - _ciclo['inicio']
+        resumen = {'corrida': _ciclo['numero'], 'total': round(total, 4),
+                   'etapas': {k: round(v, 4) for k, v in _ciclo['etapas'].items()},
+                   'requests': {k: {'n': n, 'segundos': round(s, 4)} for k, (n, s) in _ciclo['requests'].items()},
+                   **extra}
+        _ciclo['inicio'] = None
+
+    observe('bot_corrida_segundos', total)
+    if log:
+        print(json.dumps(resumen, default=str))
+    return resumen
+
+
+# Requests a OKX
+def _on_request(request):
+    request.extensions['metricas_inicio'] = time.perf_counter()
+
+
+def _on_response(response):
+    inicio = response.request.extensions.get('metricas_inicio')
+    if inicio is None:
+        return
+    duracion = time.perf_counter() - inicio
+    endpoint = response.request.url.path
+    observe('bot_request_segundos', duracion, endpoint=endpoint, status=str(response.status_code))
+    with _lock:
+        n, s = _ciclo['requests'].get(endpoint, (0, 0.))
+        _ciclo['requests'][endpoint] = (n + 1, s + duracion)
+
+
+def instrument_client(client):
+    """
+    Agrega los hooks de medicion a un cliente de OKX (httpx.Client).
+
+    :param client: Instancia de AccountAPI, TradeAPI o MarketAPI
+    :return: El mismo cliente
+    """
+    hooks = client.event_hooks
+    hooks['request'] = [h for h in hooks['request'] if h is not _on_request] + [_on_request]
+    hooks['response'] = [h for h in hooks['response'] if h is not _on_response] + [_on_response]
+    client.event_hooks = hooks
+    return client
+
+
+# Endpoint /metrics
+def render():
+    """ Texto con todos los histogramas en el formato de Prometheus. """
+    with _lock:
+        items = sorted((k, (list(h.counts), h.sum, h.count, h.buckets)) for k, h in _histogramas.items())
+
+    lineas, vistos = [], set()
+    for (nombre, labels), (counts, suma, count, buckets) in items:
+        if nombre not in vistos:
+            vistos.add(nombre)
+            lineas.append(f'# HELP {nombre} {DESCRIPCIONES.get(nombre, nombre)}')
+            lineas.append(f'# TYPE {nombre} histogram')
+
+        base = ','.join(f'{k}="{v}"' for k, v in labels)
+        sep = ',' if base else ''
+        for limite, c in zip(buckets, counts):
+            lineas.append(f'{nombre}_bucket{{{base}{sep}le="{limite}"}} {c}')
+        lineas.append(f'{nombre}_bucket{{{base}{sep}le="+Inf"}} {count}')
+        lineas.append(f'{nombre}_sum{{{base}}} {suma}' if base else f'{nombre}_sum {suma}')
+        lineas.append(f'{nombre}_count{{{base}}} {count}' if base else f'{nombre}_count {count}')
+
+    return '\n'.join(lineas) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # sin log de cada request
+
+
+def start_server(port, host='127.0.0.1'):
+    """
+    Inicia el servidor http de /metrics en un thread daemon.
+
+    :return: Instancia de ThreadingHTTPServer (server.shutdown() para terminarlo)
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    """
+    Ejemplo: mide una corrida simulada y consulta el endpoint /metrics.
+    """
+    import urllib.request
+
+    server = start_server(8001)
+
+    inicio_ciclo()
+    with etapa('parametros'):
+        time.sleep(0.02)
+    with etapa('data'):
+        time.sleep(0.05)
+    fin_ciclo(timeframes=['1m'])
+
+    print(urllib.request.urlopen('http://127.0.0.1:8001/metrics').read().decode())
+    server.shutdown()
@@ -0,0 +1,233 @@
+"""
+Optimizador de parametros: corre el backtest (ver backtest.py) para muchas combinaciones de parametros de cada
+ticker en un pool de procesos y devuelve un ranking por ticker.
+
+Las velas de cada ticker se copian una sola vez a memoria compartida (multiprocessing.shared_memory). Cada proceso
+del pool arma arrays de numpy sobre esa memoria sin copiarla, por lo que las tareas solo envian los parametros a
+probar y no las velas. Ademas cada proceso guarda el ADX y RSI de cada ticker (no dependen de los parametros) y el
+cruce de cada par de EMAs.
+
+https://docs.python.org/3/library/multiprocessing.shared_memory.html
+"""
+
+import itertools
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import indicadores
+
+# Columnas de la hoja de parametros que se pueden optimizar
+PARAMETROS_OPTIMIZABLES = ['adx', 'rsi', 'ema_slow', 'ema_fast', 'take_profit', 'stop_loss', 'leverage']
+
+# Datos de los instrumentos que agrega functions.get_parametros y no van en la hoja
+COLUMNAS_INSTRUMENTO = ['instId', 'ctVal', 'minSz', 'lotSz', 'tickSz', 'lotEscala', 'lotPaso']
+
+
+def grid(espacio):
+    """
+    Todas las combinaciones de los valores de cada parametro.
+
+    :param espacio: Diccionario {parametro: lista de valores}, por ejemplo {'adx': [15, 20, 25], 'rsi': [40, 50]}
+    :return: Lista de diccionarios {parametro: valor}
+    """
+    claves = list(espacio)
+    combinaciones = [dict(zip(claves, valores)) for valores in itertools.product(*espacio.values())]
+    return [c for c in combinaciones if _valida(c)]
+
+
+def muestra(espacio, n, seed=None):
+    """
+    Muestra aleatoria de n combinaciones distintas del grid.
+
+    :param espacio: Diccionario {parametro: lista de valores}
+    :param n: Cantidad de combinaciones
+    :param seed: Semilla para repetir la muestra
+    """
+    combinaciones = grid(espacio)
+    return random.Random(seed).sample(combinaciones, min(n, len(combinaciones)))
+
+
+def _valida(combinacion):
+    """ La EMA rapida tiene que ser mas corta que la lenta. """
+    if 'ema_fast' in combinacion and 'ema_slow' in combinacion:
+        return combinacion['ema_fast'] < combinacion['ema_slow']
+    return True
+
+
+# Memoria compartida
+def share_velas(data):
+    """
+    Copia las velas de cada ticker a un bloque de memoria compartida: tiempos (int64, ns) y open, high, low, close
+    (float64).
+
+    :param data: Diccionario {ticker: DataFrame de velas}
+    :return: Tupla (bloques, meta): lista de SharedMemory (llamar a close y unlink al terminar) y diccionario
+             {ticker: (nombre del bloque, cantidad de velas)} para los procesos del pool
+    """
+    bloques, meta = [], {}
+    for ticker, df in data.items():
+        n = len(df)
+        shm = shared_memory.SharedMemory(create=True, size=max(5 * n * 8, 1))
+        tiempos, ohlc = _vistas(shm, n)
+        tiempos[:] = df.index.values.astype('datetime64[ns]').view(np.int64)
+        for i, col in enumerate(['open', 'high', 'low', 'close']):
+            ohlc[i] = df[col].to_numpy(float)
+        bloques.append(shm)
+        meta[ticker] = (shm.name, n)
+    return bloques, meta
+
+
+def _vistas(shm, n):
+    tiempos = np.ndarray((n,), dtype=np.int64, buffer=shm.buf)
+    ohlc = np.ndarray((4, n), dtype=np.float64, buffer=shm.buf, offset=n * 8)
+    return tiempos, ohlc
+
+
+# Estado de cada proceso del pool
+_velas = {}  # ticker -> DataFrame sobre la memoria compartida
+_base = {}  # ticker -> DataFrame con ADX y RSI
+_cruces = {}  # (ticker, slow, fast) -> array del cruce
+_bloques = []
+
+
+def _init_worker(meta, fork):
+    for ticker, (nombre, n) in meta.items():
+        shm = shared_memory.SharedMemory(name=nombre)
+        # El bloque lo borra el proceso principal. Con fork el resource tracker es el del proceso principal, si no
+        # este proceso tiene el suyo y hay que evitar que borre el bloque al terminar
+        if not fork:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        _bloques.append(shm)
+
+        tiempos, ohlc = _vistas(shm, n)
+        _velas[ticker] = pd.DataFrame({'open': ohlc[0], 'high': ohlc[1], 'low': ohlc[2], 'close': ohlc[3]},
+                                      index=pd.DatetimeIndex(tiempos.view('datetime64[ns]'), name='time'), copy=False)
+
+
+def _indicadores(ticker, parametros):
+    if ticker not in _base:
+        df = _velas[ticker]
+        base = df[['open', 'high', 'low', 'close']].copy(deep=False)  # high y low para las salidas intrabar
+        base['ADX'] = indicadores.adx_ewm(df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy())
+        base['RSI'] = indicadores.get_rsi(df)
+        _base[ticker] = base
+
+    key = (ticker, parametros['ema_slow'], parametros['ema_fast'])
+    if key not in _cruces:
+        _cruces[key] = indicadores.cruce_ema(_velas[ticker], parametros['ema_slow'], parametros['ema_fast']).to_numpy()
+
+    df = _base[ticker].copy(deep=False)
+    df['cruce'] = _cruces[key]
+    return df
+
+
+def _evaluar(ticker, parametros, combinaciones, fee_rate):
+    """ Tarea del pool: backtest de varias combinaciones de un ticker. """
+    filas = []
+    for combinacion in combinaciones:
+        p = {**parametros, **combinacion}
+        operaciones, equity = backtest.backtest_ticker(_indicadores(ticker, p), p, fee_rate=fee_rate,
+                                                       con_indicadores=True)
+        filas.append({'ticker': ticker, **combinacion, **backtest.resumen(operaciones, equity)})
+    return filas
+
+
+def optimizar(data, parametros, combinaciones, metrica='equity_final', fee_rate=0.0005, max_workers=None,
+              chunk=16):
+    """
+    Corre el backtest de cada combinacion para cada ticker y ordena los resultados.
+
+    :param data: Diccionario {ticker: DataFrame de velas}
+    :param parametros: Diccionario con los parametros actuales de cada ticker (ver functions.get_parametros), las
+                       combinaciones reemplazan algunos de sus valores
+    :param combinaciones: Lista de diccionarios {parametro: valor} (ver grid y muestra)
+    :param metrica: Columna de backtest.resumen por la que se ordena (de mayor a menor)
+    :param fee_rate: Fee por orden sobre el nocional
+    :param max_workers: Cantidad de procesos (por defecto os.cpu_count())
+    :param chunk: Combinaciones por tarea
+    :return: DataFrame con una fila por (ticker, combinacion), ordenado por ticker y metrica, con la columna 'rank'
+    """
+    data = {t: df for t, df in data.items() if t in parametros and not df.empty}
+    bloques, meta = share_velas(data)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(meta, multiprocessing.get_start_method() == 'fork')) as executor:
+            futures = [executor.submit(_evaluar, ticker, parametros[ticker], combinaciones[i:i + chunk], fee_rate)
+                       for ticker in data for i in range(0, len(combinaciones), chunk)]
+            filas = [fila for f in futures for fila in f.result()]
+    finally:
+        for shm in bloques:
+            shm.close()
+            shm.unlink()
+
+    ranking = pd.DataFrame(filas)
+    if ranking.empty:
+        return ranking
+
+    ranking = ranking.sort_values(['ticker', metrica], ascending=[True, False], ignore_index=True)
+    ranking['rank'] = ranking.groupby('ticker').cumcount() + 1
+    return ranking
+
+
+def to_parametros(ranking, parametros, rank=1):
+    """
+    Arma las filas de la hoja de parametros con la combinacion de cada ticker en la posicion 'rank' del ranking.
+
+    :param ranking: Resultado de optimizar
+    :param parametros: Diccionario con los parametros actuales de cada ticker
+    :return: Lista de diccionarios con las columnas de la hoja de parametros, para google_sheets.write_sheet
+    """
+    filas = []
+    for ticker, p in parametros.items():
+        mejor = ranking[(ranking['ticker'] == ticker) & (ranking['rank'] == rank)]
+        fila = {k: v for k, v in p.items() if k not in COLUMNAS_INSTRUMENTO}
+        if not mejor.empty:
+            for k in PARAMETROS_OPTIMIZABLES:
+                if k in mejor.columns:
+                    v = mejor.iloc[0][k]
+                    fila[k] = v.item() if hasattr(v, 'item') else v
+        filas.append(fila)
+    return filas
+
+
+if __name__ == '__main__':
+    """
+    Ejemplo con velas sinteticas. Con velas reales: descargar las velas de cada ticker, leer los parametros con
+    functions.get_parametros y escribir el resultado en la hoja de testeo para revisarlo antes de pasarlo a la hoja
+    de parametros:
+
+        google_sheets.write_sheet(gogole_sheet, to_parametros(ranking, parametros), config.HOJA_TESTEO)
+    """
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 90 * 24 * 60
+    index = pd.date_range('2024-01-01', periods=n, freq='1min', name='time')
+
+    data, parametros = {}, {}
+    for k in range(4):
+        ticker = f'T{k}-USDT-SWAP'
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.0008, n)))
+        data[ticker] = pd.DataFrame({'open': close, 'high': close * 1.0005, 'low': close * 0.9995, 'close': close},
+                                    index=index)
+        parametros[ticker] = {'ticker': ticker, 'margen': 100, 'leverage': 2, 'adx': 20, 'rsi': 50, 'ema_slow': 50,
+                              'ema_fast': 20, 'take_profit': 0.01, 'stop_loss': 0.01, 'timeframe': '1m',
+                              'instId': ticker, 'ctVal': 0.01, 'lotSz': 0.1, 'minSz': 0.1}
+
+    espacio = {'adx': [20, 25, 30], 'rsi': [30, 50, 70], 'ema_slow': [50, 100], 'ema_fast': [10, 20],
+               'take_profit': [0.005, 0.01, 0.02], 'stop_loss': [0.005, 0.01, 0.02]}
+    combinaciones = muestra(espacio, 60, seed=0)
+
+    start = time.time()
+    ranking = optimizar(data, parametros, combinaciones)
+    print(f"{len(ranking)} backtests en {time.time() - start:.2f} segundos")
+    print(ranking[ranking['rank'] <= 3])
+    print(to_parametros(ranking, parametros))
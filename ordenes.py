@@ -0,0 +1,189 @@
+"""
+Seguimiento de la ejecucion de las ordenes del bot.
+
+Antes, luego de cada orden esperabamos un tiempo fijo (sleep(1) al abrir, sleep(0.1) al cerrar) y recien ahi
+consultabamos la orden. Ahora enviamos todas las ordenes de la corrida y despues esperamos todas juntas con
+wait_fills, que resuelve cada clOrdId apenas se ejecuta:
+- Si hay un FillTracker activo (config.FILL_TRACKER_WS), las ejecuciones llegan por el canal privado 'orders' del
+  websocket de OKX.
+- Las ordenes que no llegaron por websocket se consultan por REST, todas en cada vuelta, con espera exponencial
+  empezando por una espera corta.
+
+https://www.okx.com/docs-v5/en/#order-book-trading-trade-ws-order-channel
+"""
+
+import asyncio
+import json
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import websockets
+from okx.websocket.WsUtils import initLoginParams
+
+import api_okx
+import config
+
+# URLs del websocket privado segun el flag (live trading: 0, demo trading: 1)
+PRIVATE_URLS = {
+    '0': 'wss://ws.okx.com:8443/ws/v5/private',
+    '1': 'wss://wspap.okx.com:8443/ws/v5/private?brokerId=9999',
+}
+
+
+class FillTracker:
+    """
+    Escucha el canal privado 'orders' en un thread propio y guarda las ordenes que llegan a un estado final.
+    Las ordenes se guardan aunque nadie las este esperando todavia, porque una orden market puede ejecutarse antes
+    de que empecemos a esperarla.
+    """
+
+    def __init__(self, api_key, api_secret, passphrase, url=None, inst_type='SWAP', max_orders=1000,
+                 ping_interval=25, reconnect_delay=5):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.passphrase = passphrase
+        self.url = url or PRIVATE_URLS['1']
+        self.inst_type = inst_type
+        self.max_orders = max_orders
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+
+        self.fills = OrderedDict()  # clOrdId -> orden (formato de OKX)
+        self.connected = False
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+
+    def wait(self, clOrdIds, timeout):
+        """
+        Espera a que lleguen las ordenes indicadas.
+
+        :param clOrdIds: Lista de clOrdId
+        :param timeout: Espera maxima en segundos
+        :return: Diccionario {clOrdId: orden} con las ordenes que llegaron
+        """
+        with self._cond:
+            if self.connected:
+                self._cond.wait_for(lambda: all(c in self.fills for c in clOrdIds), timeout)
+            return {c: self.fills[c] for c in clOrdIds if c in self.fills}
+
+    def on_message(self, message):
+        if message == 'pong':
+            return
+
+        msg = json.loads(message)
+        if 'event' in msg:
+            if msg['event'] == 'error':
+                print(f"FillTracker error: {msg}")
+            return
+
+        with self._cond:
+            for orden in msg.get('data', []):
+                if orden.get('clOrdId') and orden.get('state') in api_okx.ORDER_FINAL_STATES:
+                    self.fills[orden['clOrdId']] = orden
+                    while len(self.fills) > self.max_orders:
+                        self.fills.popitem(last=False)
+            self._cond.notify_all()
+
+    async def _run(self):
+        while not self._stop:
+            try:
+                async with websockets.connect(self.url, ping_interval=None) as ws:
+                    await ws.send(initLoginParams(False, self.api_key, self.passphrase, self.api_secret))
+                    login = json.loads(await ws.recv())
+                    if login.get('code') != '0':
+                        raise ConnectionError(f"Login rechazado: {login}")
+
+                    await ws.send(json.dumps({'op': 'subscribe',
+                                              'args': [{'channel': 'orders', 'instType': self.inst_type}]}))
+                    self._set_connected(True)
+
+                    while not self._stop:
+                        try:
+                            message = await asyncio.wait_for(ws.recv(), timeout=self.ping_interval)
+                        except asyncio.TimeoutError:
+                            await ws.send('ping')
+                            continue
+                        self.on_message(message)
+
+            except Exception:
+                traceback.print_exc()
+                print("FillTracker: conexion cerrada, reconectando")
+            finally:
+                self._set_connected(False)
+
+            if not self._stop:
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _set_connected(self, value):
+        with self._cond:
+            self.connected = value
+            self._cond.notify_all()
+
+
+# Tracker usado por wait_fills, lo setea main.run si config.FILL_TRACKER_WS
+_tracker = None
+
+
+def set_tracker(tracker):
+    global _tracker
+    _tracker = tracker
+
+
+def wait_fills(account_trade_api, pedidos, first_delay=config.FILL_FIRST_DELAY, max_wait=config.FILL_MAX_WAIT):
+    """
+    Espera la ejecucion de varias ordenes a la vez.
+
+    :param account_trade_api: Instancia de TradeAPI
+    :param pedidos: Lista de tuplas (instId, clOrdId, close), close=True para ordenes de cierre (devuelve el pnl)
+    :param first_delay: Primera espera en segundos del polling por REST
+    :param max_wait: Espera total maxima en segundos
+    :return: Diccionario {clOrdId: datos} con el formato de api_okx.parse_order. Las ordenes que no se pudieron
+             consultar no estan en el diccionario.
+    """
+    resultados = {}
+    if not pedidos:
+        return resultados
+
+    inicio = time.monotonic()
+
+    if _tracker is not None:
+        recibidas = _tracker.wait([clOrdId for _, clOrdId, _ in pedidos], timeout=max_wait)
+        for instId, clOrdId, close in pedidos:
+            if clOrdId in recibidas:
+                resultados[clOrdId] = api_okx.parse_order(recibidas[clOrdId], close)
+
+    # Las que faltan las consulto por REST, todas en cada vuelta
+    pendientes = [p for p in pedidos if p[1] not in resultados]
+    delay = first_delay
+
+    while pendientes:
+        vencido = time.monotonic() - inicio >= max_wait
+
+        for pedido in list(pendientes):
+            instId, clOrdId, close = pedido
+            data = account_trade_api.get_order(instId=instId, clOrdId=clOrdId).get('data', [])
+
+            if data and (data[0].get('state') in api_okx.ORDER_FINAL_STATES or vencido):
+                resultados[clOrdId] = api_okx.parse_order(data[0], close)
+                pendientes.remove(pedido)
+
+        if vencido:
+            for instId, clOrdId, _ in pendientes:
+                print(f"No se pudo consultar la orden {clOrdId} de {instId}")
+            break
+
+        if pendientes:
+            time.sleep(delay)
+            delay *= 2
+
+    return resultados
@@ -0,0 +1,165 @@
+"""
+Planificador de corridas alineado al cierre de las velas.
+
+Antes el bot corria cada minuto calendario (functions.sleep_until_next_minute) sin importar el timeframe de cada
+ticker, por lo que un ticker de 1H se recalculaba 60 veces por hora con la misma vela. Ademas si una corrida duraba
+mas de un minuto nadie se enteraba de los minutos salteados.
+
+BarScheduler agrupa los tickers por timeframe y despierta justo despues del cierre de la proxima vela (mas un margen
+'settle' para que OKX confirme la vela). Cada corrida recibe los timeframes cuya vela cerro, asi el bot solo procesa
+esos tickers.
+
+- El cierre de las velas se calcula con el reloj del sistema (las velas de OKX estan alineadas a la hora real) y las
+  esperas con time.monotonic, que no salta si se ajusta el reloj.
+- Si una corrida termina despues del cierre de la siguiente vela, la siguiente corrida arranca enseguida y se
+  informa el atraso. Si se saltearon velas enteras se informa cuantas.
+
+https://www.okx.com/docs-v5/en/#order-book-trading-market-data-get-candlesticks
+"""
+
+import time
+
+import config
+import velas
+
+HORA_MS = 60 * 60 * 1000
+DIA_MS = 24 * HORA_MS
+
+
+def origen(bar):
+    """
+    Timestamp en ms de un cierre de vela de referencia. Las velas de 6H o mas sin el sufijo 'utc' abren en hora de
+    Hong Kong (UTC+8) y las semanales abren los lunes.
+    """
+    ms = 0
+    if not bar.endswith('utc') and velas.bar_seconds(bar) >= 6 * 60 * 60:
+        ms -= 8 * HORA_MS
+    if bar.startswith('1W'):
+        ms += 4 * DIA_MS  # el 1/1/1970 fue jueves, el primer lunes es el 5/1
+    return ms
+
+
+def ultimo_cierre(bar, ts_ms):
+    """ Ultimo cierre de vela (ms) menor o igual a ts_ms. """
+    periodo = velas.bar_seconds(bar) * 1000
+    base = origen(bar)
+    return base + ((ts_ms - base) // periodo) * periodo
+
+
+class BarScheduler:
+    """
+    Uso desde main.run:
+        scheduler = BarScheduler()
+        while True:
+            tick = scheduler.wait(timeframes)
+            ... procesar los tickers con timeframe en tick['bars']
+    """
+
+    def __init__(self, settle=config.SCHEDULER_SETTLE, tolerancia=config.SCHEDULER_TOLERANCIA,
+                 reloj=time.time, monotonic=time.monotonic, sleep=time.sleep):
+        """
+        :param settle: Segundos de espera despues del cierre de la vela
+        :param tolerancia: Segundos de atraso a partir de los cuales se informa la corrida como atrasada
+        :param reloj, monotonic, sleep: Funciones de tiempo (se pueden reemplazar para simular)
+        """
+        self.settle = settle
+        self.tolerancia = tolerancia
+        self.reloj = reloj
+        self.monotonic = monotonic
+        self.sleep = sleep
+
+        self.ultimo = {}  # bar -> ultimo cierre procesado (ms)
+        self.atrasos = 0  # corridas que arrancaron mas tarde que la tolerancia
+        self.saltadas = {}  # bar -> cantidad de velas salteadas
+        self._inicio = None  # monotonic del inicio de la corrida actual
+
+    def _vencidas(self, bars, ahora_ms):
+        """ Timeframes cuya vela cerro (con settle) despues del ultimo cierre procesado. """
+        listo = ahora_ms - self.settle * 1000
+        return {bar: ultimo_cierre(bar, listo) for bar in bars
+                if bar not in self.ultimo or ultimo_cierre(bar, listo) > self.ultimo[bar]}
+
+    def wait(self, bars):
+        """
+        Espera hasta el proximo cierre de vela de alguno de los timeframes. La primera llamada no espera, todos los
+        timeframes estan vencidos.
+
+        :param bars: Timeframes de los tickers, por ejemplo {'1m', '1H'}
+        :return: Diccionario con:
+                 - bars: timeframes cuya vela cerro
+                 - cierre: timestamp en ms del cierre mas reciente
+                 - atraso: segundos entre el momento previsto (cierre + settle) y el inicio de la corrida
+                 - saltadas: {bar: velas salteadas} de los timeframes que perdieron velas
+                 - duracion_anterior: segundos que duro la corrida anterior (monotonic)
+        """
+        bars = set(bars) or {'1m'}  # sin tickers sigo corriendo cada minuto
+        duracion = None if self._inicio is None else self.monotonic() - self._inicio
+
+        while True:
+            ahora_ms = int(self.reloj() * 1000)
+            vencidas = self._vencidas(bars, ahora_ms)
+            if vencidas:
+                break
+
+            # Proximo cierre entre todos los timeframes, la espera la mido con el reloj monotonic
+            proximo = min(self.ultimo[bar] + velas.bar_seconds(bar) * 1000 for bar in bars)
+            espera = (proximo - ahora_ms) / 1000 + self.settle
+            fin = self.monotonic() + espera
+            while (restante := fin - self.monotonic()) > 0:
+                self.sleep(restante)
+
+        self._inicio = self.monotonic()
+
+        # El atraso se mide contra los timeframes ya procesados antes (en el arranque no hay atraso)
+        cierre = max(vencidas.values())
+        previas = [c for bar, c in vencidas.items() if bar in self.ultimo]
+        atraso = max(ahora_ms / 1000 - (max(previas) / 1000 + self.settle), 0.) if previas else 0.
+        saltadas = {}
+        for bar, c in vencidas.items():
+            if bar in self.ultimo:
+                n = (c - self.ultimo[bar]) // (velas.bar_seconds(bar) * 1000) - 1
+                if n > 0:
+                    saltadas[bar] = n
+                    self.saltadas[bar] = self.saltadas.get(bar, 0) + n
+            self.ultimo[bar] = c
+
+        if atraso > self.tolerancia:
+            self.atrasos += 1
+            print(f"Corrida atrasada {atraso:.1f} segundos (duracion anterior {duracion or 0:.1f} segundos)")
+        if saltadas:
+            print(f"Velas salteadas: {saltadas}")
+
+        return {'bars': sorted(vencidas, key=velas.bar_seconds), 'cierre': cierre, 'atraso': atraso,
+                'saltadas': saltadas, 'duracion_anterior': duracion}
+
+
+if __name__ == '__main__':
+    """
+    Simulacion de 3 horas con tickers de 1m, 5m y 1H y un reloj falso: cuenta cuantas veces se procesa cada timeframe
+    y muestra que una corrida de 150 segundos saltea velas de 1m y se informa.
+    """
+    class Reloj:
+        def __init__(self):
+            self.t = 1_700_000_000.0
+
+        def time(self):
+            return self.t
+
+        def sleep(self, s):
+            self.t += s
+
+    reloj = Reloj()
+    scheduler = BarScheduler(settle=1, reloj=reloj.time, monotonic=reloj.time, sleep=reloj.sleep)
+
+    procesadas = {'1m': 0, '5m': 0, '1H': 0}
+    fin = reloj.t + 3 * 60 * 60
+    corrida = 0
+    while reloj.t < fin:
+        tick = scheduler.wait(procesadas)
+        for bar in tick['bars']:
+            procesadas[bar] += 1
+        corrida += 1
+        reloj.sleep(150 if corrida == 30 else 2)  # duracion de la corrida
+
+    print(f"Corridas: {corrida}, procesadas por timeframe: {procesadas}")
+    print(f"Corridas atrasadas: {scheduler.atrasos}, velas salteadas: {scheduler.saltadas}")
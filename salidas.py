@@ -0,0 +1,146 @@
+"""
+Evaluacion del stop loss y take profit dentro de las velas.
+
+check_stop_loss_take_profit compara los niveles solo contra un precio (el ultimo close). Una mecha que
+atraviesa el stop loss dentro de la vela y vuelve no se detecta, o se detecta varias velas despues con mas
+deslizamiento. Aca revisamos el high y low de cada vela desde la apertura de la posicion y ademas el mark price
+actual, y guardamos cual nivel se toco primero.
+
+- Si en una misma vela se tocan los dos niveles no se puede saber cual fue primero: se toma el stop loss
+  (criterio conservador, igual que en backtest.py).
+- Solo se usan las velas que abrieron desde el execution_time de la posicion. La vela en la que se ejecuto la orden
+  puede tener precios anteriores a la apertura, por eso no se usa.
+
+first_exit trabaja sobre arrays y sirve tanto para una posicion en vivo como para recorrer toda la historia en el
+backtest.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def check_stop_loss_take_profit(posicion, price):
+    """
+    Compara un precio contra el stop loss y take profit de una posición.
+    :param posicion: Diccionario con los datos de la posición.
+    :param price: Precio a comparar (ultimo cierre, mark price, etc).
+    :return: Tupla con un booleano indicando si se debe cerrar la posición y el motivo.
+    """
+    stop_loss = posicion['stop_loss']
+    take_profit = posicion['take_profit']
+    side = posicion['side']
+
+    if price <= stop_loss if side == 'long' else price >= stop_loss:
+        return True, 'stop loss'
+    elif price >= take_profit if side == 'long' else price <= take_profit:
+        return True, 'take profit'
+
+    return False, None
+
+
+def hits(side, high, low, stop_loss, take_profit):
+    """
+    Velas en las que se toca cada nivel.
+
+    :param side: 1 long, -1 short (o 'long' / 'short')
+    :param high: Array con los maximos de las velas
+    :param low: Array con los minimos de las velas
+    :return: Tupla (sl, tp) de arrays de booleanos
+    """
+    if side in (1, 'long'):
+        return low <= stop_loss, high >= take_profit
+    return high >= stop_loss, low <= take_profit
+
+
+def first_exit(high, low, desde, side, stop_loss, take_profit, ventana=256):
+    """
+    Primera vela desde 'desde' en la que se toca el stop loss o el take profit. Busca en ventanas crecientes, por lo
+    que el costo es proporcional a la cantidad de velas hasta la salida y no al largo de la serie.
+
+    Con high = low = close es la misma regla que check_stop_loss_take_profit aplicada vela a vela.
+
+    :return: Tupla (indice, motivo) o (None, None) si no se toca ningun nivel
+    """
+    n = len(high)
+    j = desde
+    while j < n:
+        sl, tp = hits(side, high[j:j + ventana], low[j:j + ventana], stop_loss, take_profit)
+        hit = sl | tp
+        if hit.any():
+            k = int(np.argmax(hit))
+            return j + k, 'stop loss' if sl[k] else 'take profit'
+        j += ventana
+        ventana *= 2
+    return None, None
+
+
+def exit_price(side, motivo, stop_loss, take_profit, open_price):
+    """
+    Precio de salida de una vela que toco un nivel: el nivel, o el open si la vela abrio mas alla del nivel (gap).
+    """
+    nivel = stop_loss if motivo == 'stop loss' else take_profit
+    peor = (motivo == 'stop loss') == (side in (1, 'long'))  # stop de un long o take profit de un short
+    return min(open_price, nivel) if peor else max(open_price, nivel)
+
+
+def execution_ms(execution_time):
+    """
+    Timestamp en ms de un execution_time de la hoja de posiciones. api_okx.parse_order lo guarda en hora local, por
+    eso se interpreta como hora local. None si no se puede interpretar.
+    """
+    try:
+        return int(datetime.strptime(str(execution_time), '%Y-%m-%d %H:%M:%S').timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def evaluate_exit(posicion, df, mark_price=None):
+    """
+    Evalua el stop loss y take profit de una posicion con el high y low de las velas desde su apertura y con el
+    mark price.
+
+    :param posicion: Diccionario con los datos de la posición (side, stop_loss, take_profit, execution_time).
+    :param df: DataFrame de velas del ticker (formato de api_okx.get_historical_data_formatted).
+    :param mark_price: Mark price actual (api_okx.get_positions_dict), None o NaN si no se tiene.
+    :return: None si no se toco ningun nivel, o diccionario con motivo ('stop loss' o 'take profit'), fuente
+             ('vela' o 'mark'), time (apertura de la vela, None para el mark) y precio (nivel tocado o mark price).
+    """
+    if df is not None and len(df):
+        desde_ms = execution_ms(posicion.get('execution_time'))
+        if desde_ms is None:  # sin execution_time solo uso la ultima vela
+            desde = len(df) - 1
+        else:
+            desde = int(df.index.searchsorted(pd.Timestamp(desde_ms, unit='ms'), side='left'))
+
+        high = df['high'].to_numpy()
+        low = df['low'].to_numpy()
+        i, motivo = first_exit(high, low, desde, posicion['side'], posicion['stop_loss'], posicion['take_profit'])
+        if i is not None:
+            precio = posicion['stop_loss'] if motivo == 'stop loss' else posicion['take_profit']
+            return {'motivo': motivo, 'fuente': 'vela', 'time': df.index[i], 'precio': precio}
+
+    if mark_price is not None and not np.isnan(mark_price):
+        cerrar, motivo = check_stop_loss_take_profit(posicion, mark_price)
+        if cerrar:
+            return {'motivo': motivo, 'fuente': 'mark', 'time': None, 'precio': mark_price}
+
+    return None
+
+
+if __name__ == '__main__':
+    """
+    Ejemplo: una posicion long cuyo stop loss se toca con una mecha, aunque todos los close quedan por encima.
+    """
+    index = pd.date_range('2024-03-01 12:00', periods=5, freq='1min', name='time')
+    df = pd.DataFrame({'open': [100, 100.2, 100.1, 100.3, 100.2],
+                       'high': [100.3, 100.4, 100.3, 100.5, 100.4],
+                       'low': [99.9, 100.0, 99.4, 100.1, 100.0],
+                       'close': [100.2, 100.1, 100.3, 100.2, 100.3]}, index=index)
+    posicion = {'ticker': 'BTC-USDT-SWAP', 'side': 'long', 'stop_loss': 99.5, 'take_profit': 101,
+                'execution_time': datetime.fromtimestamp(index[1].value / 10 ** 9).strftime('%Y-%m-%d %H:%M:%S')}
+
+    print('Solo el ultimo close:', check_stop_loss_take_profit(posicion, df['close'].iloc[-1]))
+    print('Con high y low:', evaluate_exit(posicion, df))
+    print('Con mark price:', evaluate_exit(posicion, df.iloc[:2], mark_price=99.4))
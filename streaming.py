@@ -0,0 +1,316 @@
+"""
+Motor de streaming: recibe velas y mark price de OKX por websocket.
+
+En el modo normal el bot se entera de los precios una vez por minuto (REST), por lo que un stop loss o take profit
+se puede detectar hasta 60 segundos tarde. En modo streaming nos suscribimos a los canales publicos de OKX:
+- candle<bar>: velas del timeframe de cada ticker (endpoint business)
+- mark-price: mark price de cada ticker (endpoint public)
+
+Con cada mensaje evaluamos el stop loss y take profit de las posiciones abiertas y, si corresponde, cerramos la
+posicion con la misma funcion que usa el bot (functions.close_single_position). Las velas confirmadas se agregan a
+la cache de velas.py, asi la siguiente corrida del bot no necesita descargarlas.
+
+Los cierres quedan guardados en el motor y main.run los toma al inicio de cada corrida (drain) para enviarlos a
+telegram y a google sheets junto con el resto de las operaciones.
+
+Para probar sin conexion a OKX se puede grabar una sesion con record_frames y reproducirla con replay_server.
+
+https://www.okx.com/docs-v5/en/#order-book-trading-market-data-ws-candlesticks-channel
+https://www.okx.com/docs-v5/en/#public-data-websocket-mark-price-channel
+"""
+
+import asyncio
+import json
+import threading
+import traceback
+
+import websockets
+
+import config
+import functions
+import salidas
+import velas
+
+# URLs de websocket segun el flag (live trading: 0, demo trading: 1)
+URLS = {
+    '0': {'public': 'wss://ws.okx.com:8443/ws/v5/public',
+          'business': 'wss://ws.okx.com:8443/ws/v5/business'},
+    '1': {'public': 'wss://wspap.okx.com:8443/ws/v5/public?brokerId=9999',
+          'business': 'wss://wspap.okx.com:8443/ws/v5/business?brokerId=9999'},
+}
+
+
+class StreamingEngine:
+    """
+    Mantiene las conexiones websocket en un thread propio y evalua stop loss / take profit en cada tick.
+
+    Uso desde main.run:
+        engine = StreamingEngine(parametros, account_trade_api)
+        engine.start()
+        ...
+        with engine.lock:  # mientras el bot cierra posiciones el motor no cierra
+            cerradas = engine.drain(to_telegram, to_sheets)
+            ...
+            engine.set_posiciones(posiciones)
+    """
+
+    def __init__(self, parametros, account_trade_api, urls=None, limit=config.VELAS_LIMIT,
+                 close_fn=functions.close_single_position, ping_interval=25, reconnect_delay=5):
+        """
+        :param parametros: Diccionario con los parámetros de cada ticker (se usa el timeframe).
+        :param account_trade_api: Instancia de TradeAPI para cerrar posiciones.
+        :param urls: Diccionario con las urls 'public' y 'business' (por defecto las de demo trading).
+        :param limit: Cantidad de velas de la cache (ver velas.get_velas).
+        :param close_fn: Funcion para cerrar una posicion, misma firma que functions.close_single_position. Devuelve
+                         los datos del cierre o None si no se pudo consultar la orden.
+        :param ping_interval: Segundos sin mensajes antes de enviar un ping (OKX corta a los 30 segundos).
+        :param reconnect_delay: Segundos de espera antes de reconectar.
+        """
+        self.parametros = parametros
+        self.account_trade_api = account_trade_api
+        self.urls = urls or URLS['1']
+        self.limit = limit
+        self.close_fn = close_fn
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+
+        self.lock = threading.Lock()
+        self.posiciones = {}  # ticker -> posicion (formato de la hoja de posiciones)
+        self.last_price = {}  # ticker -> ultimo precio recibido
+        self.alertas = []
+        self.sheets = []
+        self.cerradas = []
+
+        self._cerrando = set()
+        self._websockets = set()
+        self._stop = False
+        self._loop = None
+        self._thread = None
+
+    # Interfaz para main.run (se llama desde el thread principal)
+    def start(self):
+        """ Inicia las conexiones en un thread daemon. """
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Cierra las conexiones y termina el thread. """
+        self._stop = True
+        self._reconnect()
+
+    def set_posiciones(self, posiciones):
+        """ Reemplaza las posiciones a vigilar. Llamar con self.lock tomado. """
+        self.posiciones = {p['ticker']: p for p in posiciones}
+
+    def add_posiciones(self, posiciones):
+        """ Agrega posiciones a vigilar, por ejemplo las abiertas en la corrida. """
+        with self.lock:
+            for p in posiciones:
+                self.posiciones[p['ticker']] = p
+
+    def set_parametros(self, parametros):
+        """ Actualiza los tickers. Si cambiaron los tickers o timeframes reconecta para suscribirse de nuevo. """
+        anterior = {t: p['timeframe'] for t, p in self.parametros.items()}
+        nuevo = {t: p['timeframe'] for t, p in parametros.items()}
+        self.parametros = parametros
+        if anterior != nuevo:
+            self._reconnect()
+
+    def drain(self, list_alertas, list_sheets):
+        """
+        Pasa los cierres hechos por el motor a las listas del bot. Llamar con self.lock tomado.
+
+        :return: Lista de tickers cerrados por el motor desde la ultima llamada.
+        """
+        cerradas = self.cerradas
+        list_alertas.extend(self.alertas)
+        list_sheets.extend(self.sheets)
+        self.alertas, self.sheets, self.cerradas = [], [], []
+        return cerradas
+
+    # Procesamiento de mensajes (se ejecuta en el thread del motor)
+    def on_message(self, message):
+        """ Procesa un mensaje de OKX: agrega velas confirmadas a la cache y evalua sl/tp con el precio recibido. """
+        if message == 'pong':
+            return
+
+        msg = json.loads(message)
+        if 'event' in msg:  # respuesta a la suscripcion o error
+            if msg['event'] == 'error':
+                print(f"Streaming error: {msg}")
+            return
+
+        channel = msg['arg']['channel']
+        instId = msg['arg']['instId']
+
+        for d in msg.get('data', []):
+            if channel.startswith('candle'):
+                price = float(d[4])
+                if d[8] == '1':  # vela confirmada
+                    velas.add_vela(instId, channel[len('candle'):], d, limit=self.limit)
+            else:  # mark-price
+                price = float(d['markPx'])
+
+            self.last_price[instId] = price
+            self.evaluate(instId, price)
+
+    def evaluate(self, instId, price):
+        """ Evalua sl/tp de la posicion del ticker y si corresponde la cierra en un thread aparte. """
+        posicion = self.posiciones.get(instId)
+        if posicion is None or instId in self._cerrando or posicion.get('cierre_pendiente'):
+            return
+        if posicion.get('tpsl_exchange'):  # el take profit y stop loss los ejecuta OKX
+            return
+
+        cerrar, motivo = salidas.check_stop_loss_take_profit(posicion, price)
+        if cerrar:
+            self._cerrando.add(instId)
+            # El cierre hace requests bloqueantes, lo hago fuera del loop para seguir recibiendo mensajes
+            self._loop.run_in_executor(None, self._close, instId, motivo)
+
+    def _close(self, instId, motivo):
+        with self.lock:
+            posicion = self.posiciones.pop(instId, None)  # si el bot ya la cerro no esta mas
+            try:
+                if posicion is not None:
+                    data = self.close_fn(posicion, motivo, posicion['margen'], posicion['nocional'],
+                                         self.account_trade_api, self.alertas, self.sheets)
+                    if data is None:
+                        # La orden no se pudo consultar, queda como cierre pendiente (ver functions.pending_close)
+                        # y la reconcilia la proxima corrida del bot. No se vuelve a cerrar desde el motor
+                        self.posiciones[instId] = posicion
+                    else:
+                        self.cerradas.append(instId)
+            except Exception:
+                traceback.print_exc()
+                self.posiciones[instId] = posicion  # se reintenta en el proximo tick
+            finally:
+                self._cerrando.discard(instId)
+
+    # Conexiones
+    def _subscriptions(self):
+        candles = [{'channel': f"candle{p['timeframe']}", 'instId': t} for t, p in self.parametros.items()]
+        mark = [{'channel': 'mark-price', 'instId': t} for t in self.parametros]
+        return {'business': candles, 'public': mark}
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        await asyncio.gather(self._connect('business'), self._connect('public'))
+
+    async def _connect(self, endpoint):
+        """ Mantiene una conexion al endpoint, reconectando si se corta. """
+        while not self._stop:
+            ws = None
+            try:
+                async with websockets.connect(self.urls[endpoint], ping_interval=None) as ws:
+                    self._websockets.add(ws)
+                    await ws.send(json.dumps({'op': 'subscribe', 'args': self._subscriptions()[endpoint]}))
+
+                    while True:
+                        try:
+                            message = await asyncio.wait_for(ws.recv(), timeout=self.ping_interval)
+                        except asyncio.TimeoutError:
+                            await ws.send('ping')
+                            continue
+                        self.on_message(message)
+
+            except (websockets.ConnectionClosed, OSError) as e:
+                if not self._stop:
+                    print(f"Streaming: conexion {endpoint} cerrada ({e}), reconectando")
+            finally:
+                self._websockets.discard(ws)
+
+            if not self._stop:
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _reconnect(self):
+        """ Cierra las conexiones abiertas, el loop de _connect vuelve a conectar y suscribirse. """
+        if self._loop is None:
+            return
+        for ws in list(self._websockets):
+            asyncio.run_coroutine_threadsafe(ws.close(), self._loop)
+
+
+# Herramientas para probar sin conexion
+async def record_frames(url, args, n=100):
+    """
+    Graba n mensajes de OKX para luego reproducirlos con replay_server.
+
+    :param url: URL del websocket
+    :param args: Lista de suscripciones, por ejemplo [{'channel': 'mark-price', 'instId': 'BTC-USDT-SWAP'}]
+    :param n: Cantidad de mensajes a grabar
+    :return: Lista de mensajes (strings)
+    """
+    frames = []
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({'op': 'subscribe', 'args': args}))
+        while len(frames) < n:
+            frames.append(await ws.recv())
+    return frames
+
+
+async def replay_server(frames, host='localhost', port=8765, delay=0.0):
+    """
+    Servidor websocket local que reproduce mensajes grabados. A cada conexion le envia solo los mensajes de los
+    canales a los que se suscribio, igual que OKX.
+
+    :param frames: Lista de mensajes grabados (strings o diccionarios)
+    :param delay: Segundos de espera entre mensajes
+    :return: Servidor de websockets (usar server.close() para terminarlo)
+    """
+    frames = [f if isinstance(f, str) else json.dumps(f) for f in frames]
+
+    async def handler(ws):
+        subscribe = json.loads(await ws.recv())
+        args = [(a['channel'], a['instId']) for a in subscribe['args']]
+        for arg in args:
+            await ws.send(json.dumps({'event': 'subscribe', 'arg': {'channel': arg[0], 'instId': arg[1]}}))
+
+        for frame in frames:
+            msg = json.loads(frame)
+            if 'arg' in msg and 'event' not in msg and (msg['arg']['channel'], msg['arg']['instId']) in args:
+                await ws.send(frame)
+                await asyncio.sleep(delay)
+
+        await ws.wait_closed()
+
+    return await websockets.serve(handler, host, port)
+
+
+if __name__ == '__main__':
+    """
+    Ejemplo offline: reproducimos mensajes de mark price contra una posicion long de BTC y vemos que el motor la
+    cierra por stop loss apenas el precio lo atraviesa, sin esperar a la siguiente vela.
+    """
+    import time
+
+    frames = [{'arg': {'channel': 'mark-price', 'instId': 'BTC-USDT-SWAP'},
+               'data': [{'instType': 'SWAP', 'instId': 'BTC-USDT-SWAP', 'markPx': str(px), 'ts': '0'}]}
+              for px in [60100, 60050, 59990, 59850, 59700]]
+
+    def close_print(posicion, motivo, margen, nocional, account_trade_api, list_alertas, list_sheets):
+        print(f"Cierro {posicion['ticker']} por {motivo}")
+        list_alertas.append(f"Cierro posicion {posicion['ticker']} por {motivo}")
+        return {'ticker': posicion['ticker'], 'tipo': 'close', 'motivo': motivo}
+
+    def servir():
+        async def main():
+            await replay_server(frames, delay=0.05)
+            await asyncio.sleep(3)
+        asyncio.run(main())
+
+    threading.Thread(target=servir, daemon=True).start()
+    time.sleep(0.5)
+
+    parametros = {'BTC-USDT-SWAP': {'timeframe': '1m'}}
+    engine = StreamingEngine(parametros, None, urls={'public': 'ws://localhost:8765', 'business': 'ws://localhost:8765'},
+                             close_fn=close_print)
+    engine.set_posiciones([{'ticker': 'BTC-USDT-SWAP', 'side': 'long', 'stop_loss': 59900, 'take_profit': 61000,
+                            'margen': 100, 'nocional': 100, 'leverage': 1}])
+    engine.start()
+    time.sleep(1.5)
+
+    to_telegram, to_sheets = [], []
+    with engine.lock:
+        print(engine.drain(to_telegram, to_sheets), to_telegram)
+    engine.stop()
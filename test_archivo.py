@@ -0,0 +1,62 @@
+"""
+Archivo local de velas en una carpeta temporal.
+
+Ejecutar con: python -m pytest -q test_archivo.py
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import archivo
+
+
+def _velas(n, inicio='2024-01-01 23:50'):
+    index = pd.date_range(inicio, periods=n, freq='1min', name='time')
+    return pd.DataFrame({c: np.arange(n, dtype=np.float64) + i for i, c in enumerate(archivo.COLUMNAS)}, index=index)
+
+
+def test_agrega_al_final_y_lee_igual(tmp_path):
+    root = str(tmp_path)
+    df = _velas(30)
+
+    assert archivo.write_velas(df.iloc[10:20], 'X', '1m', root) == 10
+    path = archivo._path(root, 'X', '1m', df.index[15].value // 10 ** 6 // archivo.DIA_MS)
+    inodo = os.stat(path).st_ino
+
+    # velas nuevas con superposicion: se agregan al final sin reescribir el archivo
+    assert archivo.write_velas(df.iloc[18:25], 'X', '1m', root) == 5
+    assert os.stat(path).st_ino == inodo
+
+    # velas anteriores (backfill): se reescribe el dia
+    assert archivo.write_velas(df.iloc[:12], 'X', '1m', root) == 10
+    assert archivo.write_velas(df.iloc[25:], 'X', '1m', root) == 5
+
+    leidas = archivo.read_velas('X', '1m', root=root)
+    assert leidas.index.equals(df.index)
+    assert np.array_equal(leidas.to_numpy(), df.to_numpy())
+
+
+def test_escrituras_concurrentes_no_duplican(tmp_path):
+    root = str(tmp_path)
+    df = _velas(100, '2024-01-01')
+    archivo.write_velas(df.iloc[:1], 'X', '1m', root)
+
+    # la misma vela desde varios threads a la vez, como el motor de streaming y el pool de descargas
+    for i in range(1, len(df)):
+        barrera = threading.Barrier(4)
+
+        def escribir():
+            barrera.wait()
+            archivo.write_velas(df.iloc[i:i + 1], 'X', '1m', root)
+
+        threads = [threading.Thread(target=escribir) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    leidas = archivo.read_velas('X', '1m', root=root)
+    assert leidas.index.equals(df.index)
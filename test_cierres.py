@@ -0,0 +1,99 @@
+"""
+Cierres de posiciones contra la base local, sin conexion a OKX (las funciones de api_okx se reemplazan).
+
+Ejecutar con: python -m pytest -q test_cierres.py
+"""
+
+import pytest
+
+import base_datos
+import functions
+import ordenes
+
+POSICION = {'ticker': 'BTC-USDT-SWAP', 'execution_time': '2024-01-01 00:00:00', 'side': 'long', 'margen': 10.,
+            'leverage': 5, 'nocional': 50., 'avg_price': 100., 'contratos': 1., 'stop_loss': 90.,
+            'take_profit': 110., 'fee': -0.01}
+CIERRE = {'execution_time': '2024-01-01 01:00:00', 'avg_price': 89., 'contratos': 1., 'fee': -0.01, 'pnl': -1.1}
+
+
+@pytest.fixture
+def db(tmp_path):
+    conn = base_datos.get_connection(str(tmp_path / 'bot.db'))
+    base_datos.write_batch(conn, [{**POSICION, 'tipo': 'open', 'motivo': 'cruce'}])
+    yield conn
+    conn.close()
+
+
+def _cerrar(db, posiciones_api):
+    """ Una etapa de cierre de main.run_cycle: devuelve (cerradas, alertas, tipos) y guarda en la base """
+    alertas, sheets = [], []
+    cerradas = functions.close_positions(base_datos.read_posiciones(db), posiciones_api, None, None, alertas,
+                                         sheets)
+    base_datos.write_batch(db, sheets)
+    return cerradas, alertas, [d['tipo'] for d in sheets]
+
+
+def test_cierre_sin_fill_queda_pendiente_y_se_registra_despues(db, monkeypatch):
+    monkeypatch.setattr(functions, 'should_close_position', lambda p, mercado, ticker: (True, 'stop loss'))
+    monkeypatch.setattr(functions, 'api_close_positions', lambda pedidos, api, max_workers: ['c1'] * len(pedidos))
+    monkeypatch.setattr(ordenes, 'wait_fills', lambda api, pedidos: {})
+    api = {'BTC-USDT-SWAP': {'margin': 10., 'notionalUsd': 50.}}
+
+    cerradas, _, tipos = _cerrar(db, api)
+    assert cerradas == ['BTC-USDT-SWAP'] and tipos == ['pendiente']
+    assert base_datos.get_posicion(db, 'BTC-USDT-SWAP')['cierre_pendiente'] == 'c1'
+
+    # La orden todavia no aparece y la posicion ya no esta en la api: sigue pendiente, no se borra
+    monkeypatch.setattr(functions, 'get_data_close_position', lambda api, ticker, clOrdId: None)
+    monkeypatch.setattr(functions, 'get_close_order', lambda api, ticker, side, desde: None)
+    cerradas, alertas, tipos = _cerrar(db, {})
+    assert cerradas == [] and tipos == [] and 'Cierre pendiente' in alertas[0]
+    assert base_datos.get_posicion(db, 'BTC-USDT-SWAP') is not None
+
+    # La orden aparece: se registra el cierre con el motivo original
+    monkeypatch.setattr(functions, 'get_data_close_position', lambda api, ticker, clOrdId: dict(CIERRE))
+    cerradas, _, tipos = _cerrar(db, {})
+    assert cerradas == ['BTC-USDT-SWAP'] and tipos == ['close']
+    assert base_datos.get_posicion(db, 'BTC-USDT-SWAP') is None
+    operacion = base_datos.read_operaciones(db, 'BTC-USDT-SWAP')[-1]
+    assert (operacion['tipo'], operacion['motivo'], operacion['pnl']) == ('close', 'stop loss', -1.1)
+
+
+def test_cierre_pendiente_no_ejecutado_vuelve_a_evaluarse(db, monkeypatch):
+    alertas, sheets = [], []
+    functions.pending_close(base_datos.read_posiciones(db)[0], 'take profit', 'c1', alertas, sheets)
+    base_datos.write_batch(db, sheets)
+
+    monkeypatch.setattr(functions, 'should_close_position', lambda p, mercado, ticker: (False, None))
+    cerradas, _, tipos = _cerrar(db, {'BTC-USDT-SWAP': {'margin': 10., 'notionalUsd': 50.}})
+    assert cerradas == [] and tipos == ['pendiente']
+    assert base_datos.get_posicion(db, 'BTC-USDT-SWAP')['cierre_pendiente'] is None
+
+
+def test_tpsl_exchange_solo_omite_las_posiciones_marcadas(db, monkeypatch):
+    """ Con config.TPSL_EXCHANGE las posiciones sin la marca tpsl_exchange (abiertas antes) se siguen evaluando """
+    monkeypatch.setattr(functions.config, 'TPSL_EXCHANGE', True)
+    base_datos.write_batch(db, [{**POSICION, 'ticker': 'ETH-USDT-SWAP', 'tipo': 'open', 'motivo': 'cruce',
+                                 'tpsl_exchange': 1}])
+    evaluadas = []
+    monkeypatch.setattr(functions, 'should_close_position',
+                        lambda p, mercado, ticker: (evaluadas.append(ticker), (False, None))[1])
+    api = {t: {'margin': 10., 'notionalUsd': 50.} for t in ['BTC-USDT-SWAP', 'ETH-USDT-SWAP']}
+
+    assert _cerrar(db, api) == ([], [], [])
+    assert evaluadas == ['BTC-USDT-SWAP']
+
+
+def test_error_al_reconciliar_no_corta_la_etapa(db, monkeypatch):
+    base_datos.write_batch(db, [{**POSICION, 'ticker': 'ETH-USDT-SWAP', 'tipo': 'open', 'motivo': 'cruce',
+                                 'tpsl_exchange': 1}])
+
+    def error(*args):
+        raise ConnectionError('OKX no responde')
+
+    monkeypatch.setattr(functions, 'get_close_order', error)
+    monkeypatch.setattr(functions, 'should_close_position', lambda p, mercado, ticker: (False, None))
+
+    cerradas, alertas, tipos = _cerrar(db, {'BTC-USDT-SWAP': {'margin': 10., 'notionalUsd': 50.}})
+    assert cerradas == [] and tipos == [] and 'OKX no responde' in alertas[0]
+    assert base_datos.get_posicion(db, 'ETH-USDT-SWAP') is not None  # se vuelve a buscar en la proxima corrida
@@ -0,0 +1,82 @@
+"""
+Propiedades de lotes.quantize y lotes.quantize_array, y comparacion contra functions.adj_quantity.
+
+Ejecutar con: python -m pytest -q test_lotes.py (requiere hypothesis)
+"""
+
+from decimal import Decimal
+from math import floor
+
+import numpy as np
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from functions import adj_quantity
+from lotes import lot_step, quantize, quantize_array
+
+TICKS = [1e-7, 1e-6, 5e-6, 1e-5, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.015, 0.05, 0.1, 0.2, 0.25, 0.5, 1, 10, 100]
+
+ticks = st.sampled_from(TICKS)
+cantidades = st.floats(min_value=0, max_value=1e6, allow_nan=False, allow_infinity=False)
+
+
+def _exacto(value, tick):
+    """ Piso exacto en Decimal del valor tal como se escribe, a multiplos de paso / escala """
+    escala, paso = lot_step(tick)
+    k = int((Decimal(repr(value)) * escala).to_integral_value(rounding='ROUND_FLOOR'))
+    return Decimal(k - k % paso) / escala
+
+
+@settings(max_examples=2000, deadline=None)
+@given(value=cantidades, tick=ticks)
+def test_quantize_es_el_piso_exacto(value, tick):
+    escala, paso = lot_step(tick)
+    nuevo = quantize(value, escala, paso)
+
+    assert Decimal(repr(nuevo)) == _exacto(value, tick)
+    assert type(nuevo) is type(adj_quantity(value, tick))
+
+
+@settings(max_examples=2000, deadline=None)
+@given(value=cantidades, tick=ticks)
+def test_cantidad_en_la_grilla_no_cambia(value, tick):
+    """ Un multiplo del lotSz (escrito con los decimales del lotSz) queda igual, 2.3 con lotSz 0.01 da 2.3 """
+    escala, paso = lot_step(tick)
+    k = floor(value * escala)
+    en_grilla = (k - k % paso) / escala
+
+    assert quantize(en_grilla, escala, paso) == en_grilla
+    assert quantize_array([en_grilla], escala, paso)[0] == en_grilla
+
+
+@settings(max_examples=500, deadline=None)
+@given(values=st.lists(cantidades, max_size=50), tick=ticks)
+def test_quantize_array_igual_a_quantize(values, tick):
+    escala, paso = lot_step(tick)
+    vector = quantize_array(values, escala, paso)
+
+    assert vector.dtype == np.float64
+    assert vector.tolist() == [float(quantize(v, escala, paso)) for v in values]
+
+
+@settings(max_examples=2000, deadline=None)
+@given(value=cantidades, tick=ticks)
+def test_diferencia_con_adj_quantity(value, tick):
+    """ quantize da lo mismo que adj_quantity o un lote mas, cuando el producto en float de adj_quantity perdio uno """
+    escala, paso = lot_step(tick)
+    nuevo, anterior = Decimal(repr(quantize(value, escala, paso))), Decimal(repr(adj_quantity(value, tick)))
+
+    assert (nuevo - anterior) * escala in (0, paso)
+
+
+@pytest.mark.parametrize('value, tick, anterior, nuevo', [
+    (2.3, 0.01, 2.29, 2.3),
+    (284.215, 0.005, 284.21, 284.215),
+    (0.29, 0.01, 0.28, 0.29),
+    (7.9, 1, 7, 7),
+    (0.37, 0.2, 0.3, 0.3),
+])
+def test_ejemplos(value, tick, anterior, nuevo):
+    """ Casos donde adj_quantity perdia un lote por el producto en float, y casos sin cambios """
+    assert adj_quantity(value, tick) == anterior
+    assert quantize(value, *lot_step(tick)) == nuevo
@@ -0,0 +1,131 @@
+"""
+Motor de streaming contra el servidor local replay_server, sin conexion a OKX.
+
+Ejecutar con: python -m pytest -q test_streaming.py
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from streaming import StreamingEngine, replay_server
+
+TICKER = 'BTC-USDT-SWAP'
+
+
+def _mark(px):
+    return {'arg': {'channel': 'mark-price', 'instId': TICKER},
+            'data': [{'instType': 'SWAP', 'instId': TICKER, 'markPx': str(px), 'ts': '0'}]}
+
+
+def _posicion(side, stop_loss, take_profit):
+    return {'ticker': TICKER, 'side': side, 'stop_loss': stop_loss, 'take_profit': take_profit, 'margen': 100,
+            'nocional': 100, 'leverage': 1}
+
+
+@pytest.fixture
+def servidor():
+    """ Levanta replay_server en un thread, devuelve una funcion que recibe los frames y devuelve las urls """
+    detener = []  # (loop, evento, thread) de cada servidor
+
+    def iniciar(frames):
+        listo = threading.Event()
+        urls = {}
+
+        async def servir():
+            fin = asyncio.Event()
+            server = await replay_server(frames, port=0, delay=0.01)
+            port = server.sockets[0].getsockname()[1]
+            urls['public'] = urls['business'] = f'ws://localhost:{port}'
+            detener.append((asyncio.get_running_loop(), fin))
+            listo.set()
+            await fin.wait()
+            server.close()
+            await server.wait_closed()
+
+        thread = threading.Thread(target=asyncio.run, args=(servir(),), daemon=True)
+        thread.start()
+        listo.wait(5)
+        detener[-1] += (thread,)
+        return urls
+
+    yield iniciar
+
+    for loop, fin, thread in detener:
+        loop.call_soon_threadsafe(fin.set)
+        thread.join(5)
+
+
+def _correr(urls, posicion, close_fn, espera=2):
+    engine = StreamingEngine({TICKER: {'timeframe': '1m'}}, None, urls=urls, close_fn=close_fn, reconnect_delay=60)
+    engine.set_posiciones([posicion])
+    engine.start()
+
+    fin = time.monotonic() + espera
+    while time.monotonic() < fin and not engine.cerradas:
+        time.sleep(0.05)
+    time.sleep(0.2)  # por si hubiera un segundo cierre
+
+    alertas, sheets = [], []
+    with engine.lock:
+        cerradas = engine.drain(alertas, sheets)
+    engine.stop()
+    return engine, cerradas, sheets
+
+
+def _close_ok(llamadas):
+    def close_fn(posicion, motivo, margen, nocional, account_trade_api, list_alertas, list_sheets):
+        llamadas.append((posicion['ticker'], motivo))
+        data = {'ticker': posicion['ticker'], 'tipo': 'close', 'motivo': motivo}
+        list_sheets.append(data)
+        return data
+    return close_fn
+
+
+@pytest.mark.parametrize('side, precios, motivo', [
+    ('long', [60100, 60050, 59990, 59850, 59700], 'stop loss'),
+    ('long', [60100, 60500, 61100, 61200], 'take profit'),
+    ('short', [60000, 60200, 60950, 61300], 'stop loss'),
+    ('short', [60000, 59500, 58900, 58700], 'take profit'),
+])
+def test_cierra_en_sl_tp(servidor, side, precios, motivo):
+    urls = servidor([_mark(px) for px in precios])
+    sl, tp = (59900, 61000) if side == 'long' else (61000, 59000)
+    llamadas = []
+
+    engine, cerradas, sheets = _correr(urls, _posicion(side, sl, tp), _close_ok(llamadas))
+
+    assert llamadas == [(TICKER, motivo)]  # una sola vez aunque sigan llegando precios
+    assert cerradas == [TICKER] and sheets[0]['motivo'] == motivo
+    assert TICKER not in engine.posiciones
+
+
+def test_no_cierra_dentro_del_rango(servidor):
+    urls = servidor([_mark(px) for px in [60100, 60500, 59950, 60900]])
+    llamadas = []
+
+    engine, cerradas, _ = _correr(urls, _posicion('long', 59900, 61000), _close_ok(llamadas), espera=1)
+
+    assert llamadas == [] and cerradas == []
+    assert TICKER in engine.posiciones
+
+
+def test_cierre_sin_orden_queda_pendiente(servidor):
+    """ Si close_fn no pudo consultar la orden (None) la posicion no se informa como cerrada ni se vuelve a cerrar """
+    urls = servidor([_mark(px) for px in [60100, 59800, 59700, 59600]])
+    llamadas = []
+
+    def close_pendiente(posicion, motivo, margen, nocional, account_trade_api, list_alertas, list_sheets):
+        llamadas.append(motivo)
+        posicion['cierre_pendiente'], posicion['motivo_pendiente'] = 'c1', motivo
+        list_sheets.append({'ticker': posicion['ticker'], 'tipo': 'pendiente', 'cierre_pendiente': 'c1',
+                            'motivo_pendiente': motivo})
+        return None
+
+    engine, cerradas, sheets = _correr(urls, _posicion('long', 59900, 61000), close_pendiente, espera=1)
+
+    assert llamadas == ['stop loss']
+    assert cerradas == [] and [d['tipo'] for d in sheets] == ['pendiente']
+    assert engine.posiciones[TICKER]['cierre_pendiente'] == 'c1'
@@ -0,0 +1,139 @@
+"""
+Cache en memoria de velas confirmadas.
+
+En cada corrida del bot solo aparece una vela confirmada nueva por ticker, por lo que no tiene sentido volver a
+descargar 300 velas cada minuto. Guardamos las ultimas N velas de cada (instId, bar) y en las siguientes corridas
+pedimos a OKX solamente las velas posteriores al ultimo timestamp guardado (parametro 'before' de la paginacion).
+
+Si detectamos un hueco (por ejemplo el bot estuvo caido un rato y faltan mas velas de las que trae una consulta),
+volvemos a descargar la serie completa.
+
+Si config.ARCHIVO_VELAS no es None las velas descargadas se guardan en el archivo local (ver archivo.py) y al
+reiniciar el bot la cache arranca con las velas del archivo, descargando solo las que faltan.
+"""
+
+import pandas as pd
+
+import archivo
+import config
+from api_okx import get_historical_data_formatted
+
+# Duracion de cada timeframe de OKX en segundos
+BAR_SECONDS = {
+    '1m': 60, '3m': 180, '5m': 300, '15m': 900, '30m': 1800,
+    '1H': 3600, '2H': 7200, '4H': 14400, '6H': 21600, '12H': 43200,
+    '1D': 86400, '2D': 172800, '3D': 259200, '1W': 604800,
+    '6Hutc': 21600, '12Hutc': 43200, '1Dutc': 86400, '2Dutc': 172800, '3Dutc': 259200, '1Wutc': 604800,
+}
+
+# Las velas mensuales de OKX ('1M', '3M', '1Mutc', '3Mutc') no tienen duracion fija y no estan soportadas: la cache,
+# el archivo y el planificador calculan la vela siguiente sumando bar_seconds
+
+# Diccionario con las velas guardadas, la clave es (instId, bar)
+_cache = {}
+
+
+def bar_seconds(bar):
+    """ Devuelve la duracion en segundos de un timeframe de OKX, por ejemplo '1m' -> 60 """
+    check_bar(bar)
+    return BAR_SECONDS[bar]
+
+
+def check_bar(bar):
+    """
+    Verifica que el timeframe este soportado (ver BAR_SECONDS).
+
+    :param bar: Intervalo de tiempo, por ejemplo '1m'
+    :raise ValueError: Si el timeframe no esta soportado, por ejemplo las velas mensuales '1M'
+    """
+    if bar not in BAR_SECONDS:
+        raise ValueError(f"Timeframe {bar!r} no soportado, los timeframes validos son: {', '.join(BAR_SECONDS)}")
+
+
+def get_velas(client_md, instId, bar='1m', limit=300, limit_nuevas=100):
+    """
+    Devuelve las ultimas velas confirmadas de un instrumento, descargando solo las nuevas si ya estan en cache.
+
+    :param client_md: Instancia de MarketAPI
+    :param instId: ID del instrumento
+    :param bar: Intervalo de tiempo (por defecto '1m')
+    :param limit: Cantidad de velas a mantener en cache (por defecto 300)
+    :param limit_nuevas: Cantidad maxima de velas a pedir en la consulta incremental (maximo de OKX: 100)
+    :return: DataFrame con las velas formateadas, igual al de get_historical_data_formatted
+    """
+    key = (instId, bar)
+    df = _cache.get(key)
+
+    if (df is None or df.empty) and config.ARCHIVO_VELAS is not None:
+        df = archivo.read_last(instId, bar, limit - 1)  # arranque en caliente
+        if len(df) < limit - 1:  # el archivo no tiene suficientes velas
+            df = None
+
+    if df is None or df.empty:
+        df = get_historical_data_formatted(client_md, instId, bar=bar, limit=limit)
+        nuevas = df
+
+    else:
+        last_time = df.index[-1]
+        last_ts = int(last_time.value // 10 ** 6)  # el index esta en ns, OKX usa ms
+
+        nuevas = get_historical_data_formatted(client_md, instId, bar=bar, limit=limit_nuevas, before=str(last_ts))
+
+        if not nuevas.empty:
+            # Si la primera vela nueva no es la siguiente a la ultima guardada hay un hueco, descargo todo de nuevo
+            siguiente = last_time + pd.Timedelta(seconds=bar_seconds(bar))
+            if nuevas.index[0] != siguiente:
+                df = nuevas = get_historical_data_formatted(client_md, instId, bar=bar, limit=limit)
+            else:
+                # Una descarga completa trae limit velas de las cuales la ultima no esta confirmada, por eso mantenemos
+                # limit - 1 velas y el resultado es igual al de descargar todo de nuevo
+                df = pd.concat([df, nuevas]).iloc[-(limit - 1):]
+
+    if config.ARCHIVO_VELAS is not None:
+        archivo.write_velas(nuevas, instId, bar)
+
+    _cache[key] = df
+
+    return df
+
+
+def add_vela(instId, bar, vela, limit=300):
+    """
+    Agrega una vela confirmada a la cache (por ejemplo recibida por websocket, ver streaming.py).
+    Si la vela no es la siguiente a la ultima guardada se descarta, la proxima llamada a get_velas completara el hueco.
+
+    :param instId: ID del instrumento
+    :param bar: Intervalo de tiempo
+    :param vela: Lista con el formato de OKX [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]
+    :param limit: Cantidad de velas de la descarga completa (se guardan limit - 1)
+    :return: True si la vela se agrego
+    """
+    key = (instId, bar)
+    df = _cache.get(key)
+    if df is None or df.empty:
+        return False
+
+    ts = pd.to_datetime(int(vela[0]), unit='ms')
+    if ts != df.index[-1] + pd.Timedelta(seconds=bar_seconds(bar)):
+        return False
+
+    nueva = pd.DataFrame([[float(v) for v in vela[1:]]], columns=df.columns, index=pd.Index([ts], name=df.index.name))
+    _cache[key] = pd.concat([df, nueva]).iloc[-(limit - 1):]
+
+    if config.ARCHIVO_VELAS is not None:
+        archivo.write_velas(nueva, instId, bar)
+
+    return True
+
+
+def clear_cache(instId=None, bar=None):
+    """
+    Borra la cache de velas. Sin parametros borra todo, con instId (y opcionalmente bar) borra solo esas claves.
+    """
+    if instId is None:
+        _cache.clear()
+        return
+
+    for key in list(_cache.keys()):
+        if key[0] == instId and (bar is None or key[1] == bar):
+            del _cache[key]